@@ -1,28 +1,31 @@
-import pandas as pd
-from sqlalchemy import create_engine
 import os
-import psycopg2
+import sys
 from dotenv import load_dotenv
 
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe, copy_insert_missing, copy_returning, ensure_unique_index
+from etl_utils.excel_stream import read_excel_chunks
+from etl_utils.explode import parallel_explode
+from etl_utils.numbers import parse_numeric_columns
+from etl_utils.scheduler import StageScheduler
+from etl_utils.staging_cache import StagingCache
+from etl_utils.surrogate_keys import SurrogateKeys
+
 load_dotenv()
 
+# One pooled connection manager for the run, shared by every stage (psycopg2 and SQLAlchemy alike).
+db = ConnectionManager('Destination')
+
 # Creating the fact and dimension tables where the transformed data will be loaded to.
 # Here the connection is defined with an additional specification for the schema since here
 # the tables are not created on the default public schema.
 
-connection = None
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
 
 try:
 
-    with psycopg2.connect(
-            host='localhost',
-            dbname='Destination',
-            user=db_user,
-            password=db_password,
-            port=5432,
-            options='-c search_path=amazon') as connection:
+    with db.connection(search_path='amazon') as connection:
         # This is how to indicate the schema of interest
 
         with connection.cursor() as cursor:
@@ -75,266 +78,166 @@ try:
 except Exception as error:
     print(error)
 
-finally:
-    if connection is not None:
-        connection.close()
+# Unique indexes on the business keys of the dimension tables, so that re-running the pipeline over the
+# same workbook inserts only rows that are not loaded yet instead of duplicating every dimension row.
 
+business_keys = {
+    'amazon.dim_product': ['product_id', 'product_name'],
+    'amazon.dim_user': ['user_id', 'user_name'],
+    'amazon.dim_review': ['review_id'],
+}
 
-# Defining the function that will perform the INSERT action when called by the ETL stages.
+for table_name, key_columns in business_keys.items():
+    try:
+        with db.connection() as connection:
+
+            with connection.cursor() as cursor:
+                ensure_unique_index(cursor, table_name, key_columns)
+
+    except Exception as error:
+        print(error)
+
+
+# Staging is read once per run. Each stage declares the staging columns it needs and receives only those,
+# so the wide text columns are transferred once instead of once per stage.
+
+staging = StagingCache('stg_product_review', engine=db.engine)
+staging.declare('dim_review', ['review_id', 'review_title', 'product_id', 'product_name', 'user_id', 'user_name'])
+staging.declare('dim_user', ['user_id', 'user_name'])
+staging.declare('dim_product', ['product_id', 'product_name', 'category', 'about_product', 'img_link',
+                                'product_link', 'rating', 'rating_count'])
+staging.declare('fact_price', ['discounted_price', 'actual_price', 'discount_percentage', 'product_id', 'product_name'])
+
+# Surrogate keys generated by the dimension loads, kept in memory and looked up by business key.
+surrogate_keys = SurrogateKeys()
 
-def insert(insert_query, dataset):
-    connection = None
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
 
+# Defining the function that will perform the INSERT action when called by the ETL stages.
+# The dataframe is streamed to the table with COPY rather than row by row INSERT statements.
+# 'columns' maps dataframe columns to table columns where their names differ.
+# When 'returning' lists table columns (e.g. the generated surrogate key and the business keys),
+# the rows' values are returned as a dataframe.
+# With 'key_columns' (the table's business key) only rows not loaded yet are inserted, the others are
+# skipped, and the returned keys cover both, so a re-run leaves the table unchanged.
+
+def insert(dataset, table_name, columns=None, returning=None, key_columns=None):
     try:
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+        with db.connection() as connection:
 
             with connection.cursor() as cursor:
-                psycopg2.extras.execute_batch(cursor, insert_query, dataset)
+                if key_columns is not None:
+                    inserted, skipped, keys = copy_insert_missing(cursor, dataset, table_name, key_columns, columns,
+                                                                  returning)
+                    print(f'{inserted} rows inserted, {skipped} rows already loaded skipped for {table_name}')
+                    return keys
+                if returning is not None:
+                    return copy_returning(cursor, dataset, table_name, returning, columns)
+                copy_from_dataframe(cursor, dataset, table_name, columns)
 
     except Exception as error:
-        print(error)
+        print(f'Loading failed for {table_name}: {error}')
+        raise
 
-    finally:
-        if connection is not None:
-            connection.close()
+
+# Source columns used by the pipeline. Only these are kept while the workbook is streamed.
+source_columns = ['product_id', 'product_name', 'category', 'discounted_price', 'actual_price', 'discount_percentage',
+                  'rating', 'rating_count', 'about_product', 'user_id', 'user_name', 'review_id', 'review_title',
+                  'img_link', 'product_link']
 
 
 # Defining the function that extracts and transforms source data to staging.
 
 def extract_transform():
-    connection = None
-
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        source_table = pd.read_excel('amazon/amazon.xlsx')
-        source_table = source_table.head(5)
-        source_table = source_table.copy()
-        source_table['user_id'] = source_table['user_id'].str.split(',')
-        source_table['user_name'] = source_table['user_name'].str.split(',')
-        source_table['review_id'] = source_table['review_id'].str.split(',')
-        source_table['review_title'] = source_table['review_title'].str.split(',')
-        source_table = source_table.explode(['user_id', 'user_name', 'review_id', 'review_title'])
-        source_table.to_sql('stg_product_review', engine, index=False, if_exists='replace')
-
-        # Addition of surrogate key columns to staging.
-        db_user = os.getenv('DB_USER')
-        db_password = os.getenv('DB_PASS')
-
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+        engine = db.engine
 
-            with connection.cursor() as cursor:
-                staging_update = '''ALTER TABLE stg_product_review
-                ADD COLUMN product_key INT,
-                ADD COLUMN user_key INT,
-                ADD COLUMN review_key INT
-                '''
+        # The workbook is streamed rather than parsed whole; limit=5 stops reading after the first 5 rows
+        # (previously head(5) applied to the fully parsed file). Each chunk is transformed and appended to staging.
+        if_exists = 'replace'
 
-                cursor.execute(staging_update)
+        for source_table in read_excel_chunks('amazon/amazon.xlsx', source_columns, limit=5):
+            # The packed user/review columns are split and exploded together in one pass. Rows whose columns hold
+            # different numbers of values cannot be paired up reliably and are set aside instead of failing the load.
+            source_table, rejects = parallel_explode(source_table, ['user_id', 'user_name', 'review_id', 'review_title'])
+            if not rejects.empty:
+                print(f'{len(rejects)} source rows rejected: packed user/review columns have different lengths')
+            source_table.to_sql('stg_product_review', engine, index=False, if_exists=if_exists)
+            if_exists = 'append'
 
-                return print('Extraction to staging completed')
+        return print('Extraction to staging completed')
 
     except Exception as error:
         print(error)
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 
 # Defining the function that loads the transformed data to the dimension tables.
+# Each load returns the generated surrogate keys with their business keys, so dim_review receives
+# its product_key and user_key at insert time.
 
 def load_dim_product():
-    engine = create_engine('postgresql:///Destination')
-
-    dp = pd.read_sql('stg_product_review', engine)
-    product = dp[['product_id', 'product_name', 'category', 'about_product', 'img_link', 'product_link',
-                  'rating', 'rating_count']].copy()
+    product = staging.read('dim_product')
     product['rating_count'] = product['rating_count'].fillna(1)
     product = product.drop_duplicates(subset=['product_id', 'product_name'], keep='first')
     # It is best practice to deduplicate dim tables using business keys alone.
-    product = product.to_dict('records')
-
-    insert_query = '''INSERT into amazon.dim_product (
-    product_id,
-    product_name,
-    category,
-    about_product,
-    img_link,
-    product_link,
-    rating,
-    rating_count
-    ) 
-    VALUES (
-    %(product_id)s,
-    %(product_name)s,
-    %(category)s,
-    %(about_product)s,
-    %(img_link)s,
-    %(product_link)s,
-    %(rating)s,
-    %(rating_count)s
-    )'''
-
-    insert(insert_query, product)
+
+    keys = insert(product, 'amazon.dim_product', returning=['product_key', 'product_id', 'product_name'],
+                  key_columns=business_keys['amazon.dim_product'])
+    surrogate_keys.register('product', keys, 'product_key', {'product_id': 'product_id',
+                                                             'product_name': 'product_name'})
     return print('dim_product loaded successfully')
 
 
 def load_dim_user():
-    engine = create_engine('postgresql:///Destination')
-
-    du = pd.read_sql('stg_product_review', engine)
-    user = du[['user_id', 'user_name']].copy()
+    user = staging.read('dim_user')
     user = user.drop_duplicates()
-    user = user.to_dict('records')
-
-    insert_query = '''INSERT into amazon.dim_user (
-    user_id,
-    user_name
-    ) 
-    VALUES (
-    %(user_id)s,
-    %(user_name)s
-    )'''
-
-    insert(insert_query, user)
+
+    keys = insert(user, 'amazon.dim_user', returning=['user_key', 'user_id', 'user_name'],
+                  key_columns=business_keys['amazon.dim_user'])
+    surrogate_keys.register('user', keys, 'user_key', {'user_id': 'user_id', 'user_name': 'user_name'})
     return print('dim_user loaded successfully')
 
 
 def load_dim_review():
-    engine = create_engine('postgresql:///Destination')
-
-    drr = pd.read_sql('stg_product_review', engine)
-    review = drr[['review_id', 'review_title']].copy()
+    review = staging.read('dim_review')
+    review = surrogate_keys.attach(review, 'product')
+    review = surrogate_keys.attach(review, 'user')
     review = review.rename(columns={'review_title': 'review_content'})
     review = review.drop_duplicates(subset=['review_id'], keep='first')
-    review = review.to_dict('records')
-
-    insert_query = '''INSERT into amazon.dim_review (
-    review_id,
-    review_content
-    )
-    VALUES (
-    %(review_id)s,
-    %(review_content)s
-    )'''
-
-    insert(insert_query, review)
-    return print('dim_review loaded successfully')
-
 
-# Defining the function that fetches and loads surrogate keys to their respective target tables.
-
-def load_surrogate_keys():
-    connection = None
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
-
-    try:
-
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
-
-            with connection.cursor() as cursor:
-                # Loading surrogate keys from dimension tables to staging.
-
-                product_key = '''UPDATE stg_product_review AS s SET product_key = p.product_key 
-                FROM amazon.dim_product AS p WHERE s.product_id = p.product_id AND
-                s.product_name = p.product_name'''
-                cursor.execute(product_key)
-
-                user_key = '''UPDATE stg_product_review AS s SET user_key = u.user_key 
-                FROM amazon.dim_user AS u WHERE s.user_id = u.user_id AND
-                s.user_name = u.user_name'''
-                cursor.execute(user_key)
-
-                review_key = '''UPDATE stg_product_review AS s SET review_key = r.review_key 
-                FROM amazon.dim_review AS r WHERE s.review_id = r.review_id AND
-                s.review_title = r.review_content'''
-                cursor.execute(review_key)
-
-                # Loading dim_product table's surrogate keys from staging to dim_review.
-
-                load_prod_review = '''UPDATE amazon.dim_review r SET product_key = sa.product_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_prod_review)
-
-                # Loading dim_user table's surrogate keys from staging to dim_review.
-
-                load_user_review = '''UPDATE amazon.dim_review r SET user_key = sa.user_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_user_review)
-
-                return print('All target tables updated with surrogate keys successfully')
-
-    except Exception as error:
-        print(error)
-
-    finally:
-        if connection is not None:
-            connection.close()
+    insert(review, 'amazon.dim_review', ['review_id', 'review_content', 'user_key', 'product_key'],
+           key_columns=business_keys['amazon.dim_review'])
+    return print('dim_review loaded successfully')
 
 
 # Finally, defining the function that transforms and loads data from staging to the fact table together with
 # all surrogate keys.
 
 def transform_load_fact_table():
-    engine = create_engine('postgresql:///Destination')
-
-    dg = pd.read_sql('stg_product_review', engine)
-    fact = dg[['discounted_price', 'actual_price', 'discount_percentage',
-               'product_key']].copy()
-
-    fact['discounted_price'] = fact['discounted_price'].str.replace('₹', '')
-    fact['discounted_price'] = fact['discounted_price'].str.replace(',', '').astype(float)
-    fact['actual_price'] = fact['actual_price'].str.replace('₹', '')
-    fact['actual_price'] = fact['actual_price'].str.replace(',', '').astype(float)
+    fact = staging.read('fact_price')
+    fact = surrogate_keys.attach(fact, 'product')
+
+    # Prices such as '₹1,099' are parsed in one pass; cells that hold no readable number are reported
+    # and loaded as nulls instead of aborting the load.
+    fact, rejects = parse_numeric_columns(fact, ['discounted_price', 'actual_price'])
+    if not rejects.empty:
+        print(f'{len(rejects)} rows with unparseable prices loaded with null prices')
     fact = fact.drop_duplicates(subset=['product_key'], keep='first')
-    fact = fact.to_dict('records')
-
-    insert_query = '''INSERT into amazon.fact_price (
-    "actual_price (PLN)",
-    "discounted_price (PLN)",
-    discount_percentage,
-    product_key
-    ) 
-    VALUES (
-    %(actual_price)s,
-    %(discounted_price)s,
-    %(discount_percentage)s,
-    %(product_key)s
-    )'''
-
-    insert(insert_query, fact)
-    return print('fact_table loaded successfully')
-
 
-extract_transform()
-
-load_dim_review()
-
-load_dim_user()
+    insert(fact, 'amazon.fact_price', {'actual_price': 'actual_price (PLN)',
+                                       'discounted_price': 'discounted_price (PLN)',
+                                       'discount_percentage': 'discount_percentage',
+                                       'product_key': 'product_key'})
+    return print('fact_table loaded successfully')
 
-load_dim_product()
 
-load_surrogate_keys()
+# The stages run through a scheduler that knows their dependencies, so independent stages
+# run concurrently on a bounded thread pool, each with its own pooled connection.
+scheduler = StageScheduler(max_workers=4)
+scheduler.add(extract_transform)
+scheduler.add(load_dim_product, after=[extract_transform])
+scheduler.add(load_dim_user, after=[extract_transform])
+scheduler.add(load_dim_review, after=[load_dim_product, load_dim_user])
+scheduler.add(transform_load_fact_table, after=[load_dim_product])
+scheduler.run()
 
-transform_load_fact_table()
\ No newline at end of file
+print(db.report())
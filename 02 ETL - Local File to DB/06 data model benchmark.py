@@ -0,0 +1,333 @@
+import argparse
+import os
+import sys
+import zlib
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import sql
+
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe
+
+load_dotenv()
+
+# Benchmark of the two data models built in this folder:
+#   initial  - 04 amazon product review.py: reviews link to products only, and products link to users through
+#              the product_user_join table.
+#   improved - 05 amazon product review (optimized).py: every review carries its user_key and product_key.
+# Both models are loaded with the same synthetic data at each requested size (number of reviews), using the
+# tables exactly as the pipelines create them. For every model and size the script records the load time,
+# the storage size, and the p50/p95 latency of the "products with reviews and reviewers" report plus a few
+# typical star-join queries. Each query run picks new random parameters, so runs are not all served by the
+# same cached pages.
+#
+# Usage: python "06 data model benchmark.py" [reviews ...] [--runs N] [--output file.csv] [--keep]
+# e.g.   python "06 data model benchmark.py" 10000 1000000 10000000 --runs 20
+#
+# The report row counts are recorded too: in the initial model the report can only pair every review of a
+# product with every user of that product, so it returns reviews x reviewers rows instead of one row per review.
+
+db = ConnectionManager('Destination')
+
+DIM_PRODUCT = '''
+CREATE TABLE dim_product (
+product_key SERIAL PRIMARY KEY,
+product_id TEXT,
+product_name TEXT,
+category TEXT,
+about_product TEXT,
+img_link TEXT,
+product_link TEXT,
+rating TEXT,
+rating_count TEXT
+)'''
+
+DIM_USER = '''
+CREATE TABLE dim_user (
+user_key SERIAL PRIMARY KEY,
+user_id TEXT,
+user_name TEXT
+)'''
+
+FACT_PRICE = '''
+CREATE TABLE fact_price (
+price_key SERIAL PRIMARY KEY,
+"actual_price (PLN)" FLOAT,
+"discounted_price (PLN)" FLOAT,
+discount_percentage TEXT,
+product_key INT REFERENCES dim_product (product_key)
+)'''
+
+MODELS = {
+    'initial': {
+        'tables': [DIM_PRODUCT, DIM_USER, '''
+            CREATE TABLE dim_review (
+            review_key SERIAL PRIMARY KEY,
+            review_id TEXT,
+            review_content TEXT,
+            product_key INT REFERENCES dim_product (product_key)
+            )''', '''
+            CREATE TABLE product_user_join (
+            product_key INT REFERENCES dim_product (product_key),
+            user_key INT REFERENCES dim_user (user_key),
+            PRIMARY KEY (product_key, user_key)
+            )''', FACT_PRICE],
+        'review_columns': ['review_key', 'review_id', 'review_content', 'product_key'],
+        'queries': {
+            'report: reviews and reviewers of a product': '''
+                SELECT p.product_name, r.review_content, u.user_name
+                FROM dim_product p
+                JOIN dim_review r ON r.product_key = p.product_key
+                JOIN product_user_join j ON j.product_key = p.product_key
+                JOIN dim_user u ON u.user_key = j.user_key
+                WHERE p.product_key = %(product_key)s''',
+            'products and prices of a user': '''
+                SELECT p.product_name, f."discounted_price (PLN)"
+                FROM product_user_join j
+                JOIN dim_product p ON p.product_key = j.product_key
+                JOIN fact_price f ON f.product_key = p.product_key
+                WHERE j.user_key = %(user_key)s''',
+            'reviewers per category': '''
+                SELECT p.category, COUNT(DISTINCT j.user_key)
+                FROM product_user_join j
+                JOIN dim_product p ON p.product_key = j.product_key
+                GROUP BY p.category''',
+        },
+    },
+    'improved': {
+        'tables': [DIM_PRODUCT, DIM_USER, '''
+            CREATE TABLE dim_review (
+            review_key SERIAL PRIMARY KEY,
+            review_id TEXT,
+            review_content TEXT,
+            user_key INT REFERENCES dim_user (user_key),
+            product_key INT REFERENCES dim_product (product_key)
+            )''', FACT_PRICE],
+        'review_columns': ['review_key', 'review_id', 'review_content', 'user_key', 'product_key'],
+        'queries': {
+            'report: reviews and reviewers of a product': '''
+                SELECT p.product_name, r.review_content, u.user_name
+                FROM dim_product p
+                JOIN dim_review r ON r.product_key = p.product_key
+                JOIN dim_user u ON u.user_key = r.user_key
+                WHERE p.product_key = %(product_key)s''',
+            'products and prices of a user': '''
+                SELECT p.product_name, f."discounted_price (PLN)"
+                FROM dim_review r
+                JOIN dim_product p ON p.product_key = r.product_key
+                JOIN fact_price f ON f.product_key = p.product_key
+                WHERE r.user_key = %(user_key)s''',
+            'reviewers per category': '''
+                SELECT p.category, COUNT(DISTINCT r.user_key)
+                FROM dim_review r
+                JOIN dim_product p ON p.product_key = r.product_key
+                GROUP BY p.category''',
+        },
+    },
+}
+
+# Star-join queries that read the same tables in both models.
+SHARED_QUERIES = {
+    'average price per category': '''
+        SELECT p.category, COUNT(*), AVG(f."discounted_price (PLN)")
+        FROM fact_price f
+        JOIN dim_product p ON p.product_key = f.product_key
+        GROUP BY p.category''',
+    'most reviewed products': '''
+        SELECT p.product_name, COUNT(*)
+        FROM dim_review r
+        JOIN dim_product p ON p.product_key = r.product_key
+        GROUP BY p.product_name
+        ORDER BY 2 DESC
+        LIMIT 10''',
+}
+
+CATEGORIES = 20
+REVIEW_BATCH = 1000000
+
+
+def generate(reviews, seed=42):
+    # Synthetic source data shaped like the amazon workbook: about 10 reviews per product and 4 per user.
+    # The review rows themselves are built batch by batch at load time; only their keys are held here.
+    rng = np.random.default_rng(seed)
+    products = max(reviews // 10, 10)
+    users = max(reviews // 4, 10)
+
+    product_keys = np.arange(1, products + 1)
+    ids = pd.Series(product_keys).astype(str)
+    dim_product = pd.DataFrame({
+        'product_key': product_keys,
+        'product_id': 'B0' + ids.str.zfill(8),
+        'product_name': 'Product ' + ids,
+        'category': 'Category|Subcategory ' + pd.Series(rng.integers(0, CATEGORIES, products)).astype(str),
+        'about_product': 'About product ' + ids,
+        'img_link': 'https://m.media-amazon.com/images/' + ids + '.jpg',
+        'product_link': 'https://www.amazon.in/dp/' + ids,
+        'rating': pd.Series(rng.integers(30, 50, products) / 10).astype(str),
+        'rating_count': pd.Series(rng.integers(1, 100000, products)).astype(str),
+    })
+
+    actual_price = rng.integers(100, 100000, products).astype(float)
+    discount = rng.integers(0, 90, products)
+    fact_price = pd.DataFrame({
+        'price_key': product_keys,
+        'actual_price (PLN)': actual_price,
+        'discounted_price (PLN)': np.round(actual_price * (100 - discount) / 100),
+        'discount_percentage': pd.Series(discount).astype(str) + '%',
+        'product_key': product_keys,
+    })
+
+    user_keys = np.arange(1, users + 1)
+    dim_user = pd.DataFrame({
+        'user_key': user_keys,
+        'user_id': 'AG' + pd.Series(user_keys).astype(str).str.zfill(10),
+        'user_name': 'User ' + pd.Series(user_keys).astype(str),
+    })
+
+    review_products = rng.integers(1, products + 1, reviews)
+    review_users = rng.integers(1, users + 1, reviews)
+
+    # The join table of the initial model holds every distinct product/user pair that occurs in the reviews.
+    pairs = np.unique(review_products.astype(np.int64) * (users + 1) + review_users)
+    product_user_join = pd.DataFrame({'product_key': pairs // (users + 1), 'user_key': pairs % (users + 1)})
+
+    return {'dim_product': dim_product, 'dim_user': dim_user, 'fact_price': fact_price,
+            'product_user_join': product_user_join, 'review_products': review_products,
+            'review_users': review_users, 'products': products, 'users': users}
+
+
+def review_batches(data):
+    total = len(data['review_products'])
+    for start in range(0, total, REVIEW_BATCH):
+        stop = min(start + REVIEW_BATCH, total)
+        ids = pd.Series(np.arange(start + 1, stop + 1)).astype(str)
+        yield pd.DataFrame({
+            'review_key': np.arange(start + 1, stop + 1),
+            'review_id': 'R' + ids.str.zfill(12),
+            'review_content': 'Review ' + ids + ': works as expected, good value for the price',
+            'user_key': data['review_users'][start:stop],
+            'product_key': data['review_products'][start:stop],
+        })
+
+
+def schema_name(model):
+    return f'benchmark_{model}'
+
+
+def load_model(model, data):
+    # Creates the model's tables in a fresh schema and loads them with COPY. Returns the load time in seconds.
+    schema = schema_name(model)
+    definition = MODELS[model]
+
+    with db.cursor() as cursor:
+        cursor.execute(sql.SQL('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}').format(sql.Identifier(schema)))
+
+    t1 = perf_counter()
+    with db.cursor(search_path=schema) as cursor:
+        for table in definition['tables']:
+            cursor.execute(table)
+
+        copy_from_dataframe(cursor, data['dim_product'], 'dim_product', copy_format='binary')
+        copy_from_dataframe(cursor, data['dim_user'], 'dim_user', copy_format='binary')
+        copy_from_dataframe(cursor, data['fact_price'], 'fact_price', copy_format='binary')
+        for batch in review_batches(data):
+            copy_from_dataframe(cursor, batch, 'dim_review', definition['review_columns'], copy_format='binary')
+        if model == 'initial':
+            copy_from_dataframe(cursor, data['product_user_join'], 'product_user_join', copy_format='binary')
+
+    # Statistics are part of the load: without them the planner's choices would not reflect the data.
+    with db.cursor() as cursor:
+        cursor.execute('SELECT tablename FROM pg_tables WHERE schemaname = %s', (schema,))
+        for (table,) in cursor.fetchall():
+            cursor.execute(sql.SQL('ANALYZE {}').format(sql.Identifier(schema, table)))
+    return perf_counter() - t1
+
+
+def storage_size(model):
+    # Tables, indexes and TOAST of the model, in MB.
+    with db.cursor() as cursor:
+        cursor.execute('''
+            SELECT COALESCE(SUM(pg_total_relation_size(format('%%I.%%I', schemaname, tablename)::regclass)), 0)
+            FROM pg_tables WHERE schemaname = %s''', (schema_name(model),))
+        return cursor.fetchone()[0] / 1024 / 1024
+
+
+def time_query(model, query, data, runs, timeout_seconds, rng):
+    # Runs the query once to warm up and then 'runs' times with random parameters.
+    # Returns (latencies in ms, rows returned by the last run), or (None, None) on timeout.
+    latencies = []
+    rows = None
+    try:
+        with db.cursor(search_path=schema_name(model)) as cursor:
+            cursor.execute('SELECT set_config(%s, %s, true)', ('statement_timeout', f'{timeout_seconds * 1000}'))
+            for run in range(runs + 1):
+                parameters = {'product_key': int(rng.integers(1, data['products'] + 1)),
+                              'user_key': int(rng.integers(1, data['users'] + 1))}
+                t1 = perf_counter()
+                cursor.execute(query, parameters)
+                rows = len(cursor.fetchall())
+                if run > 0:
+                    latencies.append((perf_counter() - t1) * 1000)
+    except psycopg2.errors.QueryCanceled:
+        return None, None
+    return latencies, rows
+
+
+def benchmark(sizes, runs, timeout_seconds, keep):
+    results = []
+    for reviews in sizes:
+        data = generate(reviews)
+        print(f'{reviews} reviews: {data["products"]} products, {data["users"]} users, '
+              f'{len(data["product_user_join"])} product/user pairs')
+
+        for model in MODELS:
+            load_seconds = load_model(model, data)
+            storage_mb = storage_size(model)
+            print(f'  {model}: loaded in {load_seconds:.2f}s, {storage_mb:.1f} MB')
+
+            queries = dict(MODELS[model]['queries'], **SHARED_QUERIES)
+            for name, query in queries.items():
+                # Both models get the same parameter sequence for the same query.
+                rng = np.random.default_rng([reviews, zlib.crc32(name.encode())])
+                latencies, rows = time_query(model, query, data, runs, timeout_seconds, rng)
+                result = {'reviews': reviews, 'model': model, 'load_s': round(load_seconds, 3),
+                          'storage_mb': round(storage_mb, 1), 'query': name, 'rows': rows,
+                          'p50_ms': None, 'p95_ms': None}
+                if latencies is None:
+                    print(f'    {name}: timed out after {timeout_seconds}s')
+                else:
+                    result['p50_ms'] = round(float(np.percentile(latencies, 50)), 2)
+                    result['p95_ms'] = round(float(np.percentile(latencies, 95)), 2)
+                results.append(result)
+
+            if not keep:
+                with db.cursor() as cursor:
+                    cursor.execute(sql.SQL('DROP SCHEMA {} CASCADE').format(sql.Identifier(schema_name(model))))
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare load time, storage and query latency of the two amazon data models.')
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 1000000, 10000000], help='numbers of reviews')
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per query')
+    parser.add_argument('--timeout', type=int, default=300, help='per-query timeout in seconds')
+    parser.add_argument('--output', default='data_model_benchmark.csv', help='CSV file for the results')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark schemas after the run')
+    arguments = parser.parse_args()
+
+    try:
+        results = benchmark(arguments.sizes, arguments.runs, arguments.timeout, arguments.keep)
+        results.to_csv(arguments.output, index=False)
+        print(results.to_string(index=False))
+        print(f'Results saved to {arguments.output}')
+    except Exception as error:
+        print(error)
+    finally:
+        db.close()
@@ -1,42 +1,28 @@
-import pandas as pd
-from sqlalchemy import create_engine
-import psycopg2
 import os
+import sys
 from dotenv import load_dotenv
 
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.coercion import coerce_columns
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe, copy_insert_missing, copy_returning, ensure_unique_index
+from etl_utils.db_stream import stream_table
+from etl_utils.explode import split_to_rows, stack_columns
+from etl_utils.scheduler import StageScheduler
+from etl_utils.staging_cache import StagingCache
+from etl_utils.surrogate_keys import SurrogateKeys
+
 load_dotenv()
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
+
+# One pooled connection manager per database, shared by every stage of the run.
+source_db = ConnectionManager('Source')
+db = ConnectionManager('Destination')
 
 # Extract to staging
 
 def extract_transform():
-    connection = None
-
     try:
-        engine = create_engine('postgresql:///Source')
-
-        source_table = pd.read_sql('movies', engine)
-
-        # Remove comma-separated values
-        source_table['Genre'] = source_table['Genre'].str.split(',')
-        source_table = source_table.explode('Genre')
-        # It good practice to strip the exploded column, this removes whitespaces that can create fake duplicates.
-        # For example 'Drama' and ' Drama' won't be detected as duplicates and will cause issues later in the pipeline.
-        source_table['Genre'] = source_table['Genre'].str.strip()
-
-        # Address multiple columns of the same attribute
-        source_table = pd.melt(source_table,
-                     id_vars=['Poster_Link', 'Series_Title', 'Released_Year', 'Certificate',
-                              'Runtime', 'Genre', 'IMDB_Rating', 'Overview', 'Meta_score', 'Director', 'No_of_Votes',
-                              'Gross'],
-                     value_vars=['Star1', 'Star2', 'Star3', 'Star4'],
-                     var_name='Actor',
-                     value_name='Actor_Name').sort_values('Series_Title', ascending=True)
-
-        # Remove the unnecessary Actor column
-        source_table.drop(columns='Actor', inplace=True)
-
         schema = {
             'Poster_Link': 'string',
             'Series_Title': 'string',
@@ -49,80 +35,65 @@ def extract_transform():
             'Meta_score': 'float',
             'Director': 'string',
             'No_of_Votes': 'Int64',
-            'Gross': 'Int64'
+            'Gross': 'Int64',
+            'Star1': 'string',
+            'Star2': 'string',
+            'Star3': 'string',
+            'Star4': 'string'
         }
-
-        # The Gross column is currently saved as a string data type, since we intend to convert it to
-        # an integer any commas must first be removed, otherwise it will throw an error.
-        source_table['Gross'] = source_table['Gross'].str.replace(',', '')
-
-        for col, dtype in schema.items():
-            if dtype == 'Int64':
-                source_table[col] = pd.to_numeric(source_table[col], errors="coerce").astype('Int64')
-            elif dtype == 'float':
-                source_table[col] = pd.to_numeric(source_table[col], errors="coerce")
-            elif dtype == 'datetime':
-                source_table[col] = pd.to_datetime(source_table[col], errors="coerce")
-
-        # Group columns by dtype
-        str_cols = source_table.select_dtypes(include='object').columns
-        num_cols = source_table.select_dtypes(include='number').columns
-        bool_cols = source_table.select_dtypes(include='bool').columns
-
-        # Apply default fills for the data type groups
-        source_table[num_cols] = source_table[num_cols].fillna(0)
-        source_table[str_cols] = source_table[str_cols].fillna('NA')
-        source_table[bool_cols] = source_table[bool_cols].fillna(False)
-
-        # Remove any duplicated rows
-        source_table = source_table.drop_duplicates()
-
-        # For every record where it shows NaN, NaT, replace with None. This ensures that
-        # the missing data can be loaded to a database where they will be represented as 'Nulls.'
-        source_table = source_table.where(pd.notna(source_table), None)
-
-        engine2 = create_engine('postgresql:///Destination')
-
-        source_table.to_sql('stg_movies', engine2, index=False, if_exists='replace')
-
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
-
-            with connection.cursor() as cursor:
-                staging_update = '''
-                ALTER TABLE stg_movies
-                ADD COLUMN movie_key INT,
-                ADD COLUMN actor_key INT,
-                ADD COLUMN director_key INT
-                '''
-
-                cursor.execute(staging_update)
+        movie_key_columns = ['Series_Title', 'Released_Year']
+        failures = {}
+        staged = {'stg_movies': 0, 'stg_movie_genre': 0, 'stg_movie_actor': 0}
+
+        # The source table is streamed in batches through a server-side cursor, reading only the columns of the
+        # schema, already sorted by title. Each batch is transformed and written to staging while the next
+        # one is being fetched, so the whole table is never held in memory.
+        for batch_number, source_table in enumerate(stream_table(source_db, 'movies', columns=list(schema),
+                                                                 order_by=['Series_Title'])):
+
+            # Every column is converted to its schema type in one pass (numbers such as Gross '28,341,469' are
+            # read with their thousands separators). Nulls and values that cannot be converted get the default
+            # fill of their type (0, 'NA', False); the number of such values per column is logged below.
+            source_table, batch_failures = coerce_columns(source_table, schema)
+            for column, count in batch_failures.items():
+                failures[column] = failures.get(column, 0) + count
+
+            # The comma-separated genres and the Star1..Star4 columns are expanded into separate frames, one per
+            # relationship, instead of exploding and melting the same frame (genres x 4 rows per movie).
+            # Each frame only carries the movie's business key (Series_Title, Released_Year) next to its values.
+            movies = source_table.drop(columns=['Genre', 'Star1', 'Star2', 'Star3', 'Star4']).drop_duplicates()
+
+            # It good practice to strip the exploded column, this removes whitespaces that can create fake duplicates.
+            # For example 'Drama' and ' Drama' won't be detected as duplicates and will cause issues later in the pipeline.
+            movie_genre = split_to_rows(source_table, movie_key_columns, 'Genre', ',', strip=True).drop_duplicates()
+
+            # The director is carried along with the actors for the director_actor bridge.
+            movie_actor = stack_columns(source_table, movie_key_columns + ['Director'],
+                                        ['Star1', 'Star2', 'Star3', 'Star4'], 'Actor_Name').drop_duplicates()
+
+            # Each staging table is (re)created from the column types of the first batch and filled with COPY.
+            # Any remaining nulls (e.g. dates, or columns loaded with keep_nulls) are written as SQL NULL here.
+            for table_name, dataset in [('stg_movies', movies), ('stg_movie_genre', movie_genre),
+                                        ('stg_movie_actor', movie_actor)]:
+                if batch_number == 0:
+                    dataset.head(0).to_sql(table_name, db.engine, index=False, if_exists='replace')
+                with db.cursor() as cursor:
+                    staged[table_name] += copy_from_dataframe(cursor, dataset, table_name)
+
+        for column, count in failures.items():
+            print(f'{count} {column} values could not be converted to {schema[column]} and were filled with defaults')
+        for table_name, rows in staged.items():
+            print(f'{rows} rows staged in {table_name}')
 
         return print('Extraction to staging completed')
 
     except Exception as error:
         print(error)
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 # Create the database tables
 
-connection = None
-
 try:
-    with psycopg2.connect(
-            host='localhost',
-            dbname='Destination',
-            user=db_user,
-            password=db_password,
-            port=5432,
-            options='-c search_path=movies') as connection:
+    with db.connection(search_path='movies') as connection:
 
         with connection.cursor() as cursor:
 
@@ -207,39 +178,88 @@ try:
 except Exception as error:
     print(error)
 
-finally:
-    if connection is not None:
-        connection.close()
+# Unique indexes on the business keys of the dimension tables and on the key pairs of the join tables,
+# so that re-running the pipeline over the same source inserts only rows that are not loaded yet.
 
+business_keys = {
+    'dim_director': ['director'],
+    'dim_actor': ['actor_name'],
+    'dim_movie': ['series_title', 'released_year'],
+    'dim_genre': ['genre'],
+    'director_actor': ['director_key', 'actor_key'],
+    'actor_movie': ['actor_key', 'movie_key'],
+    'genre_movie': ['genre_key', 'movie_key'],
+}
 
-# Defining the function that will perform the INSERT action when called by the ETL stages.
+for table_name, key_columns in business_keys.items():
+    try:
+        with db.connection(search_path='movies') as connection:
+
+            with connection.cursor() as cursor:
+                ensure_unique_index(cursor, table_name, key_columns)
+
+    except Exception as error:
+        print(f'Unique index failed for {table_name}: {error}')
 
-def insert(insert_query, dataset, table_name):
-    connection = None
+
+# Defining the function that will perform the INSERT action when called by the ETL stages.
+# The dataframe is streamed to the table with COPY rather than row by row INSERT statements.
+# Dataframe columns are matched to the (lower case) table columns by name.
+# When 'returning' lists table columns (e.g. the generated surrogate key and the business keys),
+# the rows' values are returned as a dataframe.
+# Tables listed in business_keys are loaded idempotently: only rows not loaded yet are inserted, the
+# others are skipped, and the returned keys cover both.
+# A failed load is reported and re-raised, so the calling stage fails instead of registering missing keys.
+
+def insert(dataset, table_name, columns=None, returning=None):
     loaded_rows = 0
 
     try:
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432,
-                options='-c search_path=movies'
-                ) as connection:
+        with db.connection(search_path='movies') as connection:
 
             with connection.cursor() as cursor:
 
-                psycopg2.extras.execute_batch(cursor, insert_query, dataset)
+                keys = None
+                if table_name in business_keys:
+                    inserted, skipped, keys = copy_insert_missing(cursor, dataset, table_name,
+                                                                  business_keys[table_name], columns, returning)
+                    print(f'{inserted} rows inserted, {skipped} rows already loaded skipped for {table_name}')
+                    return keys
+                if returning is not None:
+                    keys = copy_returning(cursor, dataset, table_name, returning, columns)
+                else:
+                    copy_from_dataframe(cursor, dataset, table_name, columns)
                 print(f'Rows {loaded_rows} to {len(dataset)} loaded successfully for {table_name}')
                 loaded_rows += len(dataset)
 
+                return keys
+
     except Exception as error:
         print(f'Loading failed for {table_name}: {error}')
+        raise
+
+
+# Staging is read once per run. Each stage declares the staging columns it needs and receives only those,
+# so the wide text columns (e.g. Overview) are transferred once instead of once per stage.
+# Movies, their genres and their actors are staged in separate tables (see extract_transform()).
+
+staging = StagingCache('stg_movies', engine=db.engine)
+staging.declare('dim_director', ['Director'])
+staging.declare('dim_movie', ['Series_Title', 'Released_Year', 'Runtime', 'Overview',
+                              'Meta_score', 'IMDB_Rating', 'Certificate', 'Poster_Link', 'Director'])
+staging.declare('fact_gross', ['Gross', 'No_of_Votes', 'Series_Title', 'Released_Year', 'Director'])
+
+genre_staging = StagingCache('stg_movie_genre', engine=db.engine)
+genre_staging.declare('dim_genre', ['Genre'])
+genre_staging.declare('bridges', ['Series_Title', 'Released_Year', 'Genre'])
 
-    finally:
-        if connection is not None:
-            connection.close()
+actor_staging = StagingCache('stg_movie_actor', engine=db.engine)
+actor_staging.declare('dim_actor', ['Actor_Name'])
+actor_staging.declare('bridges', ['Series_Title', 'Released_Year', 'Director', 'Actor_Name'])
+actor_staging.declare('fact_gross', ['Series_Title', 'Released_Year', 'Actor_Name'])
+
+# Surrogate keys generated by the dimension loads, kept in memory and looked up by business key.
+surrogate_keys = SurrogateKeys()
 
 
 # Loading data to respective tables
@@ -248,23 +268,11 @@ def load_dim_director():
     table_name = 'dim_director'
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        dd = pd.read_sql('stg_movies', engine)
-
-        directors = dd[['Director']]
+        directors = staging.read(table_name)
         directors = directors.drop_duplicates()
-        directors = directors.to_dict('records')
-
-        insert_query = '''
-        INSERT INTO dim_director (
-        Director
-        )
-        VALUES (
-        %(Director)s
-        )'''
 
-        insert(insert_query, directors, table_name)
+        keys = insert(directors, table_name, returning=['director_key', 'director'])
+        surrogate_keys.register('director', keys, 'director_key', {'Director': 'director'})
 
     except Exception as error:
         print(error)
@@ -274,23 +282,11 @@ def load_dim_actor():
     table_name = 'dim_actor'
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        da = pd.read_sql('stg_movies', engine)
-
-        actors = da[['Actor_Name']]
+        actors = actor_staging.read(table_name)
         actors = actors.drop_duplicates()
-        actors = actors.to_dict('records')
-
-        insert_query = '''
-        INSERT INTO dim_actor (
-        Actor_Name
-        )
-        VALUES (
-        %(Actor_Name)s
-        )'''
 
-        insert(insert_query, actors, table_name)
+        keys = insert(actors, table_name, returning=['actor_key', 'actor_name'])
+        surrogate_keys.register('actor', keys, 'actor_key', {'Actor_Name': 'actor_name'})
 
     except Exception as error:
         print(error)
@@ -300,38 +296,15 @@ def load_dim_movies():
     table_name = 'dim_movie'
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        dm = pd.read_sql('stg_movies', engine)
-        movies = dm[['Series_Title', 'Released_Year', 'Runtime', 'Overview',
-                     'Meta_score', 'IMDB_Rating', 'Certificate', 'Poster_Link']]
+        # The director's key is looked up from the dim_director load and written with the movie itself.
+        movies = staging.read(table_name)
+        movies = surrogate_keys.attach(movies, 'director')
+        movies = movies.drop(columns='Director')
         movies = movies.drop_duplicates(subset=['Series_Title', 'Released_Year'], keep='first')
-        movies = movies.to_dict('records')
-
-        insert_query = '''
-        INSERT INTO dim_movie ( 
-        Series_Title, 
-        Released_Year, 
-        Runtime,
-        Overview,
-        Meta_score,
-        IMDB_Rating,
-        Certificate,
-        Poster_Link
-        )
-        VALUES (
-        %(Series_Title)s, 
-        %(Released_Year)s,
-        %(Runtime)s,
-        %(Overview)s, 
-        %(Meta_score)s,
-        %(IMDB_Rating)s,
-        %(Certificate)s,
-        %(Poster_Link)s 
-        )
-        '''
-
-        insert(insert_query, movies, table_name)
+
+        keys = insert(movies, table_name, returning=['movie_key', 'series_title', 'released_year'])
+        surrogate_keys.register('movie', keys, 'movie_key', {'Series_Title': 'series_title',
+                                                             'Released_Year': 'released_year'})
 
     except Exception as error:
         print(error)
@@ -341,156 +314,73 @@ def load_dim_genre():
     table_name = 'dim_genre'
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        dg = pd.read_sql('stg_movies', engine)
-
-        # genre = dg[['Genre']].copy()
-        # genre['Genre'] = genre['Genre'].str.strip()
-        genre = dg[['Genre']]
+        genre = genre_staging.read(table_name)
         genre = genre.drop_duplicates()
-        genre = genre.to_dict('records')
 
-        insert_query = '''
-        INSERT INTO dim_genre (
-        Genre
-        )
-        VALUES (
-        %(Genre)s
-        )'''
-
-        insert(insert_query, genre, table_name)
+        keys = insert(genre, table_name, returning=['genre_key', 'genre'])
+        surrogate_keys.register('genre', keys, 'genre_key', {'Genre': 'genre'})
 
     except Exception as error:
         print(error)
 
-# Loading surrogate keys from dimension tables to staging.
-
-def load_surrogate_keys():
-    connection = None
+# Loading the join tables. The surrogate keys are looked up in memory from the dimension loads
+# instead of being written back to staging first.
 
+def load_bridge_tables():
     try:
 
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+        # Each bridge is built from its own staging table, so it only holds as many rows as there are
+        # actor (or genre) entries of the movies.
+        actors = actor_staging.read('bridges')
+        actors = surrogate_keys.attach(actors, 'movie')
+        actors = surrogate_keys.attach(actors, 'actor')
+        actors = surrogate_keys.attach(actors, 'director')
 
-            with connection.cursor() as cursor:
+        genres = genre_staging.read('bridges')
+        genres = surrogate_keys.attach(genres, 'movie')
+        genres = surrogate_keys.attach(genres, 'genre')
 
-                movie_key = '''
-                UPDATE stg_movies AS s
-                SET movie_key = m.movie_key
-                FROM movies.dim_movie AS m
-                WHERE s."Series_Title" = m.series_title
-                AND s."Released_Year" = m.released_year
-                '''
-                cursor.execute(movie_key)
-
-                actor_key = '''
-                UPDATE stg_movies AS s
-                SET actor_key = a.actor_key
-                FROM movies.dim_actor AS a
-                WHERE s."Actor_Name" = a.actor_name
-                '''
-                cursor.execute(actor_key)
-
-                director_key = '''
-                UPDATE stg_movies AS s
-                SET director_key = d.director_key
-                FROM movies.dim_director AS d
-                WHERE s."Director" = d.director
-                '''
-                cursor.execute(director_key)
-
-                update_dim_movie = '''
-                UPDATE movies.dim_movie AS m
-                SET director_key = s.director_key
-                FROM stg_movies AS s
-                WHERE m.movie_key = s.movie_key
-                '''
-                cursor.execute(update_dim_movie)
-
-                # Loading surrogate keys from staging table to join tables.
-                load_director_actor = '''
-                INSERT INTO movies.director_actor (director_key, actor_key)
-                SELECT DISTINCT director_key, actor_key
-                FROM stg_movies
-                '''
-                cursor.execute(load_director_actor)
-
-                load_actor_movie = '''
-                INSERT INTO movies.actor_movie (actor_key, movie_key)
-                SELECT DISTINCT actor_key, movie_key
-                FROM stg_movies
-                '''
-                cursor.execute(load_actor_movie)
-
-                load_genre_movie = '''
-                INSERT INTO movies.genre_movie (genre_key, movie_key)
-                SELECT DISTINCT genre_key, movie_key
-                FROM stg_movies as s
-                join movies.dim_genre as g on s."Genre" = g.genre
-                '''
-                cursor.execute(load_genre_movie)
-
-                return print('All target tables updated with surrogate keys successfully.')
+        insert(actors[['director_key', 'actor_key']].dropna().drop_duplicates(), 'director_actor')
+        insert(actors[['actor_key', 'movie_key']].dropna().drop_duplicates(), 'actor_movie')
+        insert(genres[['genre_key', 'movie_key']].dropna().drop_duplicates(), 'genre_movie')
 
     except Exception as error:
         print(error)
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 
 def load_fact_gross():
     table_name = 'fact_gross'
     try:
 
-        engine = create_engine('postgresql:///Destination')
+        # The fact keeps one row per movie and actor: the movie's measures are joined to its actors by movie_key.
+        fact = staging.read(table_name)
+        fact = surrogate_keys.attach(fact, 'movie')
+        fact = surrogate_keys.attach(fact, 'director')
 
-        df = pd.read_sql('stg_movies', engine)
+        actors = actor_staging.read(table_name)
+        actors = surrogate_keys.attach(actors, 'movie')
+        actors = surrogate_keys.attach(actors, 'actor')
 
-        fact = df[['Gross', 'No_of_Votes', 'movie_key', 'actor_key', 'director_key']]
+        fact = fact.merge(actors[['movie_key', 'actor_key']].dropna().drop_duplicates(), on='movie_key')
+        fact = fact[['Gross', 'No_of_Votes', 'movie_key', 'actor_key', 'director_key']]
         fact = fact.drop_duplicates()
-        fact = fact.to_dict('records')
-
-        insert_query = '''
-        INSERT INTO fact_gross (
-        Gross,
-        No_of_Votes,
-        movie_key,
-        actor_key,
-        director_key
-        )
-        VALUES (
-        %(Gross)s,
-        %(No_of_Votes)s,
-        %(movie_key)s,
-        %(actor_key)s,
-        %(director_key)s
-        )
-        '''
-
-        insert(insert_query, fact, table_name)
+
+        insert(fact, table_name)
 
     except Exception as error:
         print(error)
 
 
-extract_transform()
-
-load_dim_director()
-
-load_dim_actor()
-
-load_dim_movies()
-
-load_dim_genre()
-
-load_surrogate_keys()
+# The stages run through a scheduler that knows their dependencies, so independent stages
+# run concurrently on a bounded thread pool, each with its own pooled connection.
+scheduler = StageScheduler(max_workers=4)
+scheduler.add(extract_transform)
+scheduler.add(load_dim_director, after=[extract_transform])
+scheduler.add(load_dim_actor, after=[extract_transform])
+scheduler.add(load_dim_genre, after=[extract_transform])
+scheduler.add(load_dim_movies, after=[load_dim_director])
+scheduler.add(load_bridge_tables, after=[load_dim_movies, load_dim_actor, load_dim_genre])
+scheduler.add(load_fact_gross, after=[load_dim_movies, load_dim_actor])
+scheduler.run()
 
-load_fact_gross()
\ No newline at end of file
+print(db.report())
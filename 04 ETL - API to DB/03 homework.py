@@ -3,143 +3,138 @@
 # - some of the data are needed in a transformed form for 1:1 comparison with dimension tables later.
 
 
-import requests
 import pandas as pd
-from sqlalchemy import create_engine
-import psycopg2
 import os
+import sys
 from dotenv import load_dotenv
 
-prd_url = 'https://fakestoreapi.com/products'
-sale_url = 'https://fakestoreapi.com/carts'
-user_url = 'https://fakestoreapi.com/users'
-
-
-def prd_scraper(prd_url):
-    try:
-        response = requests.get(prd_url).json()
-        prd_df = pd.DataFrame(response)
-        prd_df_expand = prd_df.join(pd.json_normalize(prd_df['rating']))
-        prd_df_expand = prd_df_expand.drop(columns=['rating'])
-        
-        engine = create_engine('postgresql:///Destination')
-        prd_df_expand.to_sql('stg_product_table', engine, index=False, if_exists='fail')
-        return print('Product data successfully extracted and loaded to staging')
-        
-    except Exception as error:
-        print(error)
-
-
-def sale_scraper(sale_url):
-    try:
-        response = requests.get(sale_url).json()
-        sale_df = pd.DataFrame(response)
-        sale_explode = sale_df.explode('products')
-        products_expanded = sale_explode['products'].apply(pd.Series)
-        sale_df_expanded = pd.concat([sale_explode, products_expanded], axis=1)
-        # It appears the join command is not working as expected to combine the original df
-        # and the normalized data, probably due to an earlier explosion step (because that's the
-        # only additional step making it different from the usage of 'join' in the function above,
-        # where join was used successfully). Therefore, concat is used here instead.
-        sale_df_expanded = sale_df_expanded.drop(columns=['products'])
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.api_fetch import download_all
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe, copy_returning, copy_upsert
+from etl_utils.flatten import PRODUCTS, SALES, USERS
+from etl_utils.hash_join import hash_join
+from etl_utils.http_cache import ResponseCache
+from etl_utils.json_stream import iter_json_file
+from etl_utils.masking import Masker
+from etl_utils.scheduler import StageScheduler
+from etl_utils.staging_cache import StagingCache
+from etl_utils.surrogate_keys import SurrogateKeys
+
+# FAKESTORE_URL points the extraction at another server, e.g. the local stub in etl_utils/fakestore_stub.py.
+api_url = os.getenv('FAKESTORE_URL', 'https://fakestoreapi.com')
+prd_url = f'{api_url}/products'
+sale_url = f'{api_url}/carts'
+user_url = f'{api_url}/users'
+
+# The three endpoints are fetched together, concurrently over one pooled HTTP session with retries,
+# before the scrapers below transform the responses. The responses are streamed into an on-disk response
+# cache: unchanged payloads are confirmed with conditional requests (ETag / Last-Modified) instead of being
+# downloaded again, and when none of them changed since the last successful run, the staging writes and
+# loads below are skipped altogether. The cached files are kept here by endpoint name.
+api_urls = {'products': prd_url, 'carts': sale_url, 'users': user_url}
+response_cache = ResponseCache()
+responses = {}
+
+# The scrapers parse the responses incrementally and transform them in batches of this many records,
+# so memory does not grow with the size of a response.
+batch_size = 5000
+
+
+def extract_api():
+    responses.update(download_all(api_urls, response_cache))
+    return print('API data successfully extracted')
+
+
+def prd_scraper(response):
+    # Yields the flattened product records batch by batch.
+    for batch in iter_json_file(response, batch_size):
+        # The nested rating object is flattened into its rate and count fields.
+        yield PRODUCTS.frame(batch)
+
+
+def sale_scraper(response):
+    # Yields the flattened sales lines batch by batch.
+    for batch in iter_json_file(response, batch_size):
+        # Every cart line (an element of the products array) becomes one row, with its productId and
+        # quantity next to the cart's id, userId and date, in one pass over the carts
+        # (see etl_utils/flatten.py; it replaces explode() followed by apply(pd.Series)).
+        sale_df_expanded = SALES.frame(batch)
         sale_df_expanded['date'] = pd.to_datetime(sale_df_expanded['date']).dt.date
         sale_df_expanded['month'] = pd.to_datetime(sale_df_expanded['date']).dt.month
         sale_df_expanded['year'] = pd.to_datetime(sale_df_expanded['date']).dt.year
-        
-        engine = create_engine('postgresql:///Destination')
-        sale_df_expanded.to_sql('stg_sale_table', engine, index=False, if_exists='fail')
-        return print('Sales data successfully extracted and loaded to staging')
-        
-    except Exception as error:
-        print(error)
+        yield sale_df_expanded
 
 
-def user_scraper(user_url):
-    try:
-        response = requests.get(user_url).json()
-        user_df = pd.DataFrame(response)
-        user_df_expand1 = user_df.join(pd.json_normalize(user_df['address']))
-        user_df_expand2 = user_df_expand1.join(pd.json_normalize(user_df_expand1['name']))
-        user_df_expand2 = user_df_expand2.drop(columns=['address'])
-        user_df_expand2 = user_df_expand2.drop(columns=['name'])
-        # The transformation below is required at this step instead of later only because 
-        # the data is required to already be in its cleaned form in staging for the 
+def user_scraper(response):
+    # Yields the flattened user records batch by batch.
+    for batch in iter_json_file(response, batch_size):
+        # The nested address (with its geolocation) and name objects are flattened into their fields.
+        user_df_expand2 = USERS.frame(batch)
+        # The transformation below is required at this step instead of later only because
+        # the data is required to already be in its cleaned form in staging for the
         # comparison done in the load_surrogate-keys() function to work.
         user_df_expand2['firstname'] = user_df_expand2['firstname'].str.capitalize()
         user_df_expand2['lastname'] = user_df_expand2['lastname'].str.capitalize()
-        
-        engine = create_engine('postgresql:///Destination')
-        user_df_expand2.to_sql('stg_user_table', engine, index=False, if_exists='fail')
-        return print('User data successfully extracted and loaded to staging')
-    
-    except Exception as error:
-        print(error)
-
-# Creating a combined staging table from all 3 data sources
+        yield user_df_expand2
 
 load_dotenv()
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASSWORD')
 
-connection = None
+# One pooled connection manager for the run, shared by every stage (psycopg2 and SQLAlchemy alike).
+db = ConnectionManager('Destination')
+
+# Creating a combined staging table from all 3 data sources.
+# The flattened sales lines are hash-joined in memory with the products on productId and with the users on
+# userId (see etl_utils/hash_join.py; a build side too large for memory is spilled to disk), and the joined
+# batches are copied into the combined staging table as they are produced. Staging is written once, instead
+# of three staging tables that were joined back together inside the database.
+
+combo_columns = {
+    'id': 'BIGINT', 'userId': 'BIGINT', 'date': 'DATE', 'month': 'INT', 'year': 'INT', '__v': 'BIGINT',
+    'productId': 'BIGINT', 'quantity': 'BIGINT', 'title': 'TEXT', 'price': 'DOUBLE PRECISION',
+    'description': 'TEXT', 'category': 'TEXT', 'image': 'TEXT', 'rate': 'DOUBLE PRECISION', 'count': 'BIGINT',
+    'email': 'TEXT', 'username': 'TEXT', 'password': 'TEXT', 'phone': 'TEXT', 'city': 'TEXT', 'street': 'TEXT',
+    'number': 'BIGINT', 'zipcode': 'TEXT', 'geolocation.lat': 'TEXT', 'geolocation.long': 'TEXT',
+    'firstname': 'TEXT', 'lastname': 'TEXT',
+}
+
+
+def create_combined_staging():
+    try:
+        combo = hash_join(sale_scraper(responses['carts']), prd_scraper(responses['products']), 'productId', 'id',
+                          columns=['title', 'price', 'description', 'category', 'image', 'rate', 'count'])
+        combo = hash_join(combo, user_scraper(responses['users']), 'userId', 'id',
+                          columns=['email', 'username', 'password', 'phone', 'city', 'street', 'number',
+                                   'zipcode', 'geolocation.lat', 'geolocation.long', 'firstname', 'lastname'])
+
+        with db.connection() as connection:
+
+            with connection.cursor() as cursor:
+
+                # Staging is rebuilt on every run, in the same transaction as its new rows, so a rerun never
+                # fails on the previous run's table and the loads never read its stale rows.
+                column_list = ', '.join(f'"{column}" {data_type}' for column, data_type in combo_columns.items())
+                cursor.execute('DROP TABLE IF EXISTS stg_combo_table')
+                cursor.execute(f'CREATE TABLE stg_combo_table ({column_list})')
+
+                rows = 0
+                for batch in combo:
+                    rows += copy_from_dataframe(cursor, batch, 'stg_combo_table', list(combo_columns))
+
+                return print(f'Combined staging table created successfully ({rows} rows)')
+
+    except Exception as error:
+        print(error)
+        raise
 
-try:
-    
-    with psycopg2.connect(
-            host='localhost',
-            dbname='Destination',
-            user=db_user,
-            password=db_password,
-            port=5432
-            ) as connection:
-    
-        with connection.cursor() as cursor:
-            
-            create_combined_stg_table = '''
-            CREATE TABLE stg_combo_table AS
-            SELECT a.id, "userId", date, month, year, a.__v, "productId", quantity, title, price, 
-            description, category, image, rate, count, email, username, 
-            password, phone, city, street, number, zipcode, "geolocation.lat", 
-            "geolocation.long", firstname, lastname 
-            FROM stg_sale_table AS a
-            JOIN stg_product_table AS b on a."productId" = b.id
-            JOIN stg_user_table AS c on a."userId" = c.id
-            '''
-            
-            cursor.execute(create_combined_stg_table) 
-
-            # Creation of additional columns on staging to hold surrogate keys
-            # from dim tables.
-            update_staging = '''
-            ALTER TABLE stg_combo_table
-            ADD COLUMN product_key INT,
-            ADD COLUMN user_key INT,
-            ADD COLUMN date_key INT
-            '''
-            
-            cursor.execute(update_staging) 
-            
-except Exception as error:
-    print(error)
-    
-finally:
-    if connection is not None:
-        connection.close()
 
 # Creating the target tables
 
-connection = None
     
 try:
     
-    with psycopg2.connect(
-            host='localhost',
-            dbname='Destination',
-            user=db_user,
-            password=db_password,
-            port=5432,
-            options='-c search_path=homework'
-            ) as connection:
+    with db.connection(search_path='homework') as connection:
     
         with connection.cursor() as cursor:
 
@@ -208,42 +203,64 @@ try:
             )'''
             
             cursor.execute(create_fact_table)
+
+            # Current stock and latest price per product, kept up to date by the fact load below and by the
+            # order procedures in '04 homework.sql', so availability checks are a primary-key lookup instead
+            # of a min(stock) over the product's facts. reconcile_product_inventory() rebuilds it from the facts.
+            create_product_inventory = '''
+            CREATE TABLE IF NOT EXISTS product_inventory (
+            product_key INT PRIMARY KEY REFERENCES dim_product (product_key),
+            stock INT NOT NULL,
+            price FLOAT,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )'''
+
+            cursor.execute(create_product_inventory)
             
 except Exception as error:
     print(error)
     
-finally:
-    if connection is not None:
-        connection.close()
 
 # Defining the function that will perform the INSERT action when called by the ETL stages.
+# The dataframe is streamed to the table with COPY rather than row by row INSERT statements.
+# 'columns' maps dataframe columns to table columns where their names differ.
+# When 'returning' lists table columns (e.g. the generated surrogate key and the business keys),
+# the inserted rows' values are returned as a dataframe.
+# A failed load is reported and re-raised, so the calling stage fails instead of registering missing keys.
 
 
-def insert(insert_query, dataset):
-    connection = None
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
-    
+def insert(dataset, table_name, columns=None, returning=None):
     try:
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432,
-                options='-c search_path=homework'
-                ) as connection:
+        with db.connection(search_path='homework') as connection:
 
             with connection.cursor() as cursor:
 
-                psycopg2.extras.execute_batch(cursor, insert_query, dataset)
+                if returning is not None:
+                    return copy_returning(cursor, dataset, table_name, returning, columns)
+                copy_from_dataframe(cursor, dataset, table_name, columns)
 
     except Exception as error:
-        print(error)
+        print(f'Loading failed for {table_name}: {error}')
+        raise
+
+
+# Staging is read once per run. Each stage declares the staging columns it needs and receives only those.
 
-    finally:
-        if connection is not None:
-            connection.close()
+staging = StagingCache('stg_combo_table', engine=db.engine)
+staging.declare('dim_product', ['productId', 'title', 'description', 'category', 'image', 'rate'])
+staging.declare('dim_user', ['userId', 'email', 'username', 'password', 'phone', 'firstname', 'lastname',
+                             'street', 'number', 'zipcode', 'geolocation.lat', 'geolocation.long', 'city'])
+staging.declare('dim_date', ['date', 'month', 'year'])
+staging.declare('sale_fact_table', ['id', 'productId', 'title', 'userId', 'firstname', 'lastname', 'date',
+                                    'price', 'quantity', 'count'])
+
+# Surrogate keys generated by the dimension loads, kept in memory and looked up by business key.
+surrogate_keys = SurrogateKeys()
+
+# Personal columns of dim_user are masked per column (see etl_utils/masking.py). Emails and usernames become
+# keyed tokens, so the same customer keeps the same token across loads and masked columns can still be joined;
+# phone numbers keep their format; passwords are redacted. The key comes from PII_TOKEN_KEY in the .env file.
+user_masking = Masker({'email': 'token', 'username': 'token', 'password': 'redact', 'phone': 'format'})
 
 # Defining the functions that extracts each table from staging, transforms, and loads to target
 
@@ -251,233 +268,146 @@ def insert(insert_query, dataset):
 def transform_load_dim_product():
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        dp = pd.read_sql('stg_combo_table', engine)
-        product = dp[['productId', 'title', 'description', 'category', 'image', 'rate']].copy()
+        product = staging.read('dim_product')
         product = product.rename(columns={'productId':'product_id', 'title':'product_name', 'rate':'rating'})
+        # Ratings such as 3.9 are rounded for the INT column, as Postgres did when they were inserted row by row.
+        product['rating'] = product['rating'].round()
         product = product.drop_duplicates(subset=['product_id', 'product_name'], keep='first')
-        product = product.to_dict('records')
-
-        insert_query = '''INSERT into dim_product (
-        product_id,
-        product_name,
-        description,
-        category,
-        image,
-        rating
-        ) 
-        VALUES (
-        %(product_id)s,
-        %(product_name)s,
-        %(description)s,
-        %(category)s,
-        %(image)s,
-        %(rating)s
-        )'''
-
-        insert(insert_query, product)
+
+        keys = insert(product, 'dim_product', returning=['product_key', 'product_id', 'product_name'])
+        surrogate_keys.register('product', keys, 'product_key', {'productId': 'product_id', 'title': 'product_name'})
         return print('dim_product loaded successfully')
     
     except Exception as error:
         print(error)
+        raise
 
 
 def transform_load_dim_user():
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        du = pd.read_sql('stg_combo_table', engine)
-        user = du[['userId', 'email', 'username', 'password', 'phone', 'firstname', 'lastname',
-                   'street', 'number', 'zipcode', 'geolocation.lat', 'geolocation.long']].copy()
+        user = staging.read('dim_user')
+        user = surrogate_keys.attach(user, 'city')
         user = user.rename(columns={'userId':'user_id', 'geolocation.lat': 'latitude', 'geolocation.long': 'longitude'})
-        user['email'] = '***Masked***'
-        user['username'] = '***Masked***'
-        user['password'] = '***Masked***'
-        user['phone'] = '***Masked***'
+        user = user_masking.apply(user)
         user['street'] = user['street'].str.title()
         user = user.drop_duplicates(subset=['user_id', 'firstname', 'lastname'], keep='first')
-        user = user.to_dict('records')
-
-        insert_query = '''INSERT into dim_user (
-        user_id,
-        first_name,
-        last_name,
-        email,
-        username,
-        password,
-        phone,
-        street,
-        number,
-        zipcode,
-        latitude,
-        longitude
-        ) 
-        VALUES (
-        %(user_id)s,
-        %(firstname)s,
-        %(lastname)s,
-        %(email)s,
-        %(username)s,
-        %(password)s,
-        %(phone)s,
-        %(street)s,
-        %(number)s,
-        %(zipcode)s,
-        %(latitude)s,
-        %(longitude)s
-        )'''
-
-        insert(insert_query, user)
+
+        keys = insert(user, 'dim_user', {'user_id': 'user_id', 'firstname': 'first_name', 'lastname': 'last_name',
+                                         'email': 'email', 'username': 'username', 'password': 'password',
+                                         'phone': 'phone', 'street': 'street', 'number': 'number',
+                                         'zipcode': 'zipcode', 'latitude': 'latitude', 'longitude': 'longitude',
+                                         'city_key': 'city_key'},
+                      returning=['user_key', 'user_id', 'first_name', 'last_name'])
+        surrogate_keys.register('user', keys, 'user_key', {'userId': 'user_id', 'firstname': 'first_name',
+                                                           'lastname': 'last_name'})
         return print('dim_user loaded successfully')
     
     except Exception as error:
         print(error)
+        raise
 
 
 def transform_load_dim_date():
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        dt = pd.read_sql('stg_combo_table', engine)
-        date = dt[['date', 'month', 'year']].copy()
+        date = staging.read('dim_date')
         date = date.rename(columns={'date':'sale_date'})
         date = date.drop_duplicates(subset=['sale_date'], keep='first')
-        date = date.to_dict('records')
-
-        insert_query = '''INSERT into dim_date (
-        sale_date,
-        month,
-        year
-        ) 
-        VALUES (
-        %(sale_date)s,
-        %(month)s,
-        %(year)s
-        )'''
-
-        insert(insert_query, date)
+
+        keys = insert(date, 'dim_date', returning=['date_key', 'sale_date'])
+        surrogate_keys.register('date', keys, 'date_key', {'date': 'sale_date'})
         return print('dim_date loaded successfully')
     
     except Exception as error:
         print(error)
+        raise
         
-# Defining the function that loads the surrogate keys of each dimension table to staging
+# Defining the function that loads dim_city and keeps its surrogate keys for dim_user.
+# Note that since there is only one attribute and no transformation required
+# it is more efficient loading dim_city straight from staging than through a dataframe.
+# It is loaded before dim_user so that the city_key can be written together with each user.
 
 
-def load_surrogate_keys():
-    connection = None
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
+def load_dim_city():
         
     try:
         
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+        with db.connection() as connection:
 
             with connection.cursor() as cursor:
-                # Loading surrogate keys from dimension tables to staging.
-
-                product_key = '''UPDATE stg_combo_table AS c SET product_key = p.product_key 
-                FROM homework.dim_product AS p WHERE c."productId" = p.product_id AND
-                c.title = p.product_name'''
-                cursor.execute(product_key)
-                
-                user_key = '''UPDATE stg_combo_table AS c SET user_key = u.user_key 
-                FROM homework.dim_user AS u WHERE c."userId" = u.user_id AND
-                c.firstname = u.first_name AND c.lastname = u.last_name'''
-                cursor.execute(user_key)
-                
-                date_key = '''UPDATE stg_combo_table AS c SET date_key = d.date_key 
-                FROM homework.dim_date AS d WHERE c.date = d.sale_date'''
-                cursor.execute(date_key)
-
-                # Fetching surrogate keys from dim_city and loading to dim_user.
-                # Note that since there is only one attribute and no transformation required
-                # it is more efficient loading dim_city this way than through a dataframe.
-                # This also explains why its loading is designed to happen at this point i.e. together with
-                # similar sql commands.
 
                 load_dim_city = '''INSERT INTO homework.dim_city (city)
-                SELECT DISTINCT city FROM stg_combo_table'''
+                SELECT DISTINCT city FROM stg_combo_table
+                RETURNING city_key, city'''
                 cursor.execute(load_dim_city)
 
-                update_dim_user = '''UPDATE homework.dim_user AS u SET city_key = c.city_key 
-                FROM stg_combo_table AS s
-                JOIN homework.dim_city AS c ON s.city = c.city
-                WHERE u.user_id = s."userId" '''
-                cursor.execute(update_dim_user)
-                
-                return print('All target tables updated with surrogate keys successfully.')
+                keys = pd.DataFrame(cursor.fetchall(), columns=['city_key', 'city'])
+                surrogate_keys.register('city', keys, 'city_key', {'city': 'city'})
+
+                return print('dim_city loaded successfully')
     
     except Exception as error:
         print(error)
+        raise
         
-    finally:
-        if connection is not None:
-            connection.close()
 
 # Finally, defining the function that transforms and loads the fact data together with all 
 # surrogate keys to the fact table.
+# The loaded stock is folded into product_inventory in the same transaction: the inventory keeps the
+# smallest stock seen for each product and takes the price of its last loaded sale.
 
 
 def transform_load_fact_table():
     try:
 
-        engine = create_engine('postgresql:///Destination')
-
-        df = pd.read_sql('stg_combo_table', engine)
-        fact = df[['id', 'product_key', 'user_key', 'date_key', 'price', 'quantity', 'count']].copy()
+        fact = staging.read('sale_fact_table')
+        fact = surrogate_keys.attach(fact, 'product')
+        fact = surrogate_keys.attach(fact, 'user')
+        fact = surrogate_keys.attach(fact, 'date')
         fact = fact.rename(columns={'id':'sale_id', 'count':'stock'})
         fact['total_sale'] = fact['price'] * fact['quantity']
-        fact = fact.to_dict('records')
-
-        insert_query = '''INSERT into sale_fact_table (
-        sale_id,
-        product_key,
-        user_key,
-        date_key,
-        price,
-        quantity,
-        total_sale,
-        stock
-        ) 
-        VALUES (
-        %(sale_id)s,
-        %(product_key)s,
-        %(user_key)s,
-        %(date_key)s,
-        %(price)s,
-        %(quantity)s,
-        %(total_sale)s,
-        %(stock)s
-        )'''
-
-        insert(insert_query, fact)
-        return print('fact_table loaded successfully')
-    
-    except Exception as error:
-        print(error)
 
+        loaded = fact[fact['product_key'].notna() & fact['stock'].notna()]
+        inventory = loaded.groupby('product_key').agg(stock=('stock', 'min'), price=('price', 'last')).reset_index()
+        inventory = inventory.astype({'product_key': 'int64', 'stock': 'int64'})
 
-prd_scraper(prd_url)
+        with db.connection(search_path='homework') as connection:
 
-sale_scraper(sale_url)
-
-user_scraper(user_url)
-
-transform_load_dim_product()
-
-transform_load_dim_user()
-
-transform_load_dim_date()
+            with connection.cursor() as cursor:
 
-load_surrogate_keys()
+                copy_from_dataframe(cursor, fact, 'sale_fact_table', ['sale_id', 'product_key', 'user_key', 'date_key',
+                                                                      'price', 'quantity', 'total_sale', 'stock'])
+                copy_upsert(cursor, inventory, 'product_inventory', ['product_key'], update_columns=['price'],
+                            extra_updates={'stock': 'LEAST(product_inventory.stock, excluded.stock)',
+                                           'updated_at': 'now()'})
 
-transform_load_fact_table()
\ No newline at end of file
+        return print('fact_table loaded successfully')
+    
+    except Exception as error:
+        print(error)
+        raise
+
+
+# The stages run through a scheduler that knows their dependencies, so independent stages
+# run concurrently on a bounded thread pool, each with its own pooled connection.
+# Every stage re-raises its errors, so the scheduler sees a failed stage, skips the stages that depend on it
+# and reports it: the payloads are only marked as loaded when every stage completed.
+# The extraction runs first: it decides whether there is anything to load.
+extract_api()
+
+scheduler = StageScheduler(max_workers=4)
+scheduler.add(create_combined_staging)
+scheduler.add(transform_load_dim_product, after=[create_combined_staging])
+scheduler.add(load_dim_city, after=[create_combined_staging])
+scheduler.add(transform_load_dim_user, after=[load_dim_city])
+scheduler.add(transform_load_dim_date, after=[create_combined_staging])
+scheduler.add(transform_load_fact_table, after=[transform_load_dim_product, transform_load_dim_user,
+                                                transform_load_dim_date])
+
+if not response_cache.needs_load(api_urls.values(), 'homework'):
+    print('API payloads unchanged since the last successful load, staging and loads skipped')
+elif not scheduler.run():
+    response_cache.mark_loaded(api_urls.values(), 'homework')
+
+print(db.report())
@@ -1,11 +1,15 @@
 -- This exercise relates to data insertion and therefore is not appropriate for an OLAP database as is used here.
 -- However it serves as a good demonstration of proficiency in SQL Stored Procedures.
 
+-- Stock is read from homework.product_inventory (current stock and price per product, created by '03 homework.py'),
+-- so the availability check is one primary-key lookup however many sales the product has. The check and the
+-- decrement are a single UPDATE of the product's inventory row, which also locks it until the sale is committed:
+-- two concurrent orders for the same product cannot both take the last items.
+
 CREATE OR REPLACE PROCEDURE sales_update(p_sale_id int, p_user_id int, p_prod_id int, p_qty int)
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    v_product_status text;
     v_product_key int;
     v_user_key int;
     v_date_key int;
@@ -16,26 +20,20 @@ begin
     select product_key into v_product_key
     from homework.dim_product
     where product_id = p_prod_id;
-		
-    select 'Available' into v_product_status
-    from homework.sale_fact_table
+
+    update homework.product_inventory
+    set stock = stock - p_qty,
+        updated_at = now()
     where product_key = v_product_key
-    and stock >= p_qty;
+    and p_qty > 0
+    and stock >= p_qty
+    returning stock, price into v_stock, v_price;
     
-    if v_product_status = 'Available' then
+    if found then
     
         select user_key into v_user_key
     	from homework.dim_user
     	where user_id = p_user_id;
-	
-	select price into v_price
-    	from homework.sale_fact_table
-   	where product_key = v_product_key;
-
-	select min(stock) into v_stock
-    	from homework.sale_fact_table
-	group by product_key
-	having product_key = v_product_key;
 
 	insert into homework.dim_date (sale_date, month, year)
 	select current_date,
@@ -50,7 +48,7 @@ begin
         insert into homework.sale_fact_table (sale_id, product_key, user_key, date_key, price, 
 	quantity, total_sale, stock)
 	values (p_sale_id, v_product_key, v_user_key, v_date_key, v_price, 
-	p_qty, (v_price * p_qty), (v_stock - p_qty));
+	p_qty, (v_price * p_qty), v_stock);
         
         raise notice 'Sale successfully completed!';
     
@@ -62,3 +60,266 @@ end;
 $$
 
 call sales_update(8, 4, 10, 2);
+
+
+-- Batch variant of sales_update. The procedure above handles one order per call, with five to six point lookups
+-- and a min(stock) aggregate over the product's facts each time, so order throughput is bounded by round trips.
+-- sales_update_batch takes a whole batch of orders as parallel arrays and resolves them with set-based joins:
+-- product and user keys are looked up once for the batch, the inventory rows of the ordered products are read and
+-- locked once (in product_key order, so concurrent batches cannot deadlock on them), the accepted sales are
+-- inserted and the inventory rows updated with one statement each, and one status row per order is returned.
+--
+-- Stock is the product's stock in product_inventory (as in sales_update). Orders for the same product are
+-- applied in batch order, each against the stock left by the orders accepted before it, so a batch gives every
+-- order the status one sales_update call per order would. An order whose quantity exceeds the remaining stock is
+-- rejected and does not consume any stock; a later, smaller order for the product can still be accepted.
+--
+-- A staged batch can be passed by aggregating it into arrays, e.g.
+--   select * from sales_update_batch((select array_agg(sale_id order by id) from order_stage), ...);
+
+CREATE OR REPLACE FUNCTION sales_update_batch(p_sale_ids int[], p_user_ids int[], p_prod_ids int[], p_qtys int[])
+RETURNS TABLE (sale_id int, status text, remaining_stock int)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_date_key int;
+    v_order record;
+    v_product_key int;
+    v_remaining int;
+    v_ords int[] := '{}';
+    v_accepted boolean[] := '{}';
+    v_remaining_stock int[] := '{}';
+
+begin
+    insert into homework.dim_date (sale_date, month, year)
+    select current_date,
+        extract(month from current_date)::int,
+        extract(year from current_date)::int
+    where not exists (select 1 from homework.dim_date where sale_date = current_date);
+
+    select date_key into v_date_key
+    from homework.dim_date
+    where sale_date = current_date
+    order by date_key
+    limit 1;
+
+    -- Walks the orders of every product in batch order, each against the stock left by the orders accepted before
+    -- it, one pass over the orders sorted by product. The inventory rows are locked in product_key order, so
+    -- concurrent batches cannot deadlock on them.
+    for v_order in
+        select o.ord::int as ord, o.qty, i.product_key, i.stock
+        from unnest(p_prod_ids, p_qtys) with ordinality as o(prod_id, qty, ord)
+        join lateral (
+            select d.product_key
+            from homework.dim_product d
+            where d.product_id = o.prod_id
+            order by d.product_key
+            limit 1
+        ) p on true
+        join homework.product_inventory i on i.product_key = p.product_key
+        order by i.product_key, o.ord
+        for update of i
+    loop
+        if v_order.product_key is distinct from v_product_key then
+            v_product_key := v_order.product_key;
+            v_remaining := v_order.stock;
+        end if;
+
+        v_ords := v_ords || v_order.ord;
+        if v_order.qty > 0 and v_order.qty <= v_remaining then
+            v_remaining := v_remaining - v_order.qty;
+            v_accepted := v_accepted || true;
+        else
+            v_accepted := v_accepted || false;
+        end if;
+        v_remaining_stock := v_remaining_stock || v_remaining;
+    end loop;
+
+    return query
+    with orders as (
+        select o.ord::int as ord, o.sale_id, o.user_id, o.prod_id, o.qty
+        from unnest(p_sale_ids, p_user_ids, p_prod_ids, p_qtys) with ordinality as o(sale_id, user_id, prod_id, qty, ord)
+    ),
+    products as (
+        select distinct on (product_id) product_id, product_key
+        from homework.dim_product
+        where product_id in (select prod_id from orders)
+        order by product_id, product_key
+    ),
+    users as (
+        select distinct on (user_id) user_id, user_key
+        from homework.dim_user
+        where user_id in (select user_id from orders)
+        order by user_id, user_key
+    ),
+    resolved as (
+        select o.ord, o.sale_id, o.qty, p.product_key, u.user_key, i.price
+        from orders o
+        left join products p on p.product_id = o.prod_id
+        left join users u on u.user_id = o.user_id
+        left join homework.product_inventory i on i.product_key = p.product_key
+    ),
+    applied as (
+        select a.ord, a.accepted, a.remaining
+        from unnest(v_ords, v_accepted, v_remaining_stock) as a(ord, accepted, remaining)
+    ),
+    inserted as (
+        insert into homework.sale_fact_table (sale_id, product_key, user_key, date_key, price,
+        quantity, total_sale, stock)
+        select r.sale_id, r.product_key, r.user_key, v_date_key, r.price,
+            r.qty, (r.price * r.qty), a.remaining
+        from resolved r
+        join applied a on a.ord = r.ord
+        where a.accepted
+        order by r.ord
+    ),
+    -- The stock left after the last accepted order of every product.
+    consumed as (
+        update homework.product_inventory i
+        set stock = l.remaining,
+            updated_at = now()
+        from (
+            select r.product_key, min(a.remaining) as remaining
+            from applied a
+            join resolved r on r.ord = a.ord
+            group by r.product_key
+        ) l
+        where i.product_key = l.product_key
+        and i.stock <> l.remaining
+    )
+    select r.sale_id,
+        case
+            when r.product_key is null then 'Unknown product'
+            when r.qty is null or r.qty <= 0 then 'Invalid quantity'
+            when a.accepted then 'Sale successfully completed'
+            else 'Insufficient quantity'
+        end,
+        a.remaining
+    from resolved r
+    left join applied a on a.ord = r.ord
+    order by r.ord;
+end;
+$$;
+
+select * from sales_update_batch(array[8, 9, 10], array[4, 2, 7], array[10, 10, 3], array[2, 1, 4]);
+
+
+-- Reconciliation of product_inventory with the facts. The inventory is maintained incrementally by the fact load
+-- and the order procedures; this rebuilds it from sale_fact_table (smallest recorded stock and latest price per
+-- product), e.g. after facts were loaded or corrected outside those paths, or to fill it for existing facts.
+-- Products without facts are removed. Returns one row per product whose snapshot differed from its facts
+-- (a null snapshot_stock: missing from the inventory; a null fact_stock: no facts).
+--
+-- The inventory is locked against writes while it is rebuilt, so no order can commit a decrement in between.
+
+CREATE OR REPLACE FUNCTION reconcile_product_inventory()
+RETURNS TABLE (product_key int, snapshot_stock int, fact_stock int)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+begin
+    lock table homework.product_inventory in exclusive mode;
+
+    return query
+    with facts as (
+        select f.product_key, min(f.stock) as stock,
+            (array_agg(f.price order by f.sale_key desc) filter (where f.price is not null))[1] as price
+        from homework.sale_fact_table f
+        where f.product_key is not null
+        and f.stock is not null
+        group by f.product_key
+    ),
+    removed as (
+        delete from homework.product_inventory i
+        where not exists (select 1 from facts where facts.product_key = i.product_key)
+    ),
+    rebuilt as (
+        insert into homework.product_inventory (product_key, stock, price, updated_at)
+        select facts.product_key, facts.stock, facts.price, now()
+        from facts
+        on conflict (product_key) do update
+        set stock = excluded.stock,
+            price = excluded.price,
+            updated_at = excluded.updated_at
+        where (product_inventory.stock, product_inventory.price) is distinct from (excluded.stock, excluded.price)
+    )
+    select coalesce(f.product_key, i.product_key), i.stock, f.stock
+    from facts f
+    full join homework.product_inventory i on i.product_key = f.product_key
+    where i.stock is distinct from f.stock
+    order by 1;
+end;
+$$;
+
+select * from reconcile_product_inventory();
+
+
+-- Order ingestion queue. Clients calling sales_update concurrently each hold a transaction open on the same hot
+-- inventory rows, so throughput collapses as clients are added. Instead clients only append their orders to
+-- order_queue (one short INSERT), and a fixed pool of workers (etl_utils/order_queue.py) applies them in batches:
+-- process_order_queue claims up to p_batch_size pending orders with FOR UPDATE SKIP LOCKED, so concurrent workers
+-- take disjoint batches without waiting on each other, applies them with sales_update_batch (which locks the
+-- inventory rows of the batch in product_key order, so two workers never deadlock on them) and records every
+-- order's status, all in one transaction. Orders are claimed oldest first; a worker that fails rolls back and its
+-- orders become pending again. Returns the number of orders processed (0 when the queue is empty).
+
+CREATE TABLE IF NOT EXISTS homework.order_queue (
+    order_id bigserial PRIMARY KEY,
+    sale_id int,
+    user_id int,
+    prod_id int,
+    qty int,
+    enqueued_at timestamptz NOT NULL DEFAULT clock_timestamp(),
+    processed_at timestamptz,
+    status text,
+    remaining_stock int
+);
+
+CREATE INDEX IF NOT EXISTS order_queue_pending_idx ON homework.order_queue (order_id) WHERE processed_at IS NULL;
+
+-- Orders name products by product_id; without an index every order scanned dim_product to find its key.
+CREATE INDEX IF NOT EXISTS dim_product_product_id_idx ON homework.dim_product (product_id);
+
+CREATE OR REPLACE FUNCTION process_order_queue(p_batch_size int DEFAULT 100)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_order_ids bigint[];
+    v_sale_ids int[];
+    v_user_ids int[];
+    v_prod_ids int[];
+    v_qtys int[];
+
+begin
+    with claimed as (
+        select order_id, sale_id, user_id, prod_id, qty
+        from homework.order_queue
+        where processed_at is null
+        order by order_id
+        limit p_batch_size
+        for update skip locked
+    )
+    select array_agg(order_id order by order_id), array_agg(sale_id order by order_id),
+        array_agg(user_id order by order_id), array_agg(prod_id order by order_id), array_agg(qty order by order_id)
+    into v_order_ids, v_sale_ids, v_user_ids, v_prod_ids, v_qtys
+    from claimed;
+
+    if v_order_ids is null then
+        return 0;
+    end if;
+
+    update homework.order_queue q
+    set processed_at = clock_timestamp(),
+        status = r.status,
+        remaining_stock = r.remaining_stock
+    from sales_update_batch(v_sale_ids, v_user_ids, v_prod_ids, v_qtys) with ordinality as r(sale_id, status, remaining_stock, ord)
+    where q.order_id = v_order_ids[r.ord];
+
+    return cardinality(v_order_ids);
+end;
+$$;
+
+insert into homework.order_queue (sale_id, user_id, prod_id, qty) values (8, 4, 10, 2), (9, 2, 10, 1);
+select process_order_queue(100);
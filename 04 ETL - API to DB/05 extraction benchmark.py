@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import pandas as pd
+import requests
+
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.api_fetch import fetch_all_json
+from etl_utils.fakestore_stub import StubServer
+
+# Offline benchmark of the API extraction. A local stub server (etl_utils/fakestore_stub.py) serves
+# fakestore-shaped /products, /carts and /users payloads of the requested size, and the same set of
+# requests is fetched three ways:
+#   sequential - requests.get() per endpoint, one after another, as the scrapers used to do
+#   session    - one requests.Session, still one request at a time, but with keep-alive connections
+#   async      - fetch_all_json(): one pooled aiohttp session with all requests in flight at once
+# Every endpoint is requested 'repeat' times per run (e.g. one request per page or per day in a real
+# extraction), and the stub can add latency per response to mimic a remote API.
+#
+# Usage: python "05 extraction benchmark.py" [--records N] [--repeat N] [--latency S] [--runs N] [--output file.csv]
+# e.g.   python "05 extraction benchmark.py" --records 10000 --repeat 20 --latency 0.05
+
+
+def sequential(urls):
+    return [requests.get(url).json() for url in urls]
+
+
+def session(urls):
+    with requests.Session() as http:
+        return [http.get(url).json() for url in urls]
+
+
+def concurrent(urls, concurrency):
+    return fetch_all_json(urls, concurrency=concurrency)
+
+
+def run_benchmark(records, repeat, latency, runs, concurrency):
+    results = []
+    with StubServer(products=records, carts=records, users=records, latency=latency) as base_url:
+        urls = [f'{base_url}/{collection}?page={page}' for page in range(repeat)
+                for collection in ('products', 'carts', 'users')]
+
+        # Warm-up: lets the stub build its payloads before anything is timed.
+        payload_bytes = sum(len(requests.get(url).content) for url in urls[:3]) * repeat
+
+        for method, fetch in [('sequential', sequential), ('session', session),
+                              ('async', lambda targets: concurrent(targets, concurrency))]:
+            timings = []
+            for _ in range(runs):
+                started = perf_counter()
+                fetch(urls)
+                timings.append(perf_counter() - started)
+
+            seconds = pd.Series(timings).median()
+            print(f'{method}: {len(urls)} requests in {seconds:.3f}s (median of {runs})')
+            results.append({'method': method, 'records': records, 'requests': len(urls), 'latency': latency,
+                            'seconds_p50': round(seconds, 4),
+                            'requests_per_second': round(len(urls) / seconds, 1),
+                            'mb_per_second': round(payload_bytes / 1e6 / seconds, 1)})
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare sequential and concurrent extraction from a local fakestore stub.')
+    parser.add_argument('--records', type=int, default=1000, help='records per collection')
+    parser.add_argument('--repeat', type=int, default=10, help='requests per collection and run')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stub adds to every response')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', default='extraction_benchmark.csv')
+    arguments = parser.parse_args()
+
+    try:
+        results = run_benchmark(arguments.records, arguments.repeat, arguments.latency, arguments.runs,
+                                arguments.concurrency)
+        results.to_csv(arguments.output, index=False)
+        print(results.to_string(index=False))
+        print(f'Results saved to {arguments.output}')
+    except Exception as error:
+        print(error)
@@ -0,0 +1,235 @@
+import argparse
+import multiprocessing
+import os
+import sys
+from time import perf_counter, sleep
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.order_queue import OrderWorkers
+
+load_dotenv()
+
+# Load generator for the order procedures in '04 homework.sql'. Synthetic orders for the products and users
+# loaded by '03 homework.py' are sent by an increasing number of concurrent clients (one process and one
+# connection each), every client sending its orders one at a time as fast as it can, in two modes:
+#   direct - every order is a CALL sales_update(...) of its own, as the clients did so far
+#   queue  - every order is an INSERT into homework.order_queue, applied by a pool of worker processes
+#            (etl_utils/order_queue.py) in batches with process_order_queue()
+# For every mode and client count the script records the throughput (orders per second) and the p50/p99
+# latency of an order: the CALL round trip in direct mode, and from enqueue to processed in queue mode
+# (read from the queue's timestamps, so the time waiting in the queue is included).
+#
+# Orders are spread over the first 'products' products only, so concurrent orders contend for the same
+# inventory rows. After every run the inventory is reconciled with the facts (reconcile_product_inventory()):
+# the 'drift' column counts the products whose stock did not match, and 'negative_stock' the products that
+# were oversold; both should be 0. Unless --keep is given, the orders and sales of every run are deleted
+# afterwards and the inventory is rebuilt, so every run starts from the same stock.
+#
+# The homework tables must have been loaded and the SQL of '04 homework.sql' run first.
+#
+# Usage: python "06 order ingestion benchmark.py" [clients ...] [--orders N] [--workers N] [--batch-size N]
+#                                                 [--products N] [--modes direct queue] [--output file.csv]
+# e.g.   python "06 order ingestion benchmark.py" 1 4 16 64 --orders 500 --workers 8
+
+db = ConnectionManager('Destination')
+
+STATEMENTS = {
+    'direct': 'CALL sales_update(%s, %s, %s, %s)',
+    'queue': 'INSERT INTO homework.order_queue (sale_id, user_id, prod_id, qty) VALUES (%s, %s, %s, %s)',
+}
+FIRST_SALE_ID = 1000000
+
+
+def catalog(products):
+    # Product ids of the first 'products' products that have stock, and every user id.
+    with db.cursor() as cursor:
+        cursor.execute('''
+            SELECT DISTINCT p.product_id
+            FROM homework.product_inventory AS i
+            JOIN homework.dim_product AS p ON p.product_key = i.product_key
+            ORDER BY p.product_id
+            LIMIT %s''', (products,))
+        product_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT DISTINCT user_id FROM homework.dim_user WHERE user_id IS NOT NULL')
+        user_ids = [row[0] for row in cursor.fetchall()]
+
+    if not product_ids or not user_ids:
+        raise ValueError('No products with inventory or no users: load the homework tables with 03 homework.py '
+                         'and run reconcile_product_inventory() first')
+    return product_ids, user_ids
+
+
+def generate(clients, orders, product_ids, user_ids, rng):
+    # One dataframe of orders (sale_id, user_id, prod_id, qty) per client.
+    total = clients * orders
+    frame = pd.DataFrame({
+        'sale_id': np.arange(FIRST_SALE_ID, FIRST_SALE_ID + total),
+        'user_id': rng.choice(user_ids, total),
+        'prod_id': rng.choice(product_ids, total),
+        'qty': rng.integers(1, 4, total),
+    })
+    return [frame.iloc[client::clients] for client in range(clients)]
+
+
+def mark():
+    # Highest fact and queue keys before a run, to tell its rows apart afterwards.
+    with db.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(max(sale_key), 0) FROM homework.sale_fact_table')
+        sale_key = cursor.fetchone()[0]
+        cursor.execute('SELECT COALESCE(max(order_id), 0) FROM homework.order_queue')
+        order_id = cursor.fetchone()[0]
+    return sale_key, order_id
+
+
+def restore(marks):
+    # Deletes the sales and orders of a run and rebuilds the inventory from the remaining facts.
+    sale_key, order_id = marks
+    with db.cursor() as cursor:
+        cursor.execute('DELETE FROM homework.sale_fact_table WHERE sale_key > %s', (sale_key,))
+        cursor.execute('DELETE FROM homework.order_queue WHERE order_id > %s', (order_id,))
+        cursor.execute('SELECT count(*) FROM reconcile_product_inventory()')
+
+
+def _client(mode, orders, barrier, results):
+    # Client process: connects, waits for the others, then sends its orders one transaction each.
+    client_db = ConnectionManager('Destination', pool_size=1)
+    with client_db.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    barrier.wait()
+
+    latencies = []
+    try:
+        for order in orders.itertuples(index=False):
+            t1 = perf_counter()
+            with client_db.cursor() as cursor:
+                cursor.execute(STATEMENTS[mode], tuple(int(value) for value in order))
+            latencies.append((perf_counter() - t1) * 1000)
+    except Exception as error:
+        print(error)
+    finally:
+        results.put(latencies)
+        client_db.close()
+
+
+def run_clients(mode, client_orders):
+    # Runs one client process per dataframe. Returns (seconds until the last client finished, latencies in ms).
+    barrier = multiprocessing.Barrier(len(client_orders) + 1)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_client, args=(mode, orders, barrier, results))
+                 for orders in client_orders]
+    for process in processes:
+        process.start()
+
+    barrier.wait()
+    t1 = perf_counter()
+    latencies = [latency for _ in processes for latency in results.get()]
+    seconds = perf_counter() - t1
+    for process in processes:
+        process.join()
+    return seconds, latencies
+
+
+def check_inventory():
+    # Products whose inventory differed from the facts (and are now repaired), and oversold products.
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM reconcile_product_inventory()')
+        drift = cursor.fetchone()[0]
+        cursor.execute('SELECT count(*) FROM homework.product_inventory WHERE stock < 0')
+        negative = cursor.fetchone()[0]
+    return drift, negative
+
+
+def run_direct(client_orders):
+    marks = mark()
+    seconds, latencies = run_clients('direct', client_orders)
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM homework.sale_fact_table WHERE sale_key > %s', (marks[0],))
+        accepted = cursor.fetchone()[0]
+    return marks, seconds, latencies, accepted
+
+
+def run_queue(client_orders, workers, batch_size):
+    # The workers are started before the clients and drain the queue before the block exits. The throughput
+    # is measured from the first enqueue to the last processed order, on the database clock.
+    marks = mark()
+    with OrderWorkers('Destination', workers, batch_size):
+        # Lets the workers connect before the clients start.
+        sleep(0.5)
+        run_clients('queue', client_orders)
+
+    with db.cursor() as cursor:
+        cursor.execute('''
+            SELECT EXTRACT(EPOCH FROM processed_at - enqueued_at) * 1000, status = 'Sale successfully completed',
+                EXTRACT(EPOCH FROM enqueued_at), EXTRACT(EPOCH FROM processed_at)
+            FROM homework.order_queue
+            WHERE order_id > %s''', (marks[1],))
+        queued = pd.DataFrame(cursor.fetchall(), columns=['latency', 'accepted', 'enqueued', 'processed'], dtype=float)
+
+    seconds = queued['processed'].max() - queued['enqueued'].min()
+    return marks, seconds, queued['latency'].tolist(), int(queued['accepted'].sum())
+
+
+def benchmark(client_counts, orders, workers, batch_size, products, modes, seed, keep):
+    product_ids, user_ids = catalog(products)
+    print(f'{len(product_ids)} products, {len(user_ids)} users')
+
+    # The inventory must match the facts before the first run, so the drift of every run is its own.
+    with db.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM reconcile_product_inventory()')
+
+    results = []
+    for clients in client_counts:
+        for mode in modes:
+            # Both modes get the same orders for the same client count.
+            client_orders = generate(clients, orders, product_ids, user_ids, np.random.default_rng([seed, clients]))
+            if mode == 'direct':
+                marks, seconds, latencies, accepted = run_direct(client_orders)
+            else:
+                marks, seconds, latencies, accepted = run_queue(client_orders, workers, batch_size)
+            drift, negative = check_inventory()
+            if not keep:
+                restore(marks)
+
+            total = clients * orders
+            result = {'mode': mode, 'clients': clients, 'workers': workers if mode == 'queue' else None,
+                      'batch_size': batch_size if mode == 'queue' else None, 'orders': total, 'accepted': accepted,
+                      'seconds': round(seconds, 3), 'orders_per_second': round(total / seconds, 1),
+                      'p50_ms': round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+                      'p99_ms': round(float(np.percentile(latencies, 99)), 2) if latencies else None,
+                      'drift': drift, 'negative_stock': negative}
+            print(f"{mode}, {clients} client(s): {result['orders_per_second']} orders/s, "
+                  f"p99 {result['p99_ms']} ms, {accepted} of {total} accepted")
+            results.append(result)
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure order throughput and latency of direct and queued order ingestion.')
+    parser.add_argument('clients', nargs='*', type=int, default=[1, 2, 4, 8, 16, 32], help='numbers of concurrent clients')
+    parser.add_argument('--orders', type=int, default=200, help='orders sent by every client')
+    parser.add_argument('--workers', type=int, default=4, help='queue worker processes')
+    parser.add_argument('--batch-size', type=int, default=100, help='orders applied per worker transaction')
+    parser.add_argument('--products', type=int, default=100, help='number of products the orders are spread over')
+    parser.add_argument('--modes', nargs='+', choices=list(STATEMENTS), default=list(STATEMENTS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='order_ingestion_benchmark.csv', help='CSV file for the results')
+    parser.add_argument('--keep', action='store_true', help='keep the sales and orders of every run')
+    arguments = parser.parse_args()
+
+    try:
+        results = benchmark(arguments.clients, arguments.orders, arguments.workers, arguments.batch_size,
+                            arguments.products, arguments.modes, arguments.seed, arguments.keep)
+        results.to_csv(arguments.output, index=False)
+        print(results.to_string(index=False))
+        print(f'Results saved to {arguments.output}')
+    except Exception as error:
+        print(error)
+    finally:
+        db.close()
@@ -1,78 +1,67 @@
-import pandas as pd
-from sqlalchemy import create_engine
 import os
-import psycopg2
+import sys
 from datetime import datetime
 from datetime import timedelta
 from dotenv import load_dotenv
 
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.excel_stream import read_excel_chunks, on_date, as_date
+from etl_utils.explode import parallel_explode
+from etl_utils.numbers import parse_numeric_columns
+from etl_utils.scheduler import StageScheduler
+from etl_utils.staging_cache import StagingCache
+from etl_utils.surrogate_keys import SurrogateKeys
+
 load_dotenv()
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASS')
+
+# One pooled connection manager for the run, shared by every stage (psycopg2 and SQLAlchemy alike).
+db = ConnectionManager('Destination')
+
+# Source columns used by the pipeline. Only these are kept while the workbook is streamed.
+source_columns = ['product_id', 'product_name', 'category', 'discounted_price', 'actual_price', 'discount_percentage',
+                  'rating', 'rating_count', 'about_product', 'user_id', 'user_name', 'review_id', 'review_title',
+                  'img_link', 'product_link', 'modified_date']
 
 # Defining the function that extracts and transforms source data to staging.
 def extract_transform():
-    connection = None
-
     try:
-        engine = create_engine('postgresql:///Destination')
+        engine = db.engine
 
-        source_table = pd.read_excel('05 ETL - Incremental Load/ebay.xlsx')
-        source_table = source_table.copy()
         # This design fetches data from any past 'modified date' in the source data, in this case,
         # data modified yesterday, but in reality it should fetch all data from the source system
         # including historical data since it is a first load.
-        source_table['modified_date'] = pd.to_datetime(source_table['modified_date']).dt.date
-        source_table = source_table[source_table['modified_date'] == datetime.today().date() - timedelta(days=1)]
-
-        source_table['user_id'] = source_table['user_id'].str.split(',')
-        source_table['user_name'] = source_table['user_name'].str.split(',')
-        source_table['review_id'] = source_table['review_id'].str.split(',')
-        source_table['review_title'] = source_table['review_title'].str.split(',')
-        # A 'created_date' column is created and added to the staging dataset
-        source_table['created_date'] = datetime.today().date()
-
-        source_table = source_table.explode(['user_id', 'user_name', 'review_id', 'review_title'])
-        source_table.to_sql('stg_product_review', engine, index=False, if_exists='fail')
+        # The date filter and the column projection are applied while the workbook is streamed, so rows from
+        # other days are never turned into a DataFrame. Each chunk is transformed and appended to staging.
+        yesterday = datetime.today().date() - timedelta(days=1)
+        if_exists = 'fail'
 
-        # Addition of surrogate key columns to staging.
+        for source_table in read_excel_chunks('05 ETL - Incremental Load/ebay.xlsx', source_columns,
+                                              filters={'modified_date': on_date(yesterday)}):
+            source_table['modified_date'] = source_table['modified_date'].map(as_date)
 
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+            # A 'created_date' column is created and added to the staging dataset
+            source_table['created_date'] = datetime.today().date()
 
-            with connection.cursor() as cursor:
-                staging_update = '''ALTER TABLE stg_product_review
-                ADD COLUMN product_key INT,
-                ADD COLUMN user_key INT
-                '''
-
-                cursor.execute(staging_update)
+            # The packed user/review columns are split and exploded together in one pass. Rows whose columns hold
+            # different numbers of values cannot be paired up reliably and are set aside instead of failing the load.
+            source_table, rejects = parallel_explode(source_table, ['user_id', 'user_name', 'review_id', 'review_title'])
+            if not rejects.empty:
+                print(f'{len(rejects)} source rows rejected: packed user/review columns have different lengths')
+            source_table.to_sql('stg_product_review', engine, index=False, if_exists=if_exists)
+            if_exists = 'append'
 
-                print('Extraction to staging completed')
+        print('Extraction to staging completed')
 
     except Exception as error:
         print(f'Extraction to staging failed: {error}')
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 
 # Creating the fact, dimension, and audit tables.
-connection = None
 
 try:
-    with psycopg2.connect(
-            host='localhost',
-            dbname='Destination',
-            user=db_user,
-            password=db_password,
-            port=5432,
-            options='-c search_path=ebay') as connection:
+    with db.connection(search_path='ebay') as connection:
 
         with connection.cursor() as cursor:
             create_dim_product = '''
@@ -193,10 +182,6 @@ try:
 except Exception as error:
     print(error)
 
-finally:
-    if connection is not None:
-        connection.close()
-
 
 # Defining the function that loads the data and updates the audit table when called.
 # Instead of INSERT, the loading script utilizes 'to_sql' as it is designed to handle the
@@ -205,7 +190,7 @@ def loader(dataset, table_name, column_name):
     try:
         loaded_rows = 0
 
-        engine = create_engine('postgresql:///Destination')
+        engine = db.engine
 
         dataset.to_sql(table_name, engine, schema='ebay', if_exists='append', index=False)
         print(f'Rows {loaded_rows} to {len(dataset)} loaded successfully for {table_name}')
@@ -217,7 +202,8 @@ def loader(dataset, table_name, column_name):
 
         # Reminder that arguments are passed to placeholders in psycopg2 using
         # tuples or lists, even if it is only one value.
-        cursor.execute(call_procedure, (table_name, column_name,))
+        with db.cursor(search_path='ebay') as cursor:
+            cursor.execute(call_procedure, (table_name, column_name,))
 
         print('Audit table updated.')
 
@@ -225,6 +211,19 @@ def loader(dataset, table_name, column_name):
         print(f'Loading failed for {table_name}: {error}')
 
 
+# Staging is read once per run. Each stage declares the staging columns it needs and receives only those,
+# so the wide text columns are transferred once instead of once per stage.
+staging = StagingCache('stg_product_review', engine=db.engine)
+staging.declare('dim_product', ['product_id', 'product_name', 'category', 'about_product', 'img_link',
+                                'product_link', 'rating', 'rating_count'])
+staging.declare('dim_user', ['user_id', 'user_name'])
+staging.declare('dim_review', ['review_id', 'review_title', 'product_id', 'product_name', 'user_id', 'user_name'])
+staging.declare('fact_price', ['actual_price', 'discounted_price', 'discount_percentage', 'product_id', 'product_name'])
+
+# Surrogate keys of the dimension tables, kept in memory and looked up by business key.
+surrogate_keys = SurrogateKeys()
+
+
 # Defining the functions that specify the loading for each of the tables.
 # Because to_sql is used for loading there is no need to create an INSERT script for loading any longer.
 def load_dim_product():
@@ -232,11 +231,7 @@ def load_dim_product():
     column_name = 'product_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        dp = pd.read_sql('stg_product_review', engine)
-        product = dp[['product_id', 'product_name', 'category', 'about_product', 'img_link', 'product_link',
-                      'rating', 'rating_count']].copy()
+        product = staging.read('dim_product')
         product['rating_count'] = product['rating_count'].fillna(1)
         # It is best practice to deduplicate dim tables using business keys alone.
         product = product.drop_duplicates(subset=['product_id', 'product_name'], keep='first')
@@ -252,10 +247,7 @@ def load_dim_user():
     column_name = 'user_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        du = pd.read_sql('stg_product_review', engine)
-        user = du[['user_id', 'user_name']].copy()
+        user = staging.read('dim_user')
         user = user.drop_duplicates()
 
         loader(user, table_name, column_name)
@@ -269,11 +261,11 @@ def load_dim_review():
     column_name = 'review_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        drr = pd.read_sql('stg_product_review', engine)
-        review = drr[['review_id', 'review_title']].copy()
+        review = staging.read('dim_review')
+        review = surrogate_keys.attach(review, 'product')
+        review = surrogate_keys.attach(review, 'user')
         review = review.rename(columns={'review_title': 'review_content'})
+        review = review[['review_id', 'review_content', 'user_key', 'product_key']]
         review = review.drop_duplicates(subset=['review_id'], keep='first')
 
         loader(review, table_name, column_name)
@@ -282,72 +274,43 @@ def load_dim_review():
         print(f'Potential issue with transformation step: {error}')
 
 
-# Defining the function that fetches and loads surrogate keys to their respective target tables.
+# Defining the function that fetches the surrogate keys of the dimension tables into memory.
+# dim_review and the fact table get their keys from this map, so staging is never updated in place.
 def load_surrogate_keys():
-    connection = None
-
     try:
 
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
+        with db.connection() as connection:
 
             with connection.cursor() as cursor:
-                # Loading surrogate keys from dimension tables to staging.
-                product_key = '''UPDATE stg_product_review AS s SET product_key = p.product_key
-                FROM ebay.dim_product AS p WHERE s.product_id = p.product_id AND
-                s.product_name = p.product_name'''
-                cursor.execute(product_key)
-
-                user_key = '''UPDATE stg_product_review AS s SET user_key = u.user_key
-                FROM ebay.dim_user AS u WHERE s.user_id = u.user_id AND
-                s.user_name = u.user_name'''
-                cursor.execute(user_key)
-
-                # Loading dim_product table's surrogate keys from staging to dim_review.
-                load_prod_review = '''UPDATE ebay.dim_review r SET product_key = sa.product_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_prod_review)
-
-                # Loading dim_user table's surrogate keys from staging to dim_review.
-                load_user_review = '''UPDATE ebay.dim_review r SET user_key = sa.user_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_user_review)
-
-                print('All target tables updated with surrogate keys successfully')
+                surrogate_keys.fetch(cursor, 'product', 'ebay.dim_product', 'product_key',
+                                     {'product_id': 'product_id', 'product_name': 'product_name'})
+                surrogate_keys.fetch(cursor, 'user', 'ebay.dim_user', 'user_key',
+                                     {'user_id': 'user_id', 'user_name': 'user_name'})
+
+                print('Surrogate keys fetched successfully')
 
     except Exception as error:
         print(f'Loading surrogate keys failed: {error}')
 
-    finally:
-        if connection is not None:
-            connection.close()
-
 
 # Defining the function that transforms and loads data from staging to the fact table
 # together with all surrogate keys.
 def transform_load_fact_table():
     table_name = 'fact_price'
-    column_name = 'product_key'
+    column_name = 'product_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        dg = pd.read_sql('stg_product_review', engine)
-        fact = dg[['actual_price', 'discounted_price', 'discount_percentage',
-                   'product_key']].copy()
-
-        fact['discounted_price'] = fact['discounted_price'].str.replace('₹', '')
-        fact['discounted_price'] = fact['discounted_price'].str.replace(',', '').astype(float)
-        fact = fact.rename(columns={'discounted_price': 'discounted_price (PLN)'})
-        fact['actual_price'] = fact['actual_price'].str.replace('₹', '')
-        fact['actual_price'] = fact['actual_price'].str.replace(',', '').astype(float)
-        fact = fact.rename(columns={'actual_price': 'actual_price (PLN)'})
+        fact = staging.read('fact_price')
+        fact = surrogate_keys.attach(fact, 'product')
+        fact = fact[['actual_price', 'discounted_price', 'discount_percentage', 'product_key']]
+
+        # Prices such as '₹1,099' are parsed in one pass; cells that hold no readable number are reported
+        # and loaded as nulls instead of aborting the load.
+        fact, rejects = parse_numeric_columns(fact, ['discounted_price', 'actual_price'])
+        if not rejects.empty:
+            print(f'{len(rejects)} rows with unparseable prices loaded with null prices')
+        fact = fact.rename(columns={'discounted_price': 'discounted_price (PLN)',
+                                    'actual_price': 'actual_price (PLN)'})
         fact = fact.drop_duplicates(subset=['product_key'], keep='first')
 
         loader(fact, table_name, column_name)
@@ -356,14 +319,15 @@ def transform_load_fact_table():
         print(f'Potential issue with transformation step: {error}')
 
 
-extract_transform()
-
-load_dim_product()
-
-load_dim_user()
-
-load_dim_review()
-
-load_surrogate_keys()
+# The stages run through a scheduler that knows their dependencies, so independent stages
+# run concurrently on a bounded thread pool, each with its own pooled connection.
+scheduler = StageScheduler(max_workers=4)
+scheduler.add(extract_transform)
+scheduler.add(load_dim_product, after=[extract_transform])
+scheduler.add(load_dim_user, after=[extract_transform])
+scheduler.add(load_surrogate_keys, after=[load_dim_product, load_dim_user])
+scheduler.add(load_dim_review, after=[load_surrogate_keys])
+scheduler.add(transform_load_fact_table, after=[load_surrogate_keys])
+scheduler.run()
 
-transform_load_fact_table()
\ No newline at end of file
+print(db.report())
@@ -1,37 +1,57 @@
-import pandas as pd
-from sqlalchemy import create_engine
 import os
-import psycopg2
+import sys
 from datetime import datetime
 from datetime import timedelta
 from dotenv import load_dotenv
 from time import time
 
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe, copy_returning, copy_upsert
+from etl_utils.excel_stream import read_excel_chunks, on_date, as_date
+from etl_utils.explode import parallel_explode
+from etl_utils.numbers import parse_numeric_columns
+from etl_utils.scheduler import StageScheduler
+from etl_utils.staging_cache import StagingCache
+from etl_utils.surrogate_keys import SurrogateKeys
+
 load_dotenv()
-db_user = os.getenv('DB_USER')
-db_password = os.getenv('DB_PASS')
+
+# One pooled connection manager for the run, shared by every stage (psycopg2 and SQLAlchemy alike).
+db = ConnectionManager('Destination')
+
+# Source columns used by the pipeline. Only these are kept while the workbook is streamed.
+source_columns = ['product_id', 'product_name', 'category', 'discounted_price', 'actual_price', 'discount_percentage',
+                  'rating', 'rating_count', 'about_product', 'user_id', 'user_name', 'review_id', 'review_title',
+                  'img_link', 'product_link', 'modified_date']
 
 # Defining the function that extracts and transforms source data to staging.
 def extract_transform():
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        source_table = pd.read_excel('incremental load/ebay.xlsx')
-        source_table = source_table.copy()
+        engine = db.engine
 
         # This design allows customization of modified date e.g. allowing only data
         # modified yesterday to be fetched (mirroring an incremental loading design).
-        source_table['modified_date'] = pd.to_datetime(source_table['modified_date']).dt.date
-        source_table = source_table[source_table['modified_date'] == datetime.today().date() - timedelta(days=1)]
-
-        source_table['user_id'] = source_table['user_id'].str.split(',')
-        source_table['user_name'] = source_table['user_name'].str.split(',')
-        source_table['review_id'] = source_table['review_id'].str.split(',')
-        source_table['review_title'] = source_table['review_title'].str.split(',')
-        source_table['created_date'] = datetime.today().date()
-
-        source_table = source_table.explode(['user_id', 'user_name', 'review_id', 'review_title'])
-        source_table.to_sql('stg_product_review', engine, index=False, if_exists='append')
+        # The date filter and the column projection are applied while the workbook is streamed, so rows from
+        # other days are never turned into a DataFrame. Each chunk is transformed and appended to staging.
+        yesterday = datetime.today().date() - timedelta(days=1)
+        if_exists = 'append'
+
+        for source_table in read_excel_chunks('incremental load/ebay.xlsx', source_columns,
+                                              filters={'modified_date': on_date(yesterday)}):
+            source_table['modified_date'] = source_table['modified_date'].map(as_date)
+
+            # A 'created_date' column is created and added to the staging dataset
+            source_table['created_date'] = datetime.today().date()
+
+            # The packed user/review columns are split and exploded together in one pass. Rows whose columns hold
+            # different numbers of values cannot be paired up reliably and are set aside instead of failing the load.
+            source_table, rejects = parallel_explode(source_table, ['user_id', 'user_name', 'review_id', 'review_title'])
+            if not rejects.empty:
+                print(f'{len(rejects)} source rows rejected: packed user/review columns have different lengths')
+            source_table.to_sql('stg_product_review', engine, index=False, if_exists=if_exists)
+            if_exists = 'append'
 
         print('Extraction to staging completed.')
 
@@ -40,22 +60,28 @@ def extract_transform():
 
 
 # Defining the function that loads the data and updates the audit table when called.
-def loader(insert_query, dataset, table_name, column_name):
-    connection = None
+# The dataframe is streamed with COPY; when a conflict column is given the rows are copied to a
+# temporary table first and UPSERTed from there, with last_updated_date set on every updated row.
+# When 'returning' lists table columns, the values of every inserted or updated row are returned
+# as a dataframe (used to collect the generated surrogate keys).
+def loader(dataset, table_name, column_name, columns, conflict_column=None, returning=None):
     loaded_rows = 0
+    keys = None
 
     try:
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432,
-                options='-c search_path=ebay') as connection:
+        with db.connection(search_path='ebay') as connection:
 
             with connection.cursor() as cursor:
                 t1 = time()
-                psycopg2.extras.execute_batch(cursor, insert_query, dataset)
+                if returning is not None:
+                    keys = copy_returning(cursor, dataset, table_name, returning, columns,
+                                          [conflict_column] if conflict_column is not None else None,
+                                          extra_updates={'last_updated_date': 'CURRENT_DATE'})
+                elif conflict_column is None:
+                    copy_from_dataframe(cursor, dataset, table_name, columns)
+                else:
+                    copy_upsert(cursor, dataset, table_name, [conflict_column], columns,
+                                extra_updates={'last_updated_date': 'CURRENT_DATE'})
                 t2 = time()
                 print(f'Rows {loaded_rows} to {len(dataset)} loaded successfully for {table_name} in {t2-t1}s')
                 loaded_rows += len(dataset)
@@ -70,9 +96,22 @@ def loader(insert_query, dataset, table_name, column_name):
     except Exception as error:
         print(f'Loading failed for {table_name}: {error}')
 
-    finally:
-        if connection is not None:
-            connection.close()
+    return keys
+
+
+# Staging is read once per run. Each stage declares the staging columns it needs and receives only those.
+# Since staging holds the full history, only today's rows are fetched: the filter on created_date is
+# pushed down to the database instead of being applied to the whole table by every stage.
+staging = StagingCache('stg_product_review', where='created_date = CURRENT_DATE', engine=db.engine)
+staging.declare('dim_product', ['product_id', 'product_name', 'category', 'about_product', 'img_link',
+                                'product_link', 'rating', 'rating_count'])
+staging.declare('dim_user', ['user_id', 'user_name'])
+staging.declare('dim_review', ['review_id', 'review_title', 'product_id', 'product_name', 'user_id', 'user_name'])
+staging.declare('fact_price', ['discounted_price', 'actual_price', 'discount_percentage', 'product_id', 'product_name'])
+
+# Surrogate keys returned by today's dimension UPSERTs, kept in memory and looked up by business key.
+# The UPSERT returns the key of every inserted or updated row, which covers every business key staged today.
+surrogate_keys = SurrogateKeys()
 
 
 # Defining the functions that specify the loading for each of the tables.
@@ -82,56 +121,21 @@ def load_dim_product():
     column_name = 'product_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        dp = pd.read_sql('stg_product_review', engine)
-        product = dp[['product_id', 'product_name', 'category', 'about_product', 'img_link', 'product_link',
-                      'rating', 'rating_count', 'created_date']].copy()
-
-        # Fetch only today's product data from staging.
-        product['created_date'] = pd.to_datetime(product['created_date']).dt.date
-        product = product[product['created_date'] == datetime.today().date()]
-
+        # Only today's product data is fetched from staging.
+        product = staging.read('dim_product')
         product['rating_count'] = product['rating_count'].fillna(1)
         product = product.drop_duplicates(subset=['product_id', 'product_name'], keep='first')
-        product = product.to_dict('records')
 
         # UPSERT is used in loading the data. If any update happens, the last_modified_date
         # column is populated with today's date for audit purposes
         # (in other implementations, an appropriate id such as batch_id, time stamp, etc. can be used)
-        insert_query = '''INSERT into dim_product (
-        product_id,
-        product_name,
-        category,
-        about_product,
-        img_link,
-        product_link,
-        rating,
-        rating_count
-        ) 
-        VALUES (
-        %(product_id)s,
-        %(product_name)s,
-        %(category)s,
-        %(about_product)s,
-        %(img_link)s,
-        %(product_link)s,
-        %(rating)s,
-        %(rating_count)s
-        )
-        ON CONFLICT (product_id)
-        DO UPDATE 
-        SET product_name = excluded.product_name,
-            category = excluded.category,
-            about_product = excluded.about_product,
-            img_link = excluded.img_link,
-            product_link = excluded.product_link,
-            rating = excluded.rating,
-            rating_count = excluded.rating_count,
-            last_updated_date = CURRENT_DATE
-        '''
-
-        loader(insert_query, product, table_name, column_name)
+        columns = ['product_id', 'product_name', 'category', 'about_product', 'img_link', 'product_link',
+                   'rating', 'rating_count']
+
+        keys = loader(product, table_name, column_name, columns, conflict_column='product_id',
+                      returning=['product_key', 'product_id', 'product_name'])
+        surrogate_keys.register('product', keys, 'product_key', {'product_id': 'product_id',
+                                                                 'product_name': 'product_name'})
 
     except Exception as error:
         print(f'Potential issue with transformation step: {error}')
@@ -142,33 +146,13 @@ def load_dim_user():
     column_name = 'user_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        du = pd.read_sql('stg_product_review', engine)
-        user = du[['user_id', 'user_name', 'created_date']].copy()
-
-        # Fetch only today's user data from staging.
-        user['created_date'] = pd.to_datetime(user['created_date']).dt.date
-        user = user[user['created_date'] == datetime.today().date()]
-
+        # Only today's user data is fetched from staging.
+        user = staging.read('dim_user')
         user = user.drop_duplicates()
-        user = user.to_dict('records')
-
-        insert_query = '''INSERT into dim_user (
-        user_id,
-        user_name
-        ) 
-        VALUES (
-        %(user_id)s,
-        %(user_name)s
-        )
-        ON CONFLICT (user_id)
-        DO UPDATE 
-        SET user_name = excluded.user_name,
-            last_updated_date = CURRENT_DATE
-        '''
-
-        loader(insert_query, user, table_name, column_name)
+
+        keys = loader(user, table_name, column_name, ['user_id', 'user_name'], conflict_column='user_id',
+                      returning=['user_key', 'user_id', 'user_name'])
+        surrogate_keys.register('user', keys, 'user_key', {'user_id': 'user_id', 'user_name': 'user_name'})
 
     except Exception as error:
         print(f'Potential issue with transformation step: {error}')
@@ -179,85 +163,19 @@ def load_dim_review():
     column_name = 'review_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        drr = pd.read_sql('stg_product_review', engine)
-        review = drr[['review_id', 'review_title', 'created_date']].copy()
-
-        # Fetch only today's review data from staging.
-        review['created_date'] = pd.to_datetime(review['created_date']).dt.date
-        review = review[review['created_date'] == datetime.today().date()]
-
+        # Only today's review data is fetched from staging.
+        review = staging.read('dim_review')
+        review = surrogate_keys.attach(review, 'product')
+        review = surrogate_keys.attach(review, 'user')
         review = review.rename(columns={'review_title': 'review_content'})
         review = review.drop_duplicates(subset=['review_id'], keep='first')
-        review = review.to_dict('records')
-
-        insert_query = '''INSERT into dim_review (
-        review_id,
-        review_content
-        )
-        VALUES (
-        %(review_id)s,
-        %(review_content)s
-        )
-        ON CONFLICT (review_id)
-        DO UPDATE 
-        SET review_content = excluded.review_content,
-            last_updated_date = CURRENT_DATE
-        '''
-
-        loader(insert_query, review, table_name, column_name)
 
-    except Exception as error:
-        print(f'Potential issue with transformation step: {error}')
-
-
-# Defining the function that fetches and loads surrogate keys to their respective target tables.
-def load_surrogate_keys():
-    connection = None
-
-    try:
-
-        with psycopg2.connect(
-                host='localhost',
-                dbname='Destination',
-                user=db_user,
-                password=db_password,
-                port=5432) as connection:
-
-            with connection.cursor() as cursor:
-                # Loading surrogate keys from dimension tables to staging. For efficiency,
-                # only today's newly generated surrogate keys are added to staging.
-                product_key = '''UPDATE stg_product_review AS s SET product_key = p.product_key 
-                FROM ebay.dim_product AS p WHERE s.created_date = CURRENT_DATE AND 
-                s.product_id = p.product_id AND s.product_name = p.product_name'''
-                cursor.execute(product_key)
-
-                user_key = '''UPDATE stg_product_review AS s SET user_key = u.user_key 
-                FROM ebay.dim_user AS u WHERE s.created_date = CURRENT_DATE AND 
-                s.user_id = u.user_id AND s.user_name = u.user_name'''
-                cursor.execute(user_key)
-
-                # Loading dim_product table's surrogate keys from staging to dim_review.
-                load_prod_review = '''UPDATE ebay.dim_review r SET product_key = sa.product_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_prod_review)
-
-                # Loading dim_user table's surrogate keys from staging to dim_review.
-                load_user_review = '''UPDATE ebay.dim_review r SET user_key = sa.user_key
-                FROM stg_product_review sa
-                WHERE r.review_id = sa.review_id'''
-                cursor.execute(load_user_review)
-
-                print('All target tables updated with surrogate keys successfully.')
+        # The product and user keys are written with the review itself, so no UPDATE of dim_review is needed.
+        loader(review, table_name, column_name, ['review_id', 'review_content', 'user_key', 'product_key'],
+               conflict_column='review_id')
 
     except Exception as error:
-        print(f'Loading surrogate keys failed: {error}')
-
-    finally:
-        if connection is not None:
-            connection.close()
+        print(f'Potential issue with transformation step: {error}')
 
 
 # Defining the function that transforms and loads data from staging to the fact table
@@ -265,53 +183,36 @@ def load_surrogate_keys():
 
 def transform_load_fact_table():
     table_name = 'fact_price'
-    column_name = 'product_key'
+    column_name = 'product_id'
 
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        dg = pd.read_sql('stg_product_review', engine)
-        fact = dg[['discounted_price', 'actual_price', 'discount_percentage',
-                   'product_key', 'created_date']].copy()
+        # Only today's fact data is fetched from staging.
+        fact = staging.read('fact_price')
+        fact = surrogate_keys.attach(fact, 'product')
+        # Prices such as '₹1,099' are parsed in one pass; cells that hold no readable number are reported
+        # and loaded as nulls instead of aborting the load.
+        fact, rejects = parse_numeric_columns(fact, ['discounted_price', 'actual_price'])
+        if not rejects.empty:
+            print(f'{len(rejects)} rows with unparseable prices loaded with null prices')
+        fact = fact.drop_duplicates(subset=['product_key'], keep='first')
 
-        # Fetch only today's fact data from staging.
-        fact['created_date'] = pd.to_datetime(fact['created_date']).dt.date
-        fact = fact[fact['created_date'] == datetime.today().date()]
+        columns = {'actual_price': 'actual_price (PLN)', 'discounted_price': 'discounted_price (PLN)',
+                   'discount_percentage': 'discount_percentage', 'product_key': 'product_key'}
 
-        fact['discounted_price'] = fact['discounted_price'].str.replace('₹', '')
-        fact['discounted_price'] = fact['discounted_price'].str.replace(',', '').astype(float)
-        fact['actual_price'] = fact['actual_price'].str.replace('₹', '')
-        fact['actual_price'] = fact['actual_price'].str.replace(',', '').astype(float)
-        fact = fact.drop_duplicates(subset=['product_key'], keep='first')
-        fact = fact.to_dict('records')
-
-        insert_query = '''INSERT into fact_price (
-        "actual_price (PLN)",
-        "discounted_price (PLN)",
-        discount_percentage,
-        product_key
-        ) 
-        VALUES (
-        %(actual_price)s,
-        %(discounted_price)s,
-        %(discount_percentage)s,
-        %(product_key)s
-        )'''
-
-        loader(insert_query, fact, table_name, column_name)
+        loader(fact, table_name, column_name, columns)
 
     except Exception as error:
         print(f'Potential issue with transformation step: {error}')
 
 
-extract_transform()
-
-load_dim_product()
-
-load_dim_user()
-
-load_dim_review()
-
-load_surrogate_keys()
+# The stages run through a scheduler that knows their dependencies, so independent stages
+# run concurrently on a bounded thread pool, each with its own pooled connection.
+scheduler = StageScheduler(max_workers=4)
+scheduler.add(extract_transform)
+scheduler.add(load_dim_product, after=[extract_transform])
+scheduler.add(load_dim_user, after=[extract_transform])
+scheduler.add(load_dim_review, after=[load_dim_product, load_dim_user])
+scheduler.add(transform_load_fact_table, after=[load_dim_product])
+scheduler.run()
 
-transform_load_fact_table()
\ No newline at end of file
+print(db.report())
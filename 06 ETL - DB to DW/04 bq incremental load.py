@@ -1,49 +1,64 @@
 import pandas as pd
-from sqlalchemy import create_engine
 from pandas_gbq import to_gbq
 from google.cloud import bigquery
 from datetime import datetime
 from datetime import timedelta
 from time import time
+import os
+import sys
+
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.connections import ConnectionManager
+from etl_utils.db_stream import BatchDeduplicator, stream_table
+from etl_utils.explode import parallel_explode
+from etl_utils.numbers import parse_numeric_columns
 
 client = bigquery.Client()
 
+# The source table lives in the local Postgres database (connected through the default socket).
+source_db = ConnectionManager('Destination', host=None)
+
 # Defining the function that extracts and transforms source data to staging.
 def extract_transform():
     try:
-        engine = create_engine('postgresql:///Destination')
-
-        source_table = pd.read_sql('bq_source_data', engine)
-        source_table = source_table.copy()
-
+        # Only the rows modified on the day of interest are read: the filter is pushed down to the database (as a
+        # range on modified_date, so an index on the column can be used) and the table is streamed in batches
+        # through a server-side cursor, so each batch is transformed and uploaded while the next one is being
+        # fetched. Duplicate transformed rows are dropped across all batches, not only within each batch.
         # This design allows the customization of modified date e.g. allowing only data
         # modified yesterday to be fetched (for incremental loading).
-        source_table['modified_date'] = pd.to_datetime(source_table['modified_date']).dt.date
-        source_table = source_table[source_table['modified_date'] == datetime.today().date() - timedelta(days=1)]
-
-        source_table['user_id'] = source_table['user_id'].str.split(',')
-        source_table['user_name'] = source_table['user_name'].str.split(',')
-        source_table['review_id'] = source_table['review_id'].str.split(',')
-        source_table['review_title'] = source_table['review_title'].str.split(',')
-        source_table = source_table.explode(['user_id', 'user_name', 'review_id', 'review_title'])
-
-        source_table['rating_count'] = source_table['rating_count'].fillna(1)
-        source_table['discounted_price'] = source_table['discounted_price'].str.replace('₹', '')
-        source_table['discounted_price'] = source_table['discounted_price'].str.replace(',', '').astype(float)
-        source_table['actual_price'] = source_table['actual_price'].str.replace('₹', '')
-        source_table['actual_price'] = source_table['actual_price'].str.replace(',', '').astype(float)
-
-        # source_table = source_table.rename(columns={'review_title': 'review_content'})
-        # source_table = source_table.rename(columns={'discounted_price': 'discounted_price_pln'})
-        # source_table = source_table.rename(columns={'actual_price': 'actual_price_pln'})
-
-        source_table = source_table.drop_duplicates()
-
-        # Finally, the data is assigned a created date of 'today' for audit purposes before loading to staging
-        source_table['created_date'] = datetime.today().date()
-
-        to_gbq(source_table, 'my-dw-project-01.bq_upload.stg_bq_project',
-               project_id='my-dw-project-01', if_exists='append')
+        modified_date = datetime.today().date() - timedelta(days=1)
+        deduplicate = BatchDeduplicator()
+        modified_on_day = 'modified_date >= %(modified_date)s AND modified_date < %(modified_date)s + 1'
+        for source_table in stream_table(source_db, 'bq_source_data', where=modified_on_day,
+                                         params={'modified_date': modified_date}, distinct=True):
+            source_table['modified_date'] = pd.to_datetime(source_table['modified_date']).dt.date
+
+            # The packed user/review columns are split and exploded together in one pass. Rows whose columns hold
+            # different numbers of values cannot be paired up reliably and are set aside instead of failing the load.
+            source_table, rejects = parallel_explode(source_table, ['user_id', 'user_name', 'review_id', 'review_title'])
+            if not rejects.empty:
+                print(f'{len(rejects)} source rows rejected: packed user/review columns have different lengths')
+
+            source_table['rating_count'] = source_table['rating_count'].fillna(1)
+            # Prices such as '₹1,099' are parsed in one pass; cells that hold no readable number are reported
+            # and loaded as nulls instead of aborting the load.
+            source_table, rejects = parse_numeric_columns(source_table, ['discounted_price', 'actual_price'])
+            if not rejects.empty:
+                print(f'{len(rejects)} rows with unparseable prices loaded with null prices')
+
+            # source_table = source_table.rename(columns={'review_title': 'review_content'})
+            # source_table = source_table.rename(columns={'discounted_price': 'discounted_price_pln'})
+            # source_table = source_table.rename(columns={'actual_price': 'actual_price_pln'})
+
+            source_table = deduplicate(source_table)
+
+            # Finally, the data is assigned a created date of 'today' for audit purposes before loading to staging
+            source_table['created_date'] = datetime.today().date()
+
+            to_gbq(source_table, 'my-dw-project-01.bq_upload.stg_bq_project',
+                   project_id='my-dw-project-01', if_exists='append')
 
         return print('Extraction to staging completed.')
 
@@ -3,6 +3,13 @@ from pandas_gbq import read_gbq
 from pandas_gbq import to_gbq
 from datetime import datetime
 from time import time
+import os
+import sys
+
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.explode import parallel_explode
+from etl_utils.numbers import parse_numeric_columns
 
 client = bigquery.Client()
 
@@ -32,25 +39,20 @@ def extract_transform():
         ds = read_gbq('bigdata_load.bq_raw_staging', 'my-dw-project-01')
         source_table = ds.copy()
 
-        source_table['user_id'] = source_table['user_id'].astype(str)
-        source_table['user_name'] = source_table['user_name'].astype(str)
-        source_table['review_id'] = source_table['review_id'].astype(str)
-        source_table['review_title'] = source_table['review_title'].astype(str)
 
-        source_table['user_id'] = source_table['user_id'].str.split(',')
-        source_table['user_name'] = source_table['user_name'].str.split(',')
-        source_table['review_id'] = source_table['review_id'].str.split(',')
-        source_table['review_title'] = source_table['review_title'].str.split(',')
-        source_table = source_table.explode(['user_id', 'user_name', 'review_id', 'review_title'])
+        # The packed user/review columns are split and exploded together in one pass. Rows whose columns hold
+        # different numbers of values cannot be paired up reliably and are set aside instead of failing the load.
+        source_table, rejects = parallel_explode(source_table, ['user_id', 'user_name', 'review_id', 'review_title'])
+        if not rejects.empty:
+            print(f'{len(rejects)} source rows rejected: packed user/review columns have different lengths')
 
         source_table['rating_count'] = source_table['rating_count'].fillna(1)
 
-        source_table['discounted_price'] = source_table['discounted_price'].astype(str)
-        source_table['discounted_price'] = source_table['discounted_price'].str.replace('₹', '')
-        source_table['discounted_price'] = source_table['discounted_price'].str.replace(',', '').astype(float)
-        source_table['actual_price'] = source_table['actual_price'].astype(str)
-        source_table['actual_price'] = source_table['actual_price'].str.replace('₹', '')
-        source_table['actual_price'] = source_table['actual_price'].str.replace(',', '').astype(float)
+        # Prices such as '₹1,099' are parsed in one pass; cells that hold no readable number are reported
+        # and loaded as nulls instead of aborting the load.
+        source_table, rejects = parse_numeric_columns(source_table, ['discounted_price', 'actual_price'])
+        if not rejects.empty:
+            print(f'{len(rejects)} rows with unparseable prices loaded with null prices')
 
         # source_table = source_table.rename(columns={'review_title': 'review_content'})
         # source_table = source_table.rename(columns={'discounted_price': 'discounted_price_pln'})
@@ -1,39 +1,55 @@
-import requests
+import os
+import sys
 from google.cloud import storage
-import json
 
-prd_url = 'https://fakestoreapi.com/products'
-sale_url = 'https://fakestoreapi.com/carts'
-user_url = 'https://fakestoreapi.com/users'
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.api_fetch import download_all
+from etl_utils.http_cache import ResponseCache
+from etl_utils.json_stream import iter_json_file, write_json_array
 
+# FAKESTORE_URL points the extraction at another server, e.g. the local stub in etl_utils/fakestore_stub.py.
+api_url = os.getenv('FAKESTORE_URL', 'https://fakestoreapi.com')
+prd_url = f'{api_url}/products'
+sale_url = f'{api_url}/carts'
+user_url = f'{api_url}/users'
 
-def upload_from_api(url, bucket_name, destination_blob_name):
-    # Step 1: Fetch data from API
-    response = requests.get(url)
-    response.raise_for_status()  # Raises HTTPError for bad responses
-    # This converts the json data into python objects of lists and dictionaries (parsed JSON data).
-    data = response.json()
+# Responses are cached on disk and revalidated with conditional requests. A payload that has not changed
+# since it was last uploaded to a blob is not uploaded again, so the blob (and its md5 hash, which the
+# api pipeline checks before running its BigQuery load jobs) stays as it is.
+response_cache = ResponseCache()
 
+
+def upload_from_api(response, url, bucket_name, destination_blob_name):
     # Step 2: Upload data to GCS
+    destination = f'gs://{bucket_name}/{destination_blob_name}'
+    if not response_cache.needs_load([url], destination):
+        return print(f'{url} unchanged since its last upload, {destination_blob_name} left as it is')
+
     client = storage.Client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
-    # Since the data is in the form of a JSON array, convert the data to a JSON string and upload.
-    # Without doing this, if you tried to upload this raw Python object you'd get a TypeError
-    # because GCS expects a string or bytes — not a dict or list.
-    # This is accomplished with json.dumps() used below.
+    # Since the data is in the form of a JSON array, it is written back out as a JSON array (indented the
+    # way json.dumps(data, indent=2) would). The cached response is read in batches of records and each batch
+    # is written to the blob as it is converted, through a resumable upload, so neither the parsed payload
+    # nor its JSON string is ever held in memory as a whole.
 
-    blob.upload_from_string(
-        data=json.dumps(data, indent=2),
-        content_type="application/json"
-    )
+    with blob.open('w', content_type="application/json") as file:
+        write_json_array(file, iter_json_file(response), indent=2)
 
+    response_cache.mark_loaded([url], destination)
     print(f'Data uploaded to GCS bucket:{bucket_name} and named as {destination_blob_name}')
 
 
-upload_from_api(prd_url, 'my-dw-bucket-02', 'bq_source_data_01.json')
+# Step 1: Fetch data from the API. All three endpoints are requested concurrently over one pooled HTTP session,
+# with retries on failures; a response that still fails raises instead of being uploaded.
+# The responses are streamed to the response cache on disk; upload_from_api() parses them from there
+# into python objects of lists and dictionaries (parsed JSON data), one batch of records at a time.
+data = download_all({'products': prd_url, 'carts': sale_url, 'users': user_url}, response_cache)
+
+upload_from_api(data['products'], prd_url, 'my-dw-bucket-02', 'bq_source_data_01.json')
 
-upload_from_api(sale_url, 'my-dw-bucket-02', 'bq_source_data_02.json')
+upload_from_api(data['carts'], sale_url, 'my-dw-bucket-02', 'bq_source_data_02.json')
 
-upload_from_api(user_url, 'my-dw-bucket-02', 'bq_source_data_03.json')
\ No newline at end of file
+upload_from_api(data['users'], user_url, 'my-dw-bucket-02', 'bq_source_data_03.json')
\ No newline at end of file
@@ -1,20 +1,31 @@
-import requests
+import os
+import sys
 from google.cloud import storage
-import json
 
-prd_url = 'https://fakestoreapi.com/products'
-sale_url = 'https://fakestoreapi.com/carts'
-user_url = 'https://fakestoreapi.com/users'
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.api_fetch import download_all
+from etl_utils.http_cache import ResponseCache
+from etl_utils.json_stream import iter_json_file, write_ndjson
 
+# FAKESTORE_URL points the extraction at another server, e.g. the local stub in etl_utils/fakestore_stub.py.
+api_url = os.getenv('FAKESTORE_URL', 'https://fakestoreapi.com')
+prd_url = f'{api_url}/products'
+sale_url = f'{api_url}/carts'
+user_url = f'{api_url}/users'
 
-def upload_from_api(url, bucket_name, destination_blob_name):
-    # Step 1: Fetch data from API
-    response = requests.get(url)
-    response.raise_for_status()  # Raises HTTPError for bad responses
-    # This converts the json data into python objects of lists and dictionaries (parsed JSON data).
-    data = response.json()
+# Responses are cached on disk and revalidated with conditional requests. A payload that has not changed
+# since it was last uploaded to a blob is not uploaded again, so the blob (and its md5 hash, which the
+# api pipeline checks before running its BigQuery load jobs) stays as it is.
+response_cache = ResponseCache()
 
+
+def upload_from_api(response, url, bucket_name, destination_blob_name):
     # Step 2: Upload data to GCS
+    destination = f'gs://{bucket_name}/{destination_blob_name}'
+    if not response_cache.needs_load([url], destination):
+        return print(f'{url} unchanged since its last upload, {destination_blob_name} left as it is')
+
     client = storage.Client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
@@ -22,18 +33,25 @@ def upload_from_api(url, bucket_name, destination_blob_name):
     # Using json.dumps() will convert the Python object (list of dictionaries) into a JSON formatted string
     # however there are cases where this is not ideal. For example, BigQuery has a limitation on how the JSON
     # array is structured. It expects one JSON object (dictionary) per line and also not wrapped in [...]
-    # (like a list would be). This JSON form is called newline delimited json (NDJSON) created below:
+    # (like a list would be). This JSON form is called newline delimited json (NDJSON) created below.
+    # The cached response is read in batches of records and written to the blob batch by batch through a
+    # resumable upload, so the payload is never held in memory as a whole.
 
-    blob.upload_from_string(
-        data='\n'.join(json.dumps(record) for record in data),
-        content_type="application/json"
-    )
+    with blob.open('w', content_type="application/json") as file:
+        write_ndjson(file, iter_json_file(response))
 
+    response_cache.mark_loaded([url], destination)
     print(f'NDJSON uploaded to GCS bucket:{bucket_name} and named as {destination_blob_name}')
 
 
-upload_from_api(prd_url, 'my-dw-bucket-02', 'bq_source_data_04.json')
+# Step 1: Fetch data from the API. All three endpoints are requested concurrently over one pooled HTTP session,
+# with retries on failures; a response that still fails raises instead of being uploaded.
+# The responses are streamed to the response cache on disk; upload_from_api() parses them from there
+# into python objects of lists and dictionaries (parsed JSON data), one batch of records at a time.
+data = download_all({'products': prd_url, 'carts': sale_url, 'users': user_url}, response_cache)
+
+upload_from_api(data['products'], prd_url, 'my-dw-bucket-02', 'bq_source_data_04.json')
 
-upload_from_api(sale_url, 'my-dw-bucket-02', 'bq_source_data_05.json')
+upload_from_api(data['carts'], sale_url, 'my-dw-bucket-02', 'bq_source_data_05.json')
 
-upload_from_api(user_url, 'my-dw-bucket-02', 'bq_source_data_06.json')
\ No newline at end of file
+upload_from_api(data['users'], user_url, 'my-dw-bucket-02', 'bq_source_data_06.json')
\ No newline at end of file
@@ -1,21 +1,55 @@
+import os
+import sys
 import pandas as pd
 from google.cloud import bigquery
+from google.cloud import storage
 from pandas_gbq import read_gbq
 from pandas_gbq import to_gbq
 from time import time
 
+# The shared etl_utils package lives at the repository root, one level above this project folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from etl_utils.flatten import PRODUCTS, SALES, USERS
+from etl_utils.http_cache import ResponseCache
+from etl_utils.masking import Masker
+
 client = bigquery.Client()
 
+# The loaders only rewrite a source blob when its API payload changed, so an unchanged blob keeps its md5
+# hash. The md5 hashes of the three blobs loaded last are recorded in the response cache, and when none of
+# them changed the BigQuery load jobs, the staging rebuild and the appends to the target tables are skipped.
+source_uris = ['gs://my-dw-bucket-02/bq_source_data_04.json', 'gs://my-dw-bucket-02/bq_source_data_05.json',
+               'gs://my-dw-bucket-02/bq_source_data_06.json']
+response_cache = ResponseCache()
+
+# Passwords are redacted and phone numbers replaced by keyed pseudonyms of the same format (etl_utils/masking.py),
+# so the same phone number masks to the same value on every load. The key comes from PII_TOKEN_KEY.
+user_masking = Masker({'password': 'redact', 'phone': 'format'})
+
+
+def source_versions(uris):
+    # md5 hash of every source blob (None for a blob that does not exist).
+    storage_client = storage.Client()
+    versions = {}
+    for uri in uris:
+        bucket_name, blob_name = uri[len('gs://'):].split('/', 1)
+        blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+        versions[uri] = blob.md5_hash if blob is not None else None
+    return versions
+
+
 # The following functions combine fetching raw data blobs from a GCS bucket, initially loading
 # them to a BigQuery table, then transforming and loading them to another (clean) table, before they are combined
 # into one cleaned staging table.
+# The staging tables are replaced on every run, so a run that failed part-way can simply be run again.
 def extract_transform_product():
     try:
         uri = 'gs://my-dw-bucket-02/bq_source_data_04.json'
         destination_table = 'bigdata_api.stg_prod_raw'
 
         job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
         )
 
         load_job = client.load_table_from_uri(uri, destination_table, job_config=job_config)
@@ -26,14 +60,17 @@ def extract_transform_product():
         dp = read_gbq('bigdata_api.stg_prod_raw', 'my-dw-project-01')
         raw_prod = dp.copy()
 
-        clean_prod = raw_prod.join(pd.json_normalize(raw_prod['rating']))
-        clean_prod = clean_prod.drop(columns=['rating'])
-        to_gbq(clean_prod, 'bigdata_api.stg_prod_clean', project_id='my-dw-project-01', if_exists='fail')
+        # The nested rating record is flattened into its rate and count fields (etl_utils/flatten.py).
+        clean_prod = PRODUCTS.frame(raw_prod)
+        to_gbq(clean_prod, 'bigdata_api.stg_prod_clean', project_id='my-dw-project-01', if_exists='replace')
 
         print('Product data transformed successfully.')
 
+        return True
+
     except Exception as error:
         print(error)
+        return False
 
 
 def extract_transform_sales():
@@ -42,7 +79,8 @@ def extract_transform_sales():
         destination_table = 'bigdata_api.stg_sales_raw'
 
         job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
         )
 
         load_job = client.load_table_from_uri(uri, destination_table, job_config=job_config)
@@ -53,21 +91,21 @@ def extract_transform_sales():
         ds = read_gbq('bigdata_api.stg_sales_raw', 'my-dw-project-01')
         raw_sales = ds.copy()
 
-        raw_sales_explode = raw_sales.explode('products')
-        products_expanded = raw_sales_explode['products'].apply(pd.Series)
-        clean_sales = pd.concat([raw_sales_explode, products_expanded], axis=1)
-        # Concat is used here as an alternative to join().
-        clean_sales = clean_sales.drop(columns=['products'])
+        # One row per cart line, in one pass over the carts instead of explode() + apply(pd.Series).
+        clean_sales = SALES.frame(raw_sales)
         clean_sales['date'] = pd.to_datetime(clean_sales['date']).dt.date
         clean_sales['month'] = pd.to_datetime(clean_sales['date']).dt.month
         clean_sales['year'] = pd.to_datetime(clean_sales['date']).dt.year
         to_gbq(clean_sales, 'bigdata_api.stg_sales_clean', project_id='my-dw-project-01',
-               if_exists='fail')
+               if_exists='replace')
 
         print('Sales data transformed successfully.')
 
+        return True
+
     except Exception as error:
         print(error)
+        return False
 
 
 def extract_transform_user():
@@ -76,7 +114,8 @@ def extract_transform_user():
         destination_table = 'bigdata_api.stg_user_raw'
 
         job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON, autodetect=True,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
         )
 
         load_job = client.load_table_from_uri(uri, destination_table, job_config=job_config)
@@ -87,27 +126,28 @@ def extract_transform_user():
         du = read_gbq('bigdata_api.stg_user_raw', 'my-dw-project-01')
         raw_user = du.copy()
 
-        raw_user = raw_user.join(pd.json_normalize(raw_user['address']))
-        raw_user = raw_user.rename(columns={'geolocation.lat': 'geolocation_lat'})
-        raw_user = raw_user.rename(columns={'geolocation.long': 'geolocation_long'})
-        raw_user = raw_user.join(pd.json_normalize(raw_user['name']))
-        raw_user = raw_user.drop(columns=['address'])
-        clean_user = raw_user.drop(columns=['name'])
+        # The nested address (with its geolocation) and name records are flattened into their fields.
+        clean_user = USERS.frame(raw_user)
+        clean_user = clean_user.rename(columns={'geolocation.lat': 'geolocation_lat'})
+        clean_user = clean_user.rename(columns={'geolocation.long': 'geolocation_long'})
         clean_user['firstname'] = clean_user['firstname'].str.capitalize()
         clean_user['lastname'] = clean_user['lastname'].str.capitalize()
-        to_gbq(clean_user, 'bigdata_api.stg_user_clean', project_id='my-dw-project-01', if_exists='fail')
+        to_gbq(clean_user, 'bigdata_api.stg_user_clean', project_id='my-dw-project-01', if_exists='replace')
 
         print('User data transformed successfully.')
 
+        return True
+
     except Exception as error:
         print(error)
+        return False
 
 
 # Creating a combined staging table from all 3 cleaned data sources.
 def create_combo_staging():
     try:
         create_combined_stg_table = '''
-        CREATE TABLE bigdata_api.stg_combo_clean_table AS
+        CREATE OR REPLACE TABLE bigdata_api.stg_combo_clean_table AS
         SELECT a.id, `userId`, date, month, year, a.__v, `productId`, quantity, title, price, 
         description, category, image, rate, count, email, username, 
         password, phone, city, street, number, zipcode, geolocation_lat, 
@@ -139,9 +179,13 @@ def create_combo_staging():
 
         except Exception as error:
             print(f'Issue with creating surrogate key columns: {error}')
+            return False
+
+        return True
 
     except Exception as error:
         print(f'Issue with combo staging table creation: {error}')
+        return False
 
 
 # Creating the dimension and fact tables
@@ -220,8 +264,11 @@ def create_tables():
 
         print('All target tables created successfully.')
 
+        return True
+
     except Exception as error:
         print(f'Issue with table creation: {error}')
+        return False
 
 
 # Loading the target tables.
@@ -242,8 +289,11 @@ def load_dim_product():
 
         print(f'Rows 0 to {len(product)} loaded successfully for {table_name} in {load_time}s')
 
+        return True
+
     except Exception as error:
         print(f'Issue with loading {table_name}: {error}')
+        return False
 
 
 def load_dim_user():
@@ -257,8 +307,7 @@ def load_dim_user():
             columns={'userId': 'user_id', 'firstname': 'first_name', 'lastname': 'last_name',
                      'geolocation_lat': 'latitude', 'geolocation_long': 'longitude'}
         )
-        user['password'] = '***Masked***'
-        user['phone'] = '***Masked***'
+        user = user_masking.apply(user)
         user['street'] = user['street'].str.title()
         user = user.drop_duplicates(subset=['user_id', 'first_name', 'last_name'], keep='first')
 
@@ -270,8 +319,11 @@ def load_dim_user():
 
         print(f'Rows 0 to {len(user)} loaded successfully for {table_name} in {load_time}s')
 
+        return True
+
     except Exception as error:
         print(f'Issue with loading {table_name}: {error}')
+        return False
 
 
 def load_dim_date():
@@ -291,8 +343,11 @@ def load_dim_date():
 
         print(f'Rows 0 to {len(date)} loaded successfully for {table_name} in {load_time}s')
 
+        return True
+
     except Exception as error:
         print(f'Issue with loading {table_name}: {error}')
+        return False
 
 
 # Filling surrogate key columns with the actual surrogate keys.
@@ -348,8 +403,11 @@ def upload_surrogate_keys():
         query_job = client.query(update_dim_user)
         query_job.result()
 
+        return True
+
     except Exception as error:
         print(f'Issue with surrogate keys loading step: {error}')
+        return False
 
 
 def load_fact_sale():
@@ -369,19 +427,27 @@ def load_fact_sale():
 
         print(f'Rows 0 to {len(fact)} loaded successfully for {table_name} in {load_time}s')
 
+        return True
+
     except Exception as error:
         print(f'Issue with loading {table_name}: {error}')
-
-
-extract_transform_product()
-extract_transform_sales()
-extract_transform_user()
-
-create_combo_staging()
-create_tables()
-
-load_dim_product()
-load_dim_user()
-load_dim_date()
-upload_surrogate_keys()
-load_fact_sale()
\ No newline at end of file
+        return False
+
+
+versions = source_versions(source_uris)
+
+if not response_cache.needs_load(source_uris, 'bigdata_api', versions):
+    print('Source files unchanged since the last load, BigQuery load jobs skipped')
+else:
+    # Every stage returns whether it succeeded. The stages build on each other, so the run stops at the first
+    # one that failed, and the source versions are only marked as loaded when all of them succeeded: a failed
+    # or partial load is retried on the next run instead of being skipped as unchanged.
+    stages = [extract_transform_product, extract_transform_sales, extract_transform_user,
+              create_combo_staging, create_tables,
+              load_dim_product, load_dim_user, load_dim_date, upload_surrogate_keys, load_fact_sale]
+
+    failed = next((stage for stage in stages if not stage()), None)
+    if failed is None:
+        response_cache.mark_loaded(source_uris, 'bigdata_api', versions)
+    else:
+        print(f'Load stopped at {failed.__name__}: the sources are not marked as loaded and will be loaded again')
@@ -0,0 +1,3 @@
+# Shared building blocks used by the pipelines in the numbered project folders.
+# The project folders contain spaces and start with digits, so they cannot be imported from each other;
+# any logic that more than one pipeline needs lives here instead and is imported as etl_utils.<module>.
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import random
+from time import time
+
+import aiohttp
+
+# Concurrent API extraction. The API pipelines fetched their endpoints one after another with
+# requests.get(), each call opening a new connection (TCP and TLS handshake) and waiting for the previous
+# response before the next request was sent. Here all endpoints are requested at once from a single
+# pooled aiohttp session: connections are kept alive and reused, at most 'concurrency' requests are in
+# flight at a time, and failed requests (connection errors, timeouts, 429 and 5xx responses) are retried
+# with exponential backoff and jitter, honouring a Retry-After header when the server sends one.
+#
+# fetch_all_json() is the synchronous entry point for the pipeline scripts; fetch_all() can be awaited
+# from code that already runs an event loop. download_all() streams large payloads to the on-disk response
+# cache instead of holding them in memory.
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+def _delay(attempt, backoff, retry_after=None):
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Full jitter: a random delay up to the exponential bound, so retries from many requests spread out.
+    return random.uniform(0, backoff * 2 ** attempt)
+
+
+async def fetch_json(session, url, semaphore, retries=3, backoff=0.5, stats=None, cache=None, parse=True):
+    # GETs one URL and returns the parsed JSON body, retrying transient failures up to 'retries' times.
+    # With a ResponseCache (etl_utils/http_cache.py) a payload within its TTL is served without a request,
+    # and otherwise the request is conditional: a 304 answer returns the cached payload.
+    # parse=False (cache required) streams the body to the cache chunk by chunk and returns the path of the
+    # cached file instead, so the payload never has to fit in memory (see etl_utils/json_stream.py).
+    if cache is not None and cache.fresh(url):
+        if stats is not None:
+            stats['cached'] += 1
+        return _cached(cache, url, parse)
+    headers = cache.validators(url) if cache is not None else {}
+
+    for attempt in range(retries + 1):
+        retry_after = None
+        try:
+            async with semaphore:
+                async with session.get(url, headers=headers) as response:
+                    if response.status in RETRY_STATUSES and attempt < retries:
+                        retry_after = response.headers.get('Retry-After')
+                        raise FetchError(f'{url} returned {response.status}')
+                    if response.status == 304 and headers:
+                        cache.not_modified(url, response.headers)
+                        size = None
+                    elif not parse:
+                        response.raise_for_status()
+                        size = 0
+                        with cache.writer(url, response.headers) as file:
+                            async for chunk in response.content.iter_chunked(1 << 16):
+                                file.write(chunk)
+                                size += len(chunk)
+                    else:
+                        response.raise_for_status()
+                        body = await response.read()
+                        size = len(body)
+                        if cache is not None:
+                            cache.store(url, body, response.headers)
+
+            if stats is not None:
+                stats['requests'] += 1
+                if size is None:
+                    stats['cached'] += 1
+                else:
+                    stats['bytes'] += size
+            if size is None or not parse:
+                return _cached(cache, url, parse)
+            # Large bodies are parsed on a worker thread so the other downloads keep going meanwhile.
+            if len(body) > 1 << 20:
+                return await asyncio.to_thread(json.loads, body)
+            return json.loads(body)
+
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, FetchError) as error:
+            if attempt == retries:
+                raise FetchError(f'{url} failed after {retries + 1} attempts: {error}') from error
+            if stats is not None:
+                stats['retries'] += 1
+            await asyncio.sleep(_delay(attempt, backoff, retry_after))
+
+
+def _cached(cache, url, parse):
+    return json.loads(cache.read(url)) if parse else cache.path(url)
+
+
+async def fetch_all(urls, concurrency=8, retries=3, backoff=0.5, timeout=60, stats=None, cache=None, parse=True):
+    # Fetches every URL concurrently over one keep-alive connection pool.
+    # urls: a list of URLs, or a dict of {name: url}; the result has the same shape with the parsed payloads
+    # (with parse=False: the paths of the cached bodies).
+    # cache: optional ResponseCache; its manifest is saved once all payloads are in.
+    names = list(urls) if isinstance(urls, dict) else None
+    targets = list(urls.values()) if isinstance(urls, dict) else list(urls)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        payloads = await asyncio.gather(*(fetch_json(session, url, semaphore, retries, backoff, stats, cache, parse)
+                                          for url in targets))
+    if cache is not None:
+        cache.save()
+
+    if names is not None:
+        return dict(zip(names, payloads))
+    return payloads
+
+
+def fetch_all_json(urls, concurrency=8, retries=3, backoff=0.5, timeout=60, cache=None):
+    # Synchronous wrapper around fetch_all(); prints how many requests, bytes and retries the fetch took,
+    # and how many payloads came from the cache (unexpired, or confirmed unchanged by a 304).
+    stats = {'requests': 0, 'bytes': 0, 'retries': 0, 'cached': 0}
+    started = time()
+    payloads = asyncio.run(fetch_all(urls, concurrency, retries, backoff, timeout, stats, cache))
+    print(f"Fetched {stats['requests']} endpoint(s), {stats['bytes'] / 1e6:.1f} MB in {time() - started:.2f}s "
+          f"({stats['retries']} retries, {stats['cached']} served from cache)")
+    return payloads
+
+
+def download_all(urls, cache, concurrency=8, retries=3, backoff=0.5, timeout=60):
+    # Like fetch_all_json(), but streams every body into the ResponseCache without parsing it, and returns
+    # the cached file of each URL (a list, or a dict for a dict of URLs). The files are then read in record
+    # batches with etl_utils.json_stream.iter_json_file().
+    stats = {'requests': 0, 'bytes': 0, 'retries': 0, 'cached': 0}
+    started = time()
+    paths = asyncio.run(fetch_all(urls, concurrency, retries, backoff, timeout, stats, cache, parse=False))
+    print(f"Downloaded {stats['requests']} endpoint(s), {stats['bytes'] / 1e6:.1f} MB in {time() - started:.2f}s "
+          f"({stats['retries']} retries, {stats['cached']} served from cache)")
+    return paths
@@ -0,0 +1,87 @@
+import pandas as pd
+import pyarrow as pa
+
+from etl_utils.numbers import parse_numbers
+
+# Schema-driven type coercion. The movies extract used to convert column by column with pd.to_numeric()
+# and astype(), fill the nulls again per dtype group found with select_dtypes(), and finally run
+# df.where(pd.notna(df), None), which turns every column into object dtype just so that nulls reach the
+# database as NULL. Here the schema, the default fills and the null policy are applied together, each
+# column is converted once into an Arrow-backed typed array, and the number of values that could not be
+# converted is counted per column. Nulls stay typed nulls (<NA>) until the writer (COPY or to_sql)
+# emits them as SQL NULL.
+#
+# Schema types are the ones the pipelines already use: 'string', 'Int64', 'float', 'bool' and 'datetime'.
+
+ARROW_TYPES = {
+    'string': pa.string(),
+    'Int64': pa.int64(),
+    'float': pa.float64(),
+    'bool': pa.bool_(),
+    'datetime': pa.timestamp('us'),
+}
+
+# Default fill per schema type, the same defaults the pipelines applied per dtype group.
+# Dates have no sensible default and stay null.
+DEFAULT_FILLS = {'string': 'NA', 'Int64': 0, 'float': 0.0, 'bool': False}
+
+BOOLEAN_TEXT = {'true': True, 't': True, 'yes': True, 'y': True, '1': True,
+                'false': False, 'f': False, 'no': False, 'n': False, '0': False}
+
+
+def _present(series):
+    # Cells that hold a value at all; blank text counts as missing rather than as a failed conversion.
+    present = series.notna()
+    if not pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_datetime64_any_dtype(series):
+        present &= series.astype('string').str.strip().ne('').fillna(False)
+    return present.to_numpy(dtype=bool)
+
+
+def _convert(series, kind):
+    # Returns (values, failures) where failures counts the cells that held a value of the wrong type.
+    if kind in ('Int64', 'float'):
+        values, unparseable = parse_numbers(series, dtype='Int64' if kind == 'Int64' else 'float64')
+        return values, int(unparseable.sum())
+
+    if kind == 'string':
+        return series.astype('string'), 0
+
+    if kind == 'datetime':
+        values = pd.to_datetime(series, errors='coerce')
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        return values, int((_present(series) & values.isna().to_numpy()).sum())
+
+    if kind == 'bool':
+        if pd.api.types.is_bool_dtype(series):
+            return series.astype('boolean'), 0
+        values = series.astype('string').str.strip().str.lower().map(BOOLEAN_TEXT).astype('boolean')
+        return values, int((_present(series) & values.isna().to_numpy()).sum())
+
+    raise ValueError(f'Unknown schema type {kind} for column {series.name}')
+
+
+def coerce_columns(dataframe, schema, fills=DEFAULT_FILLS, keep_nulls=()):
+    # Converts the schema's columns and returns (coerced, failures).
+    #   schema:     {column: type} e.g. {'Released_Year': 'Int64', 'Gross': 'Int64', 'Overview': 'string'}.
+    #   fills:      {type: default} used for nulls and for values that could not be converted.
+    #   keep_nulls: columns whose nulls are kept (and written as SQL NULL) instead of filled.
+    #   failures:   {column: number of values that could not be converted} for columns with any.
+    # Columns not in the schema are passed through unchanged.
+    missing = [column for column in schema if column not in dataframe.columns]
+    if missing:
+        raise ValueError(f'Columns {missing} in the schema are not in the dataframe')
+
+    converted = {}
+    failures = {}
+    for column, kind in schema.items():
+        values, failed = _convert(dataframe[column], kind)
+        values = values.astype(pd.ArrowDtype(ARROW_TYPES[kind]))
+
+        if column not in keep_nulls and fills.get(kind) is not None:
+            values = values.fillna(fills[kind])
+        if failed:
+            failures[column] = failed
+        converted[column] = values
+
+    return dataframe.assign(**converted), failures
@@ -0,0 +1,147 @@
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+
+import psycopg2
+from psycopg2 import sql
+from sqlalchemy import create_engine
+
+# Pipeline-level connection manager. The scripts used to open a new psycopg2 connection for the DDL,
+# for every insert() call and for every key lookup, and to build a new SQLAlchemy engine in every
+# stage, so a single run paid for a dozen TCP/auth handshakes. Here one SQLAlchemy pool serves both
+# APIs: SQLAlchemy users (pandas read_sql/to_sql) get the engine, psycopg2 users get a raw DBAPI
+# connection checked out of the same pool, and both are opened with one set of credentials.
+#
+# Stages normally commit on their own. Inside 'with manager.transaction():' every connection() and
+# sqlalchemy() call made by the same thread shares one connection and one transaction, which is
+# committed (or rolled back) once at the end.
+
+
+class ConnectionManager:
+
+    def __init__(self, dbname='Destination', host='localhost', port=5432, user=None, password=None,
+                 pool_size=4):
+        # Credentials default to DB_USER and DB_PASSWORD (DB_PASS in some of the .env files).
+        self.dbname = dbname
+        self.host = host
+        self.port = port
+        self.user = user if user is not None else os.getenv('DB_USER')
+        self.password = password if password is not None else os.getenv('DB_PASSWORD', os.getenv('DB_PASS'))
+        self.pool_size = pool_size
+        self.metrics = {'connections_opened': 0, 'connect_seconds': 0.0, 'checkouts': 0}
+
+        self._engine = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        # Called by the pool whenever it needs a new physical connection; the handshake is timed
+        # separately from the work done on the connection.
+        t1 = time()
+        connection = psycopg2.connect(host=self.host, dbname=self.dbname, user=self.user,
+                                      password=self.password, port=self.port)
+        t2 = time()
+
+        with self._lock:
+            self.metrics['connections_opened'] += 1
+            self.metrics['connect_seconds'] += t2 - t1
+        return connection
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = create_engine('postgresql+psycopg2://', creator=self._connect,
+                                                 pool_size=self.pool_size, pool_pre_ping=True)
+        return self._engine
+
+    def _checked_out(self):
+        with self._lock:
+            self.metrics['checkouts'] += 1
+
+    def _shared(self):
+        return getattr(self._local, 'shared', None)
+
+    @contextmanager
+    def _search_path(self, connection, search_path):
+        # Pooled connections are reused by other stages, so the search_path is set with SET LOCAL: it ends
+        # with the transaction. Inside a shared transaction the previous value is restored on exit instead.
+        if search_path is None:
+            yield
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('search_path')")
+            previous = cursor.fetchone()[0]
+            cursor.execute(sql.SQL('SET LOCAL search_path TO {}').format(sql.Identifier(search_path)))
+
+        yield
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('search_path', %s, true)", (previous,))
+
+    @contextmanager
+    def transaction(self):
+        # Opt-in shared transaction for the stages run inside the block (on the current thread).
+        if self._shared() is not None:
+            yield self._shared()
+            return
+
+        with self.engine.begin() as connection:
+            self._checked_out()
+            self._local.shared = connection
+            try:
+                yield connection
+            finally:
+                self._local.shared = None
+
+    @contextmanager
+    def connection(self, search_path=None):
+        # Yields a psycopg2 connection from the pool. Outside a shared transaction the work is committed
+        # when the block exits (rolled back on error) and the connection goes back to the pool.
+        shared = self._shared()
+        if shared is not None:
+            connection = shared.connection.dbapi_connection
+            with self._search_path(connection, search_path):
+                yield connection
+            return
+
+        connection = self.engine.raw_connection()
+        self._checked_out()
+        try:
+            with self._search_path(connection, search_path):
+                yield connection
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    @contextmanager
+    def cursor(self, search_path=None):
+        with self.connection(search_path) as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    @contextmanager
+    def sqlalchemy(self):
+        # Yields a SQLAlchemy connection for pandas (read_sql, to_sql) from the same pool.
+        shared = self._shared()
+        if shared is not None:
+            yield shared
+            return
+
+        with self.engine.begin() as connection:
+            self._checked_out()
+            yield connection
+
+    def report(self):
+        return (f"Connection setup: {self.metrics['connections_opened']} connection(s) to {self.dbname} "
+                f"opened in {self.metrics['connect_seconds']:.3f}s, {self.metrics['checkouts']} checkout(s)")
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.dispose()
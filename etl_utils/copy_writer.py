@@ -0,0 +1,461 @@
+import struct
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Bulk writer that streams a DataFrame into Postgres with COPY ... FROM STDIN instead of
+# execute_batch. The frame is never turned into a list of dicts: every column is converted
+# as a whole (typed array + NA mask) and the rows are assembled chunk by chunk straight into
+# the COPY wire format, either the text format or the binary format.
+
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_TRAILER = struct.pack('>h', -1)
+
+# Characters that must be escaped in the COPY text format.
+TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Fixed-width binary encodings, keyed by the Postgres type name as returned by format_type().
+BINARY_FIXED_TYPES = {
+    'smallint': '>i2',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'real': '>f4',
+    'double precision': '>f8',
+}
+BINARY_TEXT_TYPES = ('text', 'character varying', 'character', 'name')
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+PG_EPOCH = pd.Timestamp('2000-01-01')
+PG_EPOCH_DAYS = (date(2000, 1, 1) - date(1970, 1, 1)).days
+
+
+class _ChunkReader:
+    # Minimal file-like wrapper handed to copy_expert(). It pulls encoded chunks from a generator
+    # only when psycopg2 asks for more data, so at most one chunk is held in memory at a time.
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = b''
+        self._position = 0
+
+    def read(self, size=-1):
+        while self._position >= len(self._current):
+            self._current = next(self._chunks, None)
+            self._position = 0
+            if self._current is None:
+                self._current = b''
+                return b''
+
+        if size is None or size < 0:
+            size = len(self._current) - self._position
+
+        data = self._current[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+
+def fetch_column_types(cursor, table_name):
+    # Returns {column_name: type_name} for the target table. The table name is resolved with
+    # to_regclass() so both schema-qualified names and the connection's search_path work.
+    cursor.execute('''
+        SELECT a.attname, format_type(a.atttypid, NULL)
+        FROM pg_attribute AS a
+        WHERE a.attrelid = to_regclass(%s)
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+        ORDER BY a.attnum
+        ''', (table_name,))
+
+    column_types = dict(cursor.fetchall())
+
+    if not column_types:
+        raise ValueError(f'Table {table_name} does not exist or has no columns')
+
+    return column_types
+
+
+def resolve_columns(dataframe, column_types, columns=None):
+    # Maps DataFrame columns to target table columns. 'columns' may be a list of DataFrame columns
+    # (same names on both sides) or a dict of {dataframe_column: table_column}. Target names are
+    # matched case-insensitively when there is no exact match, mirroring how Postgres folds
+    # unquoted identifiers e.g. Series_Title -> series_title.
+    if columns is None:
+        columns = list(dataframe.columns)
+    if not isinstance(columns, dict):
+        columns = {column: column for column in columns}
+
+    lowered = {name.lower(): name for name in column_types}
+    resolved = {}
+
+    for source, target in columns.items():
+        if target not in column_types:
+            if target.lower() not in lowered:
+                raise ValueError(f'Column {target} does not exist in the target table')
+            target = lowered[target.lower()]
+        resolved[source] = target
+
+    return resolved
+
+
+def _integral_values(values, column_name):
+    # Float columns headed for integer targets (e.g. surrogate keys that went through a merge
+    # and picked up NaN) must hold whole numbers; anything else is a data error, not a rounding job.
+    values = pd.to_numeric(values)
+    if values.dtype.kind == 'f':
+        if not np.all(np.mod(values.to_numpy(), 1) == 0):
+            raise ValueError(f'Column {column_name} holds non-integer values for an integer column')
+    return values.astype('int64')
+
+
+def _text_column(series, type_name):
+    # Converts one column into its COPY text representation, with NA cells written as \N.
+    mask = pd.isna(series).to_numpy()
+    valid = series[~mask]
+
+    if type_name in INTEGER_TYPES and valid.dtype.kind not in 'OSU' and not pd.api.types.is_string_dtype(valid):
+        valid = _integral_values(valid, series.name)
+
+    if pd.api.types.is_bool_dtype(valid):
+        text = valid.map({True: 't', False: 'f'})
+    else:
+        text = valid.astype(str).str.translate(TEXT_ESCAPES)
+
+    result = np.full(len(series), '\\N', dtype=object)
+    result[~mask] = text.to_numpy(dtype=object)
+    return pd.Series(result, index=series.index, dtype=object)
+
+
+def _encode_text_chunk(chunk, columns, column_types):
+    # Joins all columns of the chunk with tabs and all rows with newlines in vectorized steps.
+    parts = [_text_column(chunk[source], column_types[target]) for source, target in columns.items()]
+    rows = parts[0].str.cat(parts[1:], sep='\t') if len(parts) > 1 else parts[0]
+    return ('\n'.join(rows.tolist()) + '\n').encode('utf-8')
+
+
+def _utf8_buffers(values):
+    # Returns (data, sizes) for a column of strings: one contiguous utf-8 byte buffer holding every
+    # value back to back, plus the byte length of each value.
+    values = values.astype(str)
+
+    if pa is not None:
+        array = pa.array(values.to_numpy(dtype=object), type=pa.large_string())
+        offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+        data = np.frombuffer(array.buffers()[2], dtype=np.uint8)[offsets[0]:offsets[-1]]
+        return data, np.diff(offsets)
+
+    encoded = [value.encode('utf-8') for value in values.tolist()]
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, np.fromiter((len(value) for value in encoded), dtype=np.int64, count=len(encoded))
+
+
+def _binary_column(series, type_name):
+    # Returns (data, sizes, lengths) for one column in the binary COPY format: the payload bytes of
+    # all non-NA cells, each cell's payload size, and the int32 length field (-1 marks NULL).
+    mask = pd.isna(series).to_numpy()
+    valid = series[~mask]
+
+    if type_name in BINARY_FIXED_TYPES:
+        dtype = np.dtype(BINARY_FIXED_TYPES[type_name])
+        if type_name in INTEGER_TYPES:
+            valid = _integral_values(valid, series.name)
+        data = pd.to_numeric(valid).to_numpy().astype(dtype).view(np.uint8)
+        valid_sizes = np.full(len(valid), dtype.itemsize, dtype=np.int64)
+
+    elif type_name == 'boolean':
+        data = valid.astype(bool).to_numpy().astype(np.uint8)
+        valid_sizes = np.ones(len(valid), dtype=np.int64)
+
+    elif type_name == 'date':
+        days = pd.to_datetime(valid).to_numpy(dtype='datetime64[D]').astype(np.int64) - PG_EPOCH_DAYS
+        data = days.astype('>i4').view(np.uint8)
+        valid_sizes = np.full(len(valid), 4, dtype=np.int64)
+
+    elif type_name.startswith('timestamp'):
+        timestamps = pd.to_datetime(valid)
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+        micros = (timestamps - PG_EPOCH).to_numpy(dtype='timedelta64[us]').astype(np.int64)
+        data = micros.astype('>i8').view(np.uint8)
+        valid_sizes = np.full(len(valid), 8, dtype=np.int64)
+
+    elif type_name in BINARY_TEXT_TYPES:
+        data, valid_sizes = _utf8_buffers(valid)
+
+    else:
+        raise ValueError(f'Column {series.name} has type {type_name} which the binary writer does not support, '
+                         f'use the text format instead')
+
+    sizes = np.zeros(len(series), dtype=np.int64)
+    sizes[~mask] = valid_sizes
+    lengths = np.where(mask, -1, sizes).astype('>i4')
+    return data, sizes, lengths
+
+
+def _encode_binary_chunk(chunk, columns, column_types):
+    # Assembles the rows of the chunk into one byte buffer. Instead of looping over rows, the
+    # position of every field is computed up front from the cell sizes and each column's bytes are
+    # scattered into place with a single fancy-indexing assignment.
+    encoded = [_binary_column(chunk[source], column_types[target]) for source, target in columns.items()]
+    row_count = len(chunk)
+
+    field_sizes = np.stack([4 + sizes for _, sizes, _ in encoded]) if encoded else np.zeros((0, row_count))
+    row_sizes = 2 + field_sizes.sum(axis=0)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+    buffer = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    field_count = np.array([len(encoded)], dtype='>i2').view(np.uint8)
+    buffer[row_starts[:, None] + np.arange(2)] = field_count
+
+    field_start = row_starts + 2
+    for (data, sizes, lengths), field_size in zip(encoded, field_sizes):
+        buffer[field_start[:, None] + np.arange(4)] = lengths.view(np.uint8).reshape(row_count, 4)
+
+        source_starts = np.cumsum(sizes) - sizes
+        shift = field_start + 4 - source_starts
+        buffer[np.repeat(shift, sizes) + np.arange(data.size)] = data
+
+        field_start = field_start + field_size
+
+    return buffer.tobytes()
+
+
+def _iter_chunks(dataframe, chunk_size):
+    for start in range(0, len(dataframe), chunk_size):
+        yield dataframe.iloc[start:start + chunk_size]
+
+
+def copy_from_dataframe(cursor, dataframe, table_name, columns=None, copy_format='text', chunk_size=100000):
+    # Writes the DataFrame to the table with COPY and returns the number of rows written.
+    # copy_format is 'text' or 'binary'; the binary format avoids text parsing on the server but
+    # requires every column type to be one the encoder above understands.
+    if copy_format not in ('text', 'binary'):
+        raise ValueError(f'Unknown COPY format: {copy_format}')
+
+    column_types = fetch_column_types(cursor, table_name)
+    columns = resolve_columns(dataframe, column_types, columns)
+
+    if dataframe.empty:
+        return 0
+
+    if copy_format == 'binary':
+        def chunks():
+            yield BINARY_HEADER
+            for chunk in _iter_chunks(dataframe, chunk_size):
+                yield _encode_binary_chunk(chunk, columns, column_types)
+            yield BINARY_TRAILER
+
+        options = sql.SQL('FORMAT binary')
+    else:
+        def chunks():
+            for chunk in _iter_chunks(dataframe, chunk_size):
+                yield _encode_text_chunk(chunk, columns, column_types)
+
+        options = sql.SQL("FORMAT text, ENCODING 'UTF8'")
+
+    copy_query = sql.SQL('COPY {} ({}) FROM STDIN WITH ({})').format(
+        sql.Identifier(*table_name.split('.')),
+        sql.SQL(', ').join(sql.Identifier(target) for target in columns.values()),
+        options
+    )
+
+    cursor.copy_expert(copy_query, _ChunkReader(chunks()), size=1 << 20)
+    return len(dataframe)
+
+
+def _null_patterns(cursor, temp_table, key_columns):
+    # The combinations of null key columns among the staged rows, e.g. [(False, False), (False, True)].
+    cursor.execute(sql.SQL('SELECT DISTINCT {} FROM {}').format(
+        sql.SQL(', ').join(sql.SQL('{} IS NULL').format(sql.Identifier(column)) for column in key_columns),
+        sql.Identifier(temp_table)))
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def _key_matches(key_columns, nulls):
+    # Join condition between the target (t) and the staged rows (s) for staged keys whose null columns are
+    # 'nulls'. Null columns match nulls, the others are compared with '=', which can still be hashed
+    # (IS NOT DISTINCT FROM cannot, and would turn every lookup into a nested loop over the table).
+    return sql.SQL(' AND ').join(
+        sql.SQL('t.{0} IS NULL AND s.{0} IS NULL' if null else 't.{0} = s.{0}').format(sql.Identifier(column))
+        for column, null in zip(key_columns, nulls))
+
+
+def _copy_merge(cursor, dataframe, table_name, columns, conflict_columns, update_columns, extra_updates,
+                copy_format, returning, existing_keys=None):
+    # COPY cannot resolve conflicts or return generated values on its own, so the rows are copied into a
+    # temporary table shaped like the target and moved over with a single INSERT ... SELECT statement,
+    # optionally with ON CONFLICT and RETURNING clauses.
+    # With existing_keys (key columns), rows whose key is already in the table, null keys included, are
+    # left out of the insert, and are returned as well when 'returning' is given, read from the table in
+    # the same statement. Returns the name of the temporary table.
+    column_types = fetch_column_types(cursor, table_name)
+    columns = resolve_columns(dataframe, column_types, columns)
+    targets = list(columns.values())
+
+    temp_table = 'tmp_copy_' + table_name.split('.')[-1]
+    cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier(temp_table)))
+    # Only the copied columns are taken over, without defaults: a serial default would otherwise draw
+    # a sequence value for every staged row on top of the one drawn by the final INSERT.
+    column_list = sql.SQL(', ').join(sql.Identifier(target) for target in targets)
+    cursor.execute(sql.SQL('CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA').format(
+        sql.Identifier(temp_table), column_list, sql.Identifier(*table_name.split('.'))))
+
+    copy_from_dataframe(cursor, dataframe, temp_table, columns, copy_format)
+
+    table = sql.Identifier(*table_name.split('.'))
+    query = sql.SQL('INSERT INTO {} ({}) ').format(table, column_list)
+
+    # A single INSERT may not touch the same target row twice, so rows sharing a key are collapsed first;
+    # the last one wins, as it would with one statement per row.
+    key_columns = conflict_columns or existing_keys
+    if key_columns:
+        key_list = sql.SQL(', ').join(sql.Identifier(column) for column in key_columns)
+        where = sql.SQL('')
+        if existing_keys:
+            patterns = _null_patterns(cursor, temp_table, existing_keys)
+            if patterns:
+                where = sql.SQL(' WHERE ') + sql.SQL(' AND ').join(
+                    sql.SQL('NOT EXISTS (SELECT 1 FROM {} AS t WHERE {})').format(
+                        table, _key_matches(existing_keys, nulls))
+                    for nulls in patterns)
+        query += sql.SQL('SELECT DISTINCT ON ({0}) {1} FROM {2} AS s{3} ORDER BY {0}, ctid DESC').format(
+            key_list, column_list, sql.Identifier(temp_table), where)
+    else:
+        # ctid keeps the rows in the order they were copied, so generated keys follow the frame's order.
+        query += sql.SQL('SELECT {} FROM {} ORDER BY ctid').format(column_list, sql.Identifier(temp_table))
+
+    if conflict_columns:
+        if update_columns is None:
+            update_columns = [target for target in targets if target not in conflict_columns]
+
+        assignments = [sql.SQL('{0} = excluded.{0}').format(sql.Identifier(column)) for column in update_columns]
+        assignments += [sql.SQL('{} = {}').format(sql.Identifier(column), sql.SQL(expression))
+                        for column, expression in (extra_updates or {}).items()]
+
+        if assignments:
+            conflict_action = sql.SQL('DO UPDATE SET {}').format(sql.SQL(', ').join(assignments))
+        else:
+            conflict_action = sql.SQL('DO NOTHING')
+
+        query += sql.SQL(' ON CONFLICT ({}) {}').format(
+            sql.SQL(', ').join(sql.Identifier(column) for column in conflict_columns), conflict_action)
+
+    if returning:
+        returning_list = sql.SQL(', ').join(sql.Identifier(column) for column in returning)
+        query += sql.SQL(' RETURNING {}').format(returning_list)
+
+        if existing_keys:
+            # The statement's snapshot does not see the rows it inserts, so the joins below find exactly the
+            # rows that were already there and the parts never overlap. The last column tells them apart.
+            existing = sql.SQL(', ').join(sql.SQL('t.{}').format(sql.Identifier(column)) for column in returning)
+            key_list = sql.SQL(', ').join(sql.Identifier(column) for column in existing_keys)
+            query = sql.SQL('WITH inserted AS ({}) SELECT {}, TRUE FROM inserted').format(query, returning_list)
+            for nulls in patterns:
+                query += sql.SQL(' UNION ALL SELECT {0}, FALSE FROM {1} AS t '
+                                 'JOIN (SELECT DISTINCT {2} FROM {3}) AS s ON {4}').format(
+                    existing, table, key_list, sql.Identifier(temp_table), _key_matches(existing_keys, nulls))
+
+    cursor.execute(query)
+    return temp_table
+
+
+def copy_upsert(cursor, dataframe, table_name, conflict_columns, columns=None, update_columns=None,
+                extra_updates=None, copy_format='text'):
+    # Bulk INSERT ... ON CONFLICT through COPY.
+    # update_columns defaults to every copied column that is not part of the conflict target;
+    # extra_updates adds raw SQL assignments e.g. {'last_updated_date': 'CURRENT_DATE'}.
+    # When nothing is left to update, the conflict is resolved with DO NOTHING.
+    # Returns the number of rows inserted or updated.
+    _copy_merge(cursor, dataframe, table_name, columns, conflict_columns, update_columns, extra_updates,
+                copy_format, None)
+    return cursor.rowcount
+
+
+def copy_returning(cursor, dataframe, table_name, returning, columns=None, conflict_columns=None,
+                   update_columns=None, extra_updates=None, copy_format='text'):
+    # Bulk INSERT ... RETURNING through COPY, used by dimension loads to get their generated surrogate keys
+    # back together with the business keys e.g. returning=['product_key', 'product_id', 'product_name'].
+    # With conflict_columns the insert becomes an upsert (same options as copy_upsert); rows that are
+    # updated are returned as well, rows skipped by DO NOTHING are not.
+    # Returns a DataFrame with one column per returned table column.
+    _copy_merge(cursor, dataframe, table_name, columns, conflict_columns, update_columns, extra_updates,
+                copy_format, returning)
+    return pd.DataFrame(cursor.fetchall(), columns=list(returning))
+
+
+def has_unique_index(cursor, table_name, key_columns):
+    # True when the table has a unique index on exactly key_columns (in any order), e.g. the one built by
+    # ensure_unique_index().
+    cursor.execute('''
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_index AS i
+            WHERE i.indrelid = to_regclass(%s)
+            AND i.indisunique
+            AND i.indpred IS NULL
+            AND i.indexprs IS NULL
+            AND ARRAY(SELECT a.attname::text FROM pg_attribute AS a
+                      WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                      ORDER BY a.attname COLLATE "C") = %s::text[]
+            AND i.indnkeyatts = %s)
+        ''', (table_name, sorted(key_columns), len(key_columns)))
+    return cursor.fetchone()[0]
+
+
+def ensure_unique_index(cursor, table_name, key_columns):
+    # Creates the unique index on the table's business key, which keeps concurrent copy_insert_missing()
+    # calls from inserting the same key twice. Nulls count as equal where the server supports it
+    # (Postgres 15+). Tables loaded before the index existed may already hold duplicates; the index is
+    # then not built and this is reported, while copy_insert_missing() keeps skipping loaded keys without it.
+    schema, _, table = table_name.rpartition('.')
+    index_name = f'{table}_{"_".join(key_columns)}_key'
+    key_list = sql.SQL(', ').join(sql.Identifier(column) for column in key_columns)
+
+    cursor.execute('SELECT to_regclass(%s)', ('.'.join(filter(None, [schema, f'"{index_name}"'])),))
+    if cursor.fetchone()[0] is not None:
+        return
+
+    cursor.execute(sql.SQL('SELECT count(*) FROM (SELECT 1 FROM {} GROUP BY {} HAVING count(*) > 1) AS d').format(
+        sql.Identifier(*table_name.split('.')), key_list))
+    duplicates = cursor.fetchone()[0]
+    if duplicates:
+        raise ValueError(f'{table_name} holds {duplicates} duplicated values of {key_columns}, so no unique index '
+                         f'was created; loads still skip loaded keys, remove the duplicates to add the index')
+
+    nulls = sql.SQL(' NULLS NOT DISTINCT' if cursor.connection.server_version >= 150000 else '')
+    cursor.execute(sql.SQL('CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({}){}').format(
+        sql.Identifier(index_name), sql.Identifier(*table_name.split('.')), key_list, nulls))
+
+
+def copy_insert_missing(cursor, dataframe, table_name, key_columns, columns=None, returning=None,
+                        copy_format='text'):
+    # Idempotent bulk insert for dimension and bridge tables: only rows whose business key (key_columns)
+    # is not in the table yet are inserted, so a re-run over the same source adds nothing. Loaded keys are
+    # found with an anti-join in which null keys match too, so the table needs no unique index (it may
+    # hold duplicates from earlier loads); when ensure_unique_index() built one, ON CONFLICT DO NOTHING
+    # also skips keys a concurrent load inserted in the meantime.
+    # Returns (inserted, skipped, keys). Rows sharing a business key in the frame are counted once.
+    # keys is None without 'returning', otherwise a DataFrame of the returned columns for every business
+    # key in the frame, newly inserted and already present alike, so surrogate keys can still be looked up.
+    # A key loaded more than once before is returned once per loaded row.
+    conflict_columns = key_columns if has_unique_index(cursor, table_name, key_columns) else None
+    temp_table = _copy_merge(cursor, dataframe, table_name, columns, conflict_columns, [], None, copy_format,
+                             returning, existing_keys=key_columns)
+
+    if returning:
+        keys = pd.DataFrame(cursor.fetchall(), columns=list(returning) + ['inserted'])
+        inserted = int(keys.pop('inserted').sum())
+    else:
+        keys = None
+        inserted = max(cursor.rowcount, 0)
+
+    cursor.execute(sql.SQL('SELECT count(*) FROM (SELECT DISTINCT {} FROM {}) AS s').format(
+        sql.SQL(', ').join(sql.Identifier(column) for column in key_columns), sql.Identifier(temp_table)))
+    staged = cursor.fetchone()[0]
+    return inserted, staged - inserted, keys
@@ -0,0 +1,226 @@
+import itertools
+import queue
+import threading
+
+from psycopg2 import sql
+
+from etl_utils.copy_writer import _ChunkReader
+from etl_utils.db_stream import build_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# Database-to-database transfer. Moving a table between two Postgres databases through pandas builds a
+# Python object for every cell twice: once when the rows are fetched and once when they are written.
+# When the columns pass through unchanged, none of that is needed: here the source runs
+# COPY (SELECT ...) TO STDOUT and the bytes are fed straight into COPY ... FROM STDIN on the destination.
+# The two COPY commands run at the same time on two connections, joined by a small bounded queue of
+# byte chunks, so memory stays at a few chunks regardless of the size of the table.
+#
+# The binary format is the fastest, but needs the source and target columns to have the same types;
+# the text and csv formats let the destination convert the values (e.g. INT to TEXT).
+#
+# An optional transform hook receives each batch as a pyarrow RecordBatch and returns the batch to load
+# (columns may be renamed, added, dropped or recomputed with pyarrow.compute). The data then travels as
+# CSV, which is parsed into and written back from Arrow's columnar buffers without creating Python objects.
+
+CHUNK_SIZE = 1 << 20
+
+# Arrow types for the Postgres type OIDs the transform hook reads with their own type.
+# Every other type (numeric, json, arrays, ...) reaches the hook as text.
+ARROW_TYPES_BY_OID = {
+    16: 'bool',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1082: 'date32',
+    1114: 'timestamp[us]',
+}
+
+_DONE = object()
+
+
+class _QueueWriter:
+    # File-like target for COPY TO. psycopg2 writes one row at a time; rows are gathered into chunks of
+    # about CHUNK_SIZE bytes before they are queued. Gives up (and aborts the COPY) once the consumer stopped.
+
+    def __init__(self, chunks, stop):
+        self._chunks = chunks
+        self._stop = stop
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self._stop.is_set():
+                raise RuntimeError('Transfer cancelled by the destination')
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class _QueueFile:
+    # File-like source over the queued chunks, read by the Arrow CSV reader.
+
+    def __init__(self, chunks):
+        self._reader = _ChunkReader(chunks)
+        self.closed = False
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def _produce(source, copy_query, chunks, stop):
+    writer = _QueueWriter(chunks, stop)
+    try:
+        with source.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(copy_query, writer, size=CHUNK_SIZE)
+        writer.flush()
+        writer.put(_DONE)
+
+    except Exception as error:
+        if not stop.is_set():
+            writer.put(error)
+
+
+def _consume(chunks):
+    # Yields the queued byte chunks until the producer is done, re-raising its errors.
+    while True:
+        item = chunks.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _arrow_schema(source, query):
+    # Column names and Arrow types of the query's result, read from an empty execution of the query.
+    with source.cursor() as cursor:
+        cursor.execute(sql.SQL('SELECT * FROM ({}) AS q LIMIT 0').format(query))
+        return [(column.name, ARROW_TYPES_BY_OID.get(column.type_code, 'string')) for column in cursor.description]
+
+
+def _transformed_csv(chunks, schema, transform):
+    # Parses the CSV stream into Arrow batches, applies the hook and yields each result as CSV bytes,
+    # preceded by the column names of the first result (the COPY column list).
+    names = [name for name, _ in schema]
+    types = {name: pa.type_for_alias(kind) for name, kind in schema}
+    read_options = pa_csv.ReadOptions(column_names=names, block_size=CHUNK_SIZE)
+    # Postgres writes NULL as an empty field and an empty string as "".
+    convert_options = pa_csv.ConvertOptions(column_types=types, strings_can_be_null=True,
+                                            quoted_strings_can_be_null=False, null_values=[''],
+                                            true_values=['t'], false_values=['f'])
+    write_options = pa_csv.WriteOptions(include_header=False)
+
+    first = next(chunks, None)
+    if first is None:
+        # The Arrow reader rejects an empty stream; the hook still runs once, on an empty batch, so the
+        # (empty) COPY is issued with the columns the hook produces.
+        yield transform(pa.RecordBatch.from_pylist([], schema=pa.schema(types))).schema.names
+        return
+
+    reader = pa_csv.open_csv(_QueueFile(itertools.chain([first], chunks)), read_options=read_options,
+                             convert_options=convert_options)
+    columns = None
+    for batch in reader:
+        batch = transform(batch)
+        if columns is None:
+            columns = batch.schema.names
+            yield columns
+
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(batch, sink, write_options)
+        yield sink.getvalue().to_pybytes()
+
+
+def copy_query(source, destination, query, target_table, columns=None, params=None, copy_format='binary',
+               transform=None, prefetch=8):
+    # Copies the result of a SELECT on 'source' into target_table on 'destination' (both ConnectionManagers)
+    # and returns the number of rows copied.
+    # query:       SQL string or psycopg2.sql object, with %(name)s / %s placeholders for 'params'.
+    # columns:     target columns in the order of the query's columns (default: the query's column names).
+    # copy_format: 'binary', 'text' or 'csv'; ignored with a transform, which always travels as csv.
+    # transform:   function(pyarrow.RecordBatch) -> RecordBatch applied to every batch; the target columns are
+    #              then the names of the returned batch unless 'columns' is given.
+    # prefetch:    number of byte chunks (about 1 MB each) buffered between the two connections.
+    if copy_format not in ('binary', 'text', 'csv'):
+        raise ValueError(f'Unknown COPY format: {copy_format}')
+    if transform is not None:
+        if pa is None:
+            raise ImportError('pyarrow is required for a transform hook')
+        copy_format = 'csv'
+
+    if isinstance(query, str):
+        query = sql.SQL(query)
+    if params is not None:
+        # COPY takes no parameters, so they are bound into the statement by the driver.
+        with source.cursor() as cursor:
+            query = sql.SQL(cursor.mogrify(query, params).decode('utf-8'))
+
+    schema = _arrow_schema(source, query)
+    options = sql.SQL('FORMAT {}').format(sql.SQL(copy_format))
+    if copy_format != 'binary':
+        options += sql.SQL(", ENCODING 'UTF8'")
+
+    chunks = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, daemon=True, args=(
+        source, sql.SQL('COPY ({}) TO STDOUT WITH ({})').format(query, options), chunks, stop))
+    producer.start()
+
+    try:
+        data = _consume(chunks)
+        if transform is not None:
+            data = _transformed_csv(data, schema, transform)
+            names = next(data)
+        else:
+            names = [name for name, _ in schema]
+        columns = list(columns) if columns is not None else names
+
+        copy_in = sql.SQL('COPY {} ({}) FROM STDIN WITH ({})').format(
+            sql.Identifier(*target_table.split('.')),
+            sql.SQL(', ').join(sql.Identifier(column) for column in columns),
+            options)
+
+        with destination.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(copy_in, _ChunkReader(data), size=CHUNK_SIZE)
+                return cursor.rowcount
+
+    finally:
+        # Stops the producer when the destination fails or the data was not read to the end.
+        stop.set()
+        producer.join()
+
+
+def copy_table(source, destination, source_table, target_table=None, columns=None, where=None, params=None,
+               target_columns=None, copy_format='binary', transform=None, prefetch=8):
+    # Copies source_table (optionally only 'columns' and the rows matching 'where') into target_table
+    # (default: a table of the same name) and returns the number of rows copied.
+    query = build_query(source_table, columns, where)
+    return copy_query(source, destination, query, target_table or source_table, target_columns, params,
+                      copy_format, transform, prefetch)
@@ -0,0 +1,140 @@
+import queue
+import threading
+from itertools import count
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+# Streaming extract from a Postgres table. pd.read_sql() materialises the whole result on the client
+# before the first row can be transformed. Here the query runs on a named (server-side) cursor, only the
+# requested columns and rows are selected on the server (projection and WHERE pushdown), and the rows
+# arrive as DataFrame batches of bounded size. The batches are fetched on a background thread into a
+# small queue, so the next batch is already on its way while the current one is transformed and written
+# to the destination. Memory stays at a few batches regardless of the size of the table.
+
+_DONE = object()
+_cursor_ids = count()
+
+
+def build_query(table_name, columns=None, where=None, order_by=None, distinct=False):
+    # SELECT [DISTINCT] <columns> FROM <table> [WHERE <where>] [ORDER BY <order_by>].
+    # 'where' is an SQL predicate with %(name)s / %s placeholders for the parameters e.g.
+    # "modified_date >= %(day)s AND modified_date < %(day)s + 1"; values are always passed as parameters, never formatted in.
+    if columns is None:
+        column_list = sql.SQL('*')
+    else:
+        column_list = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+
+    query = sql.SQL('SELECT {}{} FROM {}').format(sql.SQL('DISTINCT ' if distinct else ''), column_list,
+                                                  sql.Identifier(*table_name.split('.')))
+    if where is not None:
+        query += sql.SQL(' WHERE ') + sql.SQL(where)
+    if order_by:
+        query += sql.SQL(' ORDER BY ') + sql.SQL(', ').join(sql.Identifier(column) for column in order_by)
+    return query
+
+
+def _put(batches, item, stop):
+    # Blocks while the queue is full, but gives up once the consumer has stopped reading.
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _fetch(manager, query, params, batch_size, batches, stop):
+    try:
+        with manager.connection() as connection:
+            # A named cursor keeps the result on the server; fetchmany() transfers one batch at a time.
+            with connection.cursor(name=f'stream_{next(_cursor_ids)}') as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query, params)
+
+                yielded = False
+                while not stop.is_set():
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows and yielded:
+                        break
+                    columns = [column.name for column in cursor.description]
+                    _put(batches, pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), stop)
+                    yielded = True
+                    if len(rows) < batch_size:
+                        break
+
+        _put(batches, _DONE, stop)
+
+    except Exception as error:
+        _put(batches, error, stop)
+
+
+def stream_table(manager, table_name, columns=None, where=None, params=None, order_by=None, distinct=False,
+                 batch_size=50000, prefetch=2):
+    # Yields DataFrames of at most batch_size rows read from table_name through the ConnectionManager.
+    # columns:  the columns to select (all when None).
+    # where:    SQL predicate pushed down to the server, with 'params' for its placeholders.
+    # order_by: columns to sort by on the server.
+    # distinct: drop duplicate rows on the server, so batches never hold duplicates of each other.
+    # prefetch: number of batches fetched ahead of the consumer.
+    # At least one (possibly empty) batch is always yielded so callers can create their staging table.
+    query = build_query(table_name, columns, where, order_by, distinct)
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    fetcher = threading.Thread(target=_fetch, args=(manager, query, params, batch_size, batches, stop), daemon=True)
+    fetcher.start()
+
+    try:
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    finally:
+        # Stops the fetcher when the consumer finishes early (break or exception).
+        stop.set()
+        fetcher.join()
+
+
+class BatchDeduplicator:
+    # Drops duplicate rows across a stream of batches, as drop_duplicates() would on all the batches
+    # concatenated: a row is kept the first time it occurs, in this batch or any earlier one. distinct=True in
+    # stream_table() only removes duplicates of the source rows, before they are transformed; rows that only
+    # become equal in the transform (e.g. after exploding packed columns or truncating timestamps to dates)
+    # are removed here.
+    #
+    # Every row is remembered by a 128-bit key (two independently seeded 64-bit hashes of its values), so
+    # memory grows by a few dozen bytes per distinct row rather than by the rows themselves. Numeric columns
+    # are hashed as floats, so 3 and 3.0 (an integer column that picked up a null in one batch) are equal.
+
+    _HASH_KEYS = ('0123456789abcdef', 'fedcba9876543210')
+
+    def __init__(self):
+        self._seen = set()
+
+    def _row_keys(self, frame):
+        frame = frame.reset_index(drop=True)
+        numeric = [column for column in frame.columns
+                   if pd.api.types.is_numeric_dtype(frame[column].dtype) and not pd.api.types.is_bool_dtype(frame[column].dtype)]
+        if numeric:
+            frame = frame.astype({column: 'float64' for column in numeric})
+        hashes = [pd.util.hash_pandas_object(frame, index=False, hash_key=hash_key).to_numpy()
+                  for hash_key in self._HASH_KEYS]
+        return np.ascontiguousarray(np.stack(hashes, axis=1)).view('V16').ravel().tolist()
+
+    def __call__(self, frame):
+        # Returns the rows of the batch that did not occur before.
+        if frame.empty:
+            return frame
+        keep = np.zeros(len(frame), dtype=bool)
+        seen = self._seen
+        for position, key in enumerate(self._row_keys(frame)):
+            if key not in seen:
+                seen.add(key)
+                keep[position] = True
+        return frame if keep.all() else frame[keep].copy()
@@ -0,0 +1,109 @@
+from datetime import date, datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    from etl_utils.source_cache import SourceCache
+except ImportError:
+    SourceCache = None
+
+# Streaming extraction for the Excel sources. pd.read_excel() parses the whole workbook into memory
+# before a single row can be filtered; here the workbook is opened in read-only mode, which iterates
+# over the sheet's rows lazily, so filters and the column projection are applied while reading and
+# the rows are handed on as DataFrame chunks of bounded size.
+#
+# When pyarrow is available the rows are also kept in a columnar cache while they are read (see
+# etl_utils.source_cache): as long as the workbook does not change, later runs read the memory-mapped copy
+# instead of the workbook, through the same filters and chunking, so they get the same DataFrames.
+
+
+def as_date(value):
+    # Normalises the different shapes a date cell can take (datetime, date, ISO text) to a date.
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None or value == '':
+        return None
+    return pd.to_datetime(value).date()
+
+
+def on_date(target_date):
+    # Builds a filter that keeps rows whose cell falls on target_date e.g. {'modified_date': on_date(yesterday)}.
+    return lambda value: as_date(value) == target_date
+
+
+def _sheet_rows(file_path, sheet_name=None):
+    # Yields the header row (cell values as text), then every row of the sheet that is not entirely empty.
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.active
+        rows = sheet.iter_rows(values_only=True)
+        yield [str(name) if name is not None else None for name in next(rows, ())]
+
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            yield row
+
+    finally:
+        workbook.close()
+
+
+def _projection(file_path, header, columns, filters):
+    if columns is None:
+        columns = [name for name in header if name is not None]
+    missing = [name for name in list(columns) + list(filters or {}) if name not in header]
+    if missing:
+        raise ValueError(f'Columns {missing} not found in {file_path}')
+    return list(columns)
+
+
+def _read_rows(file_path, rows, columns, filters, chunk_size, limit):
+    # rows: a generator of the header, then the rows of the sheet (_sheet_rows() or the source cache).
+    try:
+        header = next(rows)
+        columns = _projection(file_path, header, columns, filters)
+        positions = [header.index(name) for name in columns]
+        checks = [(header.index(name), check) for name, check in (filters or {}).items()]
+
+        chunk = []
+        kept = 0
+        yielded = False
+
+        for row in rows:
+            if limit is not None and kept >= limit:
+                break
+            # Rows shorter than the header (trailing empty cells) are padded on access.
+            if any(not check(row[position] if position < len(row) else None) for position, check in checks):
+                continue
+            chunk.append(tuple(row[position] if position < len(row) else None for position in positions))
+            kept += 1
+
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                yielded = True
+                chunk = []
+
+        if chunk or not yielded:
+            yield pd.DataFrame.from_records(chunk, columns=columns)
+
+    finally:
+        rows.close()
+
+
+def read_excel_chunks(file_path, columns=None, filters=None, chunk_size=50000, limit=None, sheet_name=None,
+                      cache=True):
+    # Yields DataFrames of at most chunk_size rows.
+    # columns: the source columns to keep (all columns when None), in the order they should appear.
+    # filters: {column: function(value) -> bool}; a row is kept only when every function returns True.
+    # limit:   stop after this many kept rows, without reading the rest of the sheet.
+    # cache:   read through the columnar source cache, which is filled while a workbook is read to its end.
+    # At least one (possibly empty) chunk is always yielded so callers can create their staging table.
+    if cache and SourceCache is not None:
+        rows = SourceCache().rows(file_path, sheet_name, parse=lambda: _sheet_rows(file_path, sheet_name))
+    else:
+        rows = _sheet_rows(file_path, sheet_name)
+    return _read_rows(file_path, rows, columns, filters, chunk_size, limit)
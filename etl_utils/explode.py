@@ -0,0 +1,82 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# "Parallel explode" for delimiter-packed columns that belong together, such as user_id, user_name,
+# review_id and review_title in the review sources, where the n-th value of every column describes
+# the same review. The usual str.split() + explode() builds a Python list per cell and raises as soon
+# as one row has lists of different lengths. Here every column is split in a single pass over one
+# joined string, the values are laid out with NumPy, and rows whose columns do not line up are
+# returned separately as rejects instead of aborting the whole load.
+
+
+def _split_column(series, delimiter):
+    # Returns (values, counts, nulls): the flat array of split values for the whole column, the number
+    # of values each cell produced, and which cells were null. Joining the column into one string and
+    # splitting it once yields exactly the concatenation of the per-cell splits, without per-cell lists.
+    nulls = series.isna().to_numpy()
+    text = series.astype(object).where(~nulls, '').astype(str)
+
+    counts = text.str.count(re.escape(delimiter)).to_numpy() + 1
+    if len(text):
+        values = np.array(delimiter.join(text.tolist()).split(delimiter), dtype=object)
+    else:
+        values = np.empty(0, dtype=object)
+    return values, counts, nulls
+
+
+def parallel_explode(dataframe, columns, delimiter=',', strip=False):
+    # Splits the aligned columns and explodes them together.
+    # Returns (exploded, rejects):
+    #   exploded - one row per split position; every other column is repeated from its parent row and the
+    #              index holds the parent row's index label (the same convention as DataFrame.explode).
+    #   rejects  - the original rows whose packed columns split into different numbers of values.
+    # Null cells count as a single null value, as they do with explode().
+    columns = list(columns)
+    split = {column: _split_column(dataframe[column], delimiter) for column in columns}
+
+    counts = split[columns[0]][1]
+    aligned = np.ones(len(dataframe), dtype=bool)
+    for column in columns[1:]:
+        aligned &= split[column][1] == counts
+
+    accepted_counts = counts[aligned]
+    parent_rows = np.repeat(np.flatnonzero(aligned), accepted_counts)
+
+    split_values = {}
+    for column in columns:
+        values, column_counts, nulls = split[column]
+        keep = np.repeat(aligned, column_counts)
+        values = values[keep]
+        values[np.repeat(nulls[aligned], accepted_counts)] = None
+        if strip:
+            values = pd.Series(values, dtype=object).str.strip().to_numpy(dtype=object)
+        split_values[column] = values
+
+    exploded = dataframe.iloc[parent_rows].assign(**split_values)
+    rejects = dataframe[~aligned]
+    return exploded, rejects
+
+
+# Normalized expansion for bridge tables. Exploding one multi-valued column and melting another on the
+# same frame multiplies them: a movie with 3 genres and 4 stars becomes 12 rows, every one repeating all
+# other columns. The two functions below instead emit one narrow frame per relationship, holding only the
+# key columns and the expanded values, so each frame grows with the number of source rows times the values
+# of that one relationship.
+
+
+def split_to_rows(dataframe, key_columns, column, delimiter=',', strip=False):
+    # Returns key_columns + column with one row per value packed into the column e.g. one row per genre of
+    # a movie for a movie_genre bridge.
+    exploded, _ = parallel_explode(dataframe[list(key_columns) + [column]], [column], delimiter, strip)
+    return exploded.reset_index(drop=True)
+
+
+def stack_columns(dataframe, key_columns, columns, value_name):
+    # Returns key_columns + value_name with one row per row and column of 'columns', for attributes spread
+    # over repeated columns e.g. Star1..Star4 -> one row per actor of a movie (the same rows as melt()).
+    positions = np.tile(np.arange(len(dataframe)), len(columns))
+    stacked = dataframe[list(key_columns)].iloc[positions].reset_index(drop=True)
+    stacked[value_name] = pd.concat([dataframe[column] for column in columns], ignore_index=True)
+    return stacked
@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+from email.utils import formatdate
+
+from aiohttp import web
+
+# Local stand-in for https://fakestoreapi.com. It serves /products, /carts and /users with synthetic
+# payloads shaped like the real ones (nested rating, products, address and name objects included), in
+# any size, so the API pipelines and their extraction speed can be tested offline. The payloads are
+# generated once per size and served from memory, so the server itself is never the bottleneck.
+#
+# Optional latency and fail_rate make the server behave like a slow or flaky API: every response is
+# delayed by 'latency' seconds, and a 'fail_rate' share of the requests is answered with 503 and a
+# Retry-After header.
+#
+# Every response carries an ETag and a Last-Modified header, and a request whose If-None-Match matches
+# is answered with 304 Not Modified, so conditional requests (etl_utils/http_cache.py) can be tested too.
+#
+# Usage:
+#   python -m etl_utils.fakestore_stub --port 8765 --products 20000 --carts 7000 --users 10000
+#   FAKESTORE_URL=http://localhost:8765 python "04 ETL - API to DB/03 homework.py"
+
+CATEGORIES = ["men's clothing", "women's clothing", 'jewelery', 'electronics']
+CITIES = ['kilcoole', 'cullman', 'san Antonio', 'el paso', 'fresno', 'mesa', 'miami beach', 'fort wayne']
+FIRST_NAMES = ['john', 'david', 'kevin', 'don', 'derek', 'david', 'miriam', 'william', 'kate', 'jimmie']
+LAST_NAMES = ['doe', 'morrison', 'ryan', 'romer', 'powell', 'russell', 'snyder', 'hopkins', 'hale', 'kerlin']
+
+
+def make_products(count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'id': product_id,
+        'title': f'Product {product_id} {rng.choice(["Backpack", "Jacket", "Ring", "Monitor", "Shirt"])}',
+        'price': round(rng.uniform(5, 1000), 2),
+        'description': ' '.join(rng.choice(['slim', 'fit', 'cotton', 'gold', 'usb', 'casual', 'premium', 'everyday'])
+                                for _ in range(rng.randint(8, 40))),
+        'category': rng.choice(CATEGORIES),
+        'image': f'https://fakestoreapi.com/img/{product_id}.jpg',
+        'rating': {'rate': round(rng.uniform(1, 5), 1), 'count': rng.randint(0, 700)},
+    } for product_id in range(1, count + 1)]
+
+
+def make_users(count, seed=0):
+    rng = random.Random(seed + 1)
+    return [{
+        'address': {
+            'geolocation': {'lat': f'{rng.uniform(-90, 90):.4f}', 'long': f'{rng.uniform(-180, 180):.4f}'},
+            'city': rng.choice(CITIES),
+            'street': f'{rng.choice(["new road", "lovers ln", "frances ct", "hunters creek dr"])}',
+            'number': rng.randint(1, 9999),
+            'zipcode': f'{rng.randint(10000, 99999)}-{rng.randint(1000, 9999)}',
+        },
+        'id': user_id,
+        'email': f'user{user_id}@gmail.com',
+        'username': f'user{user_id}',
+        'password': f'pw{rng.getrandbits(32):08x}',
+        'name': {'firstname': rng.choice(FIRST_NAMES), 'lastname': rng.choice(LAST_NAMES)},
+        'phone': f'1-{rng.randint(100, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}',
+        '__v': 0,
+    } for user_id in range(1, count + 1)]
+
+
+def make_carts(count, products, users, seed=0):
+    rng = random.Random(seed + 2)
+    start = datetime(2020, 1, 1)
+    return [{
+        'id': cart_id,
+        'userId': rng.randint(1, max(users, 1)),
+        'date': (start + timedelta(days=rng.randint(0, 365))).strftime('%Y-%m-%dT00:00:00.000Z'),
+        'products': [{'productId': rng.randint(1, max(products, 1)), 'quantity': rng.randint(1, 10)}
+                     for _ in range(rng.randint(1, 5))],
+        '__v': 0,
+    } for cart_id in range(1, count + 1)]
+
+
+def make_app(products=20, carts=7, users=10, latency=0.0, fail_rate=0.0, seed=0):
+    # Builds the aiohttp application. ?limit=N returns the first N records, as the real API does.
+    collections = {
+        'products': lambda: make_products(products, seed),
+        'carts': lambda: make_carts(carts, products, users, seed),
+        'users': lambda: make_users(users, seed),
+    }
+    bodies = {}
+    rng = random.Random(seed + 3)
+    last_modified = formatdate(usegmt=True)
+
+    async def serve(request):
+        name = request.match_info['collection']
+        if latency:
+            await asyncio.sleep(latency)
+        if fail_rate and rng.random() < fail_rate:
+            return web.Response(status=503, headers={'Retry-After': '0'})
+
+        limit = request.query.get('limit')
+        key = (name, limit)
+        if key not in bodies:
+            records = collections[name]()
+            body = json.dumps(records[:int(limit)] if limit else records).encode('utf-8')
+            bodies[key] = (body, f'W/"{hashlib.md5(body).hexdigest()}"')
+
+        body, etag = bodies[key]
+        headers = {'ETag': etag, 'Last-Modified': last_modified}
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    app = web.Application()
+    app.router.add_get('/{collection:products|carts|users}', serve)
+    return app
+
+
+class StubServer:
+    # Runs the stub on a background thread for the duration of a 'with' block and yields its base URL.
+    # port=0 picks a free port.
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.host = host
+        self.port = port
+        self.options = options
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def __enter__(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._runner = web.AppRunner(make_app(**self.options), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = self._runner.addresses[0][1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return f'http://{self.host}:{self.port}'
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve synthetic fakestoreapi.com payloads locally.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--carts', type=int, default=7)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args(argv)
+
+    app = make_app(arguments.products, arguments.carts, arguments.users, arguments.latency, arguments.fail_rate,
+                   arguments.seed)
+    web.run_app(app, host=arguments.host, port=arguments.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
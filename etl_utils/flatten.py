@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+# Declarative flattening of nested API records. The pipelines flattened their payloads with
+# explode() + apply(pd.Series), which builds one Series per cart line, and with repeated
+# json_normalize() + join() + drop() for the nested rating, address and name objects. Here the wanted
+# columns are declared once as dotted paths into a record, with at most one array to unnest and optional
+# renames, and the spec is compiled into a single Python function that walks every record once: each
+# nested object on the way to the columns is looked up once per record (shared by all of its columns),
+# and every output row is produced as a tuple, so the DataFrame is built in one step.
+#
+# Missing keys, nulls and non-object values on a path give a null column, as json_normalize does; an
+# unnested array that is missing or empty still gives one row with null item columns, as explode() does.
+#
+# Example (one row per cart line):
+#   SALES = Flattener(['id', 'userId', 'date', '__v', 'products.productId', 'products.quantity'],
+#                     unnest='products', rename={'products.productId': 'productId', 'products.quantity': 'quantity'})
+#   sales_df = SALES.frame(carts)
+
+_EMPTY = {}
+# Arrays as they come from json (list) or from a DataFrame read from BigQuery (numpy array).
+_ARRAY_TYPES = (list, tuple, np.ndarray)
+
+
+class Flattener:
+
+    def __init__(self, columns, unnest=None, rename=None):
+        # columns: dotted paths in output order; paths under the unnested array start with '<unnest>.'.
+        # unnest:  dotted path of an array of objects; every element gives one output row.
+        # rename:  {path: column name}; other columns are named by their path (as json_normalize names them).
+        self.columns = list(columns)
+        self.unnest = unnest
+        self.names = [(rename or {}).get(path, path) for path in self.columns]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f'Duplicate output columns in {self.names}')
+        self.source = self._generate()
+        namespace = {'_EMPTY': _EMPTY, '_ARRAY_TYPES': _ARRAY_TYPES}
+        exec(compile(self.source, f'<flattener {self.names}>', 'exec'), namespace)
+        self.rows = namespace['rows']
+
+    def _generate(self):
+        # Source of rows(records): a generator of one tuple per output row.
+        prefix = f'{self.unnest}.' if self.unnest else None
+        outer = [path for path in self.columns if not (prefix and path.startswith(prefix))]
+        inner = [path[len(prefix):] for path in self.columns if prefix and path.startswith(prefix)]
+        if self.unnest and not inner:
+            raise ValueError(f'No columns are read from the unnested array {self.unnest}')
+
+        lines = ['def rows(records):', '    for record in records:']
+        objects = {}
+
+        def lookup(root, parts, indent):
+            # Expression for the value at parts under root, assigning every nested object on the way once.
+            variable = root
+            for depth in range(1, len(parts)):
+                key = (root,) + tuple(parts[:depth])
+                if key not in objects:
+                    objects[key] = f'o{len(objects)}'
+                    lines.append(f'{indent}{objects[key]} = {variable}.get({parts[depth - 1]!r})')
+                    lines.append(f'{indent}if {objects[key]}.__class__ is not dict:')
+                    lines.append(f'{indent}    {objects[key]} = _EMPTY')
+                variable = objects[key]
+            return f'{variable}.get({parts[-1]!r})'
+
+        values = {path: lookup('record', path.split('.'), '        ') for path in outer}
+        if not self.unnest:
+            lines.append(f'        yield ({"".join(values[path] + ", " for path in self.columns)})')
+            return '\n'.join(lines) + '\n'
+
+        # The record-level values are read once, before the loop over the array.
+        for number, path in enumerate(outer):
+            lines.append(f'        v{number} = {values[path]}')
+            values[path] = f'v{number}'
+        lines.append(f'        items = {lookup("record", self.unnest.split("."), "        ")}')
+        lines.append('        if not isinstance(items, _ARRAY_TYPES) or len(items) == 0:')
+        lines.append('            items = (None,)')
+        lines.append('        for item in items:')
+        lines.append('            if item.__class__ is not dict:')
+        lines.append('                item = _EMPTY')
+        for path in inner:
+            values[prefix + path] = lookup('item', path.split('.'), '            ')
+        lines.append(f'            yield ({"".join(values[path] + ", " for path in self.columns)})')
+        return '\n'.join(lines) + '\n'
+
+    def frame(self, records):
+        # Flat DataFrame of the records (an iterable of dicts, or a DataFrame whose cells hold the nested values).
+        if isinstance(records, pd.DataFrame):
+            records = records.to_dict('records')
+        return pd.DataFrame.from_records(list(self.rows(records)), columns=self.names)
+
+
+# Specs for the fakestore API payloads (/products, /carts, /users), giving the columns the pipelines
+# staged before: the nested rating, address and name objects are flattened into their fields and every
+# cart line becomes one sales row.
+PRODUCTS = Flattener(
+    ['id', 'title', 'price', 'description', 'category', 'image', 'rating.rate', 'rating.count'],
+    rename={'rating.rate': 'rate', 'rating.count': 'count'})
+
+SALES = Flattener(
+    ['id', 'userId', 'date', '__v', 'products.productId', 'products.quantity'],
+    unnest='products', rename={'products.productId': 'productId', 'products.quantity': 'quantity'})
+
+USERS = Flattener(
+    ['id', 'email', 'username', 'password', 'phone', '__v', 'address.city', 'address.street', 'address.number',
+     'address.zipcode', 'address.geolocation.lat', 'address.geolocation.long', 'name.firstname', 'name.lastname'],
+    rename={'address.city': 'city', 'address.street': 'street', 'address.number': 'number',
+            'address.zipcode': 'zipcode', 'address.geolocation.lat': 'geolocation.lat',
+            'address.geolocation.long': 'geolocation.long', 'name.firstname': 'firstname',
+            'name.lastname': 'lastname'})
@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+# In-process hash join. The API pipeline wrote every flattened payload to its own staging table only to
+# join them back together inside Postgres with CREATE TABLE ... AS SELECT ... JOIN. Here the join happens
+# before anything is written: the smaller (build) side is hashed once on its key, and the larger (probe)
+# side is streamed through it batch by batch, so the joined rows can be written straight to the combined
+# staging table as they are produced.
+#
+# When the build side is larger than memory_limit, the join falls back to a partitioned (Grace) hash join:
+# both sides are hash-partitioned on their keys into pickle files in a temporary directory, and the
+# partitions are then joined one pair at a time, each small enough to hash in memory.
+#
+# The join is an inner join with SQL semantics: rows with a null key match nothing.
+
+MEMORY_LIMIT = 256 << 20
+
+
+def _batches(frames):
+    if isinstance(frames, pd.DataFrame):
+        return [frames]
+    return frames
+
+
+def _partitions_of(keys, partitions):
+    # Partition number of every key. Numeric keys are hashed as floats, so 3 and 3.0 (an integer key column
+    # that picked up a null on one side) land in the same partition.
+    values = keys.to_numpy()
+    if pd.api.types.is_numeric_dtype(keys.dtype):
+        values = values.astype('float64')
+    return pd.util.hash_array(values) % partitions
+
+
+class _Spill:
+    # DataFrame pieces hash-partitioned on a key column, one pickle file per partition and piece.
+
+    def __init__(self, directory, name, key, partitions):
+        self.directory = directory
+        self.name = name
+        self.key = key
+        self.partitions = partitions
+        self._files = [[] for _ in range(partitions)]
+
+    def add(self, frame):
+        numbers = _partitions_of(frame[self.key], self.partitions)
+        for number, piece in frame.groupby(numbers, sort=False):
+            files = self._files[number]
+            path = os.path.join(self.directory, f'{self.name}_{number}_{len(files)}.pkl')
+            piece.to_pickle(path)
+            files.append(path)
+
+    def pieces(self, number):
+        for path in self._files[number]:
+            yield pd.read_pickle(path)
+
+    def read(self, number):
+        pieces = list(self.pieces(number))
+        return pd.concat(pieces, ignore_index=True) if pieces else None
+
+
+class _HashTable:
+    # The build side hashed on its key. Unique keys (the usual case: a dimension-like side joined on its id)
+    # are probed with one hash lookup per probe row; duplicate keys fall back to a merge.
+
+    def __init__(self, build, key, columns):
+        build = build[build[key].notna()]
+        self.index = pd.Index(build[key])
+        self.unique = self.index.is_unique
+        self.values = build[columns].reset_index(drop=True)
+        if not self.unique:
+            self.values = self.values.assign(__join_key=build[key].to_numpy())
+
+    def probe(self, batch, probe_key):
+        overlap = [column for column in self.values.columns if column in batch.columns]
+        if overlap:
+            raise ValueError(f'Columns {overlap} are on both sides of the join')
+        batch = batch[batch[probe_key].notna()]
+        if not self.unique:
+            joined = batch.assign(__join_key=batch[probe_key].to_numpy()).merge(self.values, on='__join_key')
+            return joined.drop(columns=['__join_key'])
+
+        positions = self.index.get_indexer(batch[probe_key])
+        matched = positions >= 0
+        left = batch[matched].reset_index(drop=True)
+        right = self.values.take(positions[matched]).reset_index(drop=True)
+        return pd.concat([left, right], axis=1)
+
+
+def hash_join(probe, build, probe_key, build_key, columns=None, memory_limit=MEMORY_LIMIT, partitions=16,
+              spill_dir=None):
+    # Inner join of probe and build on probe[probe_key] == build[build_key], yielded in batches.
+    # probe, build: a DataFrame or an iterable of DataFrame batches; probe may be larger than memory.
+    # columns:      build columns added to every probe row (default: every build column but the key).
+    # memory_limit: bytes the build side may take in memory before the join spills both sides to disk.
+    # spill_dir:    parent directory of the spill files (default: the system temporary directory).
+    held = []
+    held_bytes = 0
+    build_spill = None
+    directory = None
+
+    try:
+        for batch in _batches(build):
+            if columns is None:
+                columns = [column for column in batch.columns if column != build_key]
+            batch = batch[[build_key] + [column for column in columns if column != build_key]]
+            if build_spill is not None:
+                build_spill.add(batch)
+                continue
+
+            held.append(batch)
+            held_bytes += int(batch.memory_usage(deep=True).sum())
+            if held_bytes > memory_limit:
+                directory = tempfile.mkdtemp(prefix='hash_join_', dir=spill_dir)
+                print(f'Join build side exceeds {memory_limit / 1e6:.0f} MB, spilling {partitions} partitions '
+                      f'to {directory}')
+                build_spill = _Spill(directory, 'build', build_key, partitions)
+                for piece in held:
+                    build_spill.add(piece)
+                held = []
+
+        if build_spill is None:
+            if not held:
+                return
+            table = _HashTable(pd.concat(held, ignore_index=True), build_key, columns)
+            held = None
+            for batch in _batches(probe):
+                joined = table.probe(batch, probe_key)
+                if len(joined):
+                    yield joined
+            return
+
+        probe_spill = _Spill(directory, 'probe', probe_key, partitions)
+        for batch in _batches(probe):
+            probe_spill.add(batch)
+
+        for number in range(partitions):
+            build_part = build_spill.read(number)
+            if build_part is None:
+                continue
+            table = _HashTable(build_part, build_key, columns)
+            for piece in probe_spill.pieces(number):
+                joined = table.probe(piece, probe_key)
+                if len(joined):
+                    yield joined
+
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
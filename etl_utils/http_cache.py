@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from email.utils import formatdate
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# On-disk cache of API responses. The API pipelines downloaded every payload on every run and rebuilt
+# staging from it although the source rarely changes. Here each response body is stored by URL (query
+# parameters included, in a canonical order) together with its ETag / Last-Modified validators:
+#   - within the TTL the cached payload is used without any request
+#   - after it the request is sent with If-None-Match / If-Modified-Since, and a 304 answer reuses the
+#     cached payload without transferring it again
+#   - a full 200 answer is compared with the cached body by content hash, so servers that send no
+#     validators still get unchanged payloads recognised
+#
+# The cache also records, per consumer (a pipeline, a GCS blob, a BigQuery dataset), which version of each
+# payload it last loaded successfully. needs_load() tells a pipeline whether anything changed since then,
+# so the staging writes and warehouse load jobs can be skipped when nothing did.
+#
+# Bodies are stored once per content hash; the manifest (manifest.json) holds the entries and the load
+# records. The cache directory defaults to ~/.cache/etl_http and can be moved with ETL_HTTP_CACHE.
+
+HTTP_CACHE_DIR = os.getenv('ETL_HTTP_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'etl_http'))
+
+
+def canonical_url(url, params=None):
+    # Same URL and parameters -> same cache key, whatever order the parameters were written in.
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True) + list((params or {}).items()))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+def _max_age(headers):
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() == 'max-age' and value.isdigit():
+            return int(value)
+        if name.lower() in ('no-cache', 'no-store'):
+            return 0
+    return 0
+
+
+class _HashingFile:
+    # Binary file that hashes what is written to it.
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class ResponseCache:
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, ttl=None):
+        # ttl: seconds a payload is used without asking the server again. None follows the response's
+        # Cache-Control max-age (revalidating every time when there is none); 0 always revalidates.
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.status = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.manifest_path) as file:
+                self._manifest = json.load(file)
+        except (OSError, ValueError):
+            self._manifest = {}
+        self._manifest.setdefault('responses', {})
+        self._manifest.setdefault('loaded', {})
+
+    def _entry(self, url):
+        return self._manifest['responses'].get(canonical_url(url))
+
+    def _body_path(self, sha256):
+        return os.path.join(self.cache_dir, f'{sha256}.json')
+
+    def fresh(self, url):
+        # True while the cached payload is within its TTL and may be used without a request.
+        entry = self._entry(url)
+        if entry is None or not os.path.exists(self._body_path(entry['sha256'])):
+            return False
+        if time() < entry['expires']:
+            self.status[url] = 'fresh'
+            return True
+        return False
+
+    def validators(self, url):
+        # Conditional request headers for the cached payload (none when nothing is cached).
+        entry = self._entry(url)
+        if entry is None or not os.path.exists(self._body_path(entry['sha256'])):
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        elif entry.get('fetched_at'):
+            headers['If-Modified-Since'] = formatdate(entry['fetched_at'], usegmt=True)
+        return headers
+
+    def read(self, url):
+        with open(self.path(url), 'rb') as file:
+            return file.read()
+
+    def not_modified(self, url, headers):
+        # Records a 304 answer: the cached payload is still current and its TTL starts again.
+        with self._lock:
+            entry = self._entry(url)
+            entry['fetched_at'] = time()
+            entry['expires'] = entry['fetched_at'] + self._ttl(headers)
+            entry['etag'] = headers.get('ETag', entry.get('etag'))
+        self.status[url] = 'not_modified'
+
+    def store(self, url, body, headers):
+        # Records a 200 answer and returns 'new', 'changed' or 'unchanged' (same content as the cached copy).
+        with self.writer(url, headers) as file:
+            file.write(body)
+        return self.status[url]
+
+    @contextmanager
+    def writer(self, url, headers):
+        # Streams a 200 answer into the cache: yields a binary file for the body chunks, and records the
+        # response once the block completes (a failed download leaves the cached copy as it was).
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = os.path.join(self.cache_dir, f'{os.getpid()}.{threading.get_ident()}.{id(headers)}.tmp')
+        file = _HashingFile(temporary)
+        try:
+            yield file
+            file.close()
+            path = self._body_path(file.sha256.hexdigest())
+            if os.path.exists(path):
+                os.remove(temporary)
+            else:
+                os.replace(temporary, path)
+        except BaseException:
+            file.close()
+            os.remove(temporary)
+            raise
+        self._record(url, file.sha256.hexdigest(), headers)
+
+    def _record(self, url, sha256, headers):
+        with self._lock:
+            key = canonical_url(url)
+            previous = self._manifest['responses'].get(key)
+            fetched_at = time()
+            self._manifest['responses'][key] = {
+                'sha256': sha256,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'fetched_at': fetched_at,
+                'expires': fetched_at + self._ttl(headers),
+            }
+
+        if previous is None:
+            status = 'new'
+        elif previous['sha256'] == sha256:
+            status = 'unchanged'
+        else:
+            status = 'changed'
+            self._remove_unused(previous['sha256'])
+        self.status[url] = status
+
+    def path(self, url):
+        # File holding the cached body of 'url', e.g. to parse it in batches with etl_utils.json_stream.
+        return self._body_path(self._entry(url)['sha256'])
+
+    def _ttl(self, headers):
+        return self.ttl if self.ttl is not None else _max_age(headers)
+
+    def _remove_unused(self, sha256):
+        if all(entry['sha256'] != sha256 for entry in self._manifest['responses'].values()):
+            try:
+                os.remove(self._body_path(sha256))
+            except OSError:
+                pass
+
+    def version(self, url):
+        entry = self._entry(url)
+        return entry['sha256'] if entry is not None else None
+
+    def needs_load(self, keys, consumer, versions=None):
+        # True when any of the keys (URLs, or other sources such as GCS URIs) has a version the consumer has
+        # not loaded yet. versions: {key: version} for keys that are not cached responses (e.g. blob hashes).
+        loaded = self._manifest['loaded'].get(consumer, {})
+        for key in keys:
+            version = versions[key] if versions is not None and key in versions else self.version(key)
+            if version is None or loaded.get(canonical_url(key)) != version:
+                return True
+        return False
+
+    def mark_loaded(self, keys, consumer, versions=None):
+        # Records that the consumer loaded the current version of every key; call only after a successful load.
+        with self._lock:
+            loaded = self._manifest['loaded'].setdefault(consumer, {})
+            for key in keys:
+                version = versions[key] if versions is not None and key in versions else self.version(key)
+                loaded[canonical_url(key)] = version
+        self.save()
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            temporary = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(self._manifest, file, indent=1)
+            os.replace(temporary, self.manifest_path)
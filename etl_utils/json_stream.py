@@ -0,0 +1,170 @@
+import codecs
+import json
+
+import requests
+
+# Incremental JSON parsing for large API payloads. response.json() followed by pd.DataFrame() holds the
+# whole body as bytes, as one Python object per value and as a DataFrame at the same time, so peak memory
+# grows with the size of the response. The payloads of the API sources are a top-level JSON array of
+# records; here the array is read from a stream of byte chunks (an HTTP response, a cached body on disk)
+# and its elements are decoded one at a time, as soon as their last byte has arrived, and handed out in
+# batches of at most 'batch_size' records. Memory stays at one chunk plus one batch.
+#
+# The elements are decoded with the standard json decoder (json.JSONDecoder.raw_decode), so the records
+# are the same dicts and lists json.loads() would have produced.
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+
+
+def iter_file(file, chunk_size=CHUNK_SIZE):
+    # Byte chunks of an open binary file.
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_array(chunks):
+    # Yields the elements of the top-level JSON array in 'chunks' (an iterable of bytes or str).
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+    finished = False
+    # Length the buffer must reach before an incomplete element is decoded again; doubling it keeps the
+    # work linear for elements that span many chunks.
+    retry_at = 0
+
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer = buffer[position:] + text_decoder.decode(b'', final=True)
+            position = 0
+            end_of_stream = True
+        else:
+            if isinstance(chunk, bytes):
+                chunk = text_decoder.decode(chunk)
+            buffer = buffer[position:] + chunk
+            position = 0
+            end_of_stream = False
+            if len(buffer) < retry_at:
+                continue
+
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+
+            if finished:
+                raise ValueError(f'Unexpected data after the end of the JSON array: {buffer[position:position + 20]!r}')
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('The JSON payload is not an array')
+                started = True
+                position += 1
+                expect_value = True
+                after_comma = False
+                continue
+
+            character = buffer[position]
+            if character == ']':
+                if expect_value and after_comma:
+                    raise ValueError("Trailing ',' in the JSON array")
+                finished = True
+                position += 1
+                continue
+            if character == ',' and not expect_value:
+                expect_value = after_comma = True
+                position += 1
+                continue
+            if not expect_value:
+                raise ValueError(f"Expected ',' or ']' in the JSON array, found {buffer[position:position + 20]!r}")
+
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if end_of_stream:
+                    raise
+                retry_at = 2 * (len(buffer) - position)
+                break
+            # A value that ends exactly at the end of the buffer may continue in the next chunk (a number).
+            if end == len(buffer) and not end_of_stream:
+                retry_at = len(buffer) + 1
+                break
+
+            retry_at = 0
+            expect_value = False
+            position = end
+            yield value
+
+        if end_of_stream:
+            if not finished:
+                raise ValueError('The JSON payload ended before its array was closed')
+            return
+
+
+def iter_batches(records, batch_size=5000):
+    # Groups an iterable of records into lists of at most batch_size records.
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_record_batches(chunks, batch_size=5000):
+    # Batches of the records of the JSON array streamed in 'chunks'.
+    return iter_batches(iter_array(chunks), batch_size)
+
+
+def iter_json_file(path, batch_size=5000, chunk_size=CHUNK_SIZE):
+    # Batches of the records of the JSON array stored in the file at 'path'.
+    with open(path, 'rb') as file:
+        yield from iter_record_batches(iter_file(file, chunk_size), batch_size)
+
+
+def iter_url_batches(url, batch_size=5000, session=None, timeout=60, chunk_size=CHUNK_SIZE):
+    # Batches of the records of the JSON array served at 'url', parsed while the response is downloaded.
+    http = session if session is not None else requests
+    with http.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        yield from iter_record_batches(response.iter_content(chunk_size), batch_size)
+
+
+def write_json_array(file, batches, indent=None):
+    # Writes the records of 'batches' to a text file as one JSON array, the same text json.dump() writes for
+    # the whole list, without building the list or its string. Returns the number of records written.
+    count = 0
+    for batch in batches:
+        for record in batch:
+            text = json.dumps(record, indent=indent)
+            if indent is not None:
+                text = text.replace('\n', '\n' + ' ' * indent)
+                file.write('[\n' + ' ' * indent if count == 0 else ',\n' + ' ' * indent)
+            else:
+                file.write('[' if count == 0 else ', ')
+            file.write(text)
+            count += 1
+    file.write('[]' if count == 0 else ('\n]' if indent is not None else ']'))
+    return count
+
+
+def write_ndjson(file, batches):
+    # Writes the records of 'batches' to a text file as newline delimited JSON (one record per line, no
+    # trailing newline). Returns the number of records written.
+    count = 0
+    for batch in batches:
+        for record in batch:
+            if count:
+                file.write('\n')
+            file.write(json.dumps(record))
+            count += 1
+    return count
@@ -0,0 +1,145 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+# Parser for locale-formatted currency and number strings such as '₹1,099' or '28,341,469'.
+# The price columns used to be cleaned with one str.replace() per symbol/separator followed by
+# astype(float), allocating a new object column for every step and aborting the load on the first
+# malformed cell. Here the symbols, separators and spaces are dropped from the column's utf-8 byte
+# buffer in a single vectorized pass, the result is cast straight to a float64 / Int64 array by Arrow,
+# and cells that still cannot be read are reported instead of raising.
+# Without pyarrow the same cleaning runs as one regular expression followed by pd.to_numeric().
+
+CURRENCY_SYMBOLS = '₹$€£'
+NUMBER_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+
+def _drop_tokens(data, tokens):
+    # Marks every byte of every occurrence of the given byte sequences (multi-byte symbols such as '₹' included).
+    drop = np.zeros(len(data), dtype=bool)
+    for token in tokens:
+        token = np.frombuffer(token, dtype=np.uint8)
+        if len(token) == 1:
+            drop |= data == token[0]
+            continue
+        if len(data) < len(token):
+            continue
+        starts = np.ones(len(data) - len(token) + 1, dtype=bool)
+        for position, byte in enumerate(token):
+            starts &= data[position:position + len(starts)] == byte
+        for position in range(len(token)):
+            drop[position:position + len(starts)] |= starts
+    return drop
+
+
+WHITESPACE = ' \t\xa0'
+
+
+def _clean_arrow(series, symbols, thousands, decimal):
+    # Returns (array, candidates, filled): the cleaned strings as an Arrow array, which of them are not
+    # empty, and which cells held anything but whitespace before cleaning.
+    array = pa.array(series.astype('string[pyarrow]').array)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    array = array.cast(pa.large_string())
+    if array.offset:
+        array = pa.concat_arrays([array])
+
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[:len(array) + 1]
+    data_buffer = array.buffers()[2]
+    data = np.frombuffer(data_buffer, dtype=np.uint8)[:offsets[-1]] if data_buffer is not None else np.empty(0, np.uint8)
+
+    tokens = [character.encode('utf-8') for character in dict.fromkeys(symbols + thousands + WHITESPACE)]
+    keep = ~_drop_tokens(data, tokens)
+    written = ~_drop_tokens(data, [character.encode('utf-8') for character in WHITESPACE])
+    valid = array.is_valid().to_numpy(zero_copy_only=False)
+    filled = valid & (np.diff(np.concatenate(([0], np.cumsum(written, dtype=np.int64)))[offsets]) > 0)
+
+    data = data[keep]
+    if decimal != '.' and len(decimal.encode('utf-8')) == 1:
+        data[data == ord(decimal)] = ord('.')
+    offsets = np.concatenate(([0], np.cumsum(keep, dtype=np.int64)))[offsets]
+
+    cleaned = pa.LargeStringArray.from_buffers(len(array), pa.py_buffer(offsets), pa.py_buffer(data),
+                                               array.buffers()[0], array.null_count)
+    candidates = valid & (np.diff(offsets) > 0)
+    return cleaned, candidates, filled
+
+
+def _parse_arrow(series, symbols, thousands, decimal):
+    cleaned, candidates, filled = _clean_arrow(series, symbols, thousands, decimal)
+    numbers = np.full(len(series), np.nan)
+    mask = pa.array(candidates)
+
+    try:
+        numbers[candidates] = pc.cast(cleaned.filter(mask), pa.float64()).to_numpy(zero_copy_only=False)
+        unparseable = np.zeros(len(series), dtype=bool)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        # At least one cell is not a number: validate cell by cell (still vectorized) and cast the rest.
+        valid = pc.fill_null(pc.match_substring_regex(cleaned, NUMBER_PATTERN), False).to_numpy(zero_copy_only=False)
+        readable = candidates & valid
+        numbers[readable] = pc.cast(cleaned.filter(pa.array(readable)), pa.float64()).to_numpy(zero_copy_only=False)
+        unparseable = candidates & ~valid
+
+    # Cells that held only symbols or separators (e.g. '₹') are left empty by the cleaning, but they are
+    # not blank either.
+    return numbers, unparseable | (filled & ~candidates)
+
+
+def _parse_python(series, symbols, thousands, decimal):
+    pattern = '[' + re.escape(symbols + thousands) + r'\s]'
+    original = series.astype('string')
+    text = original.str.replace(pattern, '', regex=True)
+    if decimal != '.':
+        text = text.str.replace(decimal, '.', regex=False)
+
+    numbers = pd.to_numeric(text, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    filled = original.str.strip().fillna('').ne('').to_numpy(dtype=bool)
+    unparseable = np.isnan(numbers) & filled
+    return numbers, unparseable
+
+
+def parse_numbers(series, symbols=CURRENCY_SYMBOLS, thousands=',', decimal='.', dtype='float64'):
+    # Returns (values, unparseable):
+    #   values      - a float64 (dtype='float64') or Int64 (dtype='Int64') Series with the original index;
+    #                 null, blank (empty or whitespace) and unparseable cells are NaN / <NA>.
+    #   unparseable - boolean array marking the cells that held text but no readable number, symbol-only
+    #                 cells such as '₹' included (for Int64 also numbers with a fractional part).
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        numbers = series.to_numpy(dtype='float64', na_value=np.nan)
+        unparseable = np.zeros(len(series), dtype=bool)
+    elif pa is not None:
+        numbers, unparseable = _parse_arrow(series, symbols, thousands, decimal)
+    else:
+        numbers, unparseable = _parse_python(series, symbols, thousands, decimal)
+
+    if dtype == 'Int64':
+        fractional = ~np.isnan(numbers) & (numbers % 1 != 0)
+        unparseable = unparseable | fractional
+        missing = np.isnan(numbers) | fractional
+        values = pd.arrays.IntegerArray(np.where(missing, 0, numbers).astype(np.int64), missing)
+        return pd.Series(values, index=series.index, name=series.name), unparseable
+
+    return pd.Series(numbers, index=series.index, name=series.name), unparseable
+
+
+def parse_numeric_columns(dataframe, columns, symbols=CURRENCY_SYMBOLS, thousands=',', decimal='.',
+                          dtype='float64'):
+    # Parses several columns with the same format.
+    # Returns (parsed, rejects): the frame with the columns converted, and the original rows holding at
+    # least one unparseable cell. Rejected cells become null in 'parsed' so the rest of the row still loads.
+    parsed = {}
+    rejected = np.zeros(len(dataframe), dtype=bool)
+
+    for column in columns:
+        parsed[column], unparseable = parse_numbers(dataframe[column], symbols, thousands, decimal, dtype)
+        rejected |= unparseable
+
+    return dataframe.assign(**parsed), dataframe[rejected]
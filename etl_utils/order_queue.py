@@ -0,0 +1,133 @@
+import argparse
+import multiprocessing
+import signal
+from time import sleep
+
+import psycopg2
+import sqlalchemy.exc
+from dotenv import load_dotenv
+
+from etl_utils.connections import ConnectionManager
+from etl_utils.copy_writer import copy_from_dataframe
+
+# Workers of the order ingestion queue (homework.order_queue and process_order_queue() in
+# '04 ETL - API to DB/04 homework.sql'). Clients append orders to the queue; every worker is a separate
+# process with its own connection that calls process_order_queue() in a loop, one transaction per batch.
+# The function claims its batch with FOR UPDATE SKIP LOCKED, so the workers never wait for each other's
+# orders, and locks the inventory rows of the batch in product_key order, so they never deadlock on them.
+# An idle worker polls the queue every 'idle_sleep' seconds.
+#
+# A worker whose batch fails (e.g. the connection drops, or the pool cannot open one) prints the error and
+# retries after 'idle_sleep' seconds: the failed transaction is rolled back, so its orders are still pending
+# and are claimed again.
+#
+# Usage (the SQL in '04 homework.sql' must have been run first):
+#   python -m etl_utils.order_queue --workers 4 --batch-size 100
+#
+# Orders are queued with enqueue() from Python, or with a plain INSERT from any client:
+#   INSERT INTO homework.order_queue (sale_id, user_id, prod_id, qty) VALUES (8, 4, 10, 2);
+
+QUEUE_TABLE = 'homework.order_queue'
+ORDER_COLUMNS = ['sale_id', 'user_id', 'prod_id', 'qty']
+
+
+def enqueue(cursor, orders):
+    # Appends the orders (a dataframe with the ORDER_COLUMNS) to the queue. Returns the number of orders.
+    return copy_from_dataframe(cursor, orders, QUEUE_TABLE, ORDER_COLUMNS)
+
+
+def process_batch(cursor, batch_size=100):
+    # Applies up to batch_size pending orders. Returns the number of orders processed (0: the queue is empty).
+    cursor.execute('SELECT process_order_queue(%s)', (batch_size,))
+    return cursor.fetchone()[0]
+
+
+def pending(cursor):
+    cursor.execute(f'SELECT count(*) FROM {QUEUE_TABLE} WHERE processed_at IS NULL')
+    return cursor.fetchone()[0]
+
+
+def _work(dbname, connection, batch_size, idle_sleep, stop, processed):
+    # Worker process: one pooled connection, one transaction per batch, until 'stop' is set and the
+    # queue is empty. Ctrl+C is left to the parent, which sets 'stop', so a batch is never interrupted.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    db = ConnectionManager(dbname, pool_size=1, **connection)
+    try:
+        while True:
+            try:
+                with db.cursor() as cursor:
+                    orders = process_batch(cursor, batch_size)
+            except (psycopg2.Error, sqlalchemy.exc.DBAPIError) as error:
+                # Errors of the query are psycopg2's; a connection the pool fails to check out raises
+                # SQLAlchemy's. Either way the batch is retried, without hammering a database that is down.
+                print(error)
+                sleep(idle_sleep)
+                continue
+
+            if orders:
+                with processed.get_lock():
+                    processed.value += orders
+            elif stop.is_set():
+                return
+            else:
+                sleep(idle_sleep)
+    finally:
+        db.close()
+
+
+class OrderWorkers:
+    # A pool of worker processes consuming the queue while the block runs:
+    #   with OrderWorkers(workers=4):
+    #       ...  # clients enqueue orders
+    # On exit the workers finish the orders still pending and stop.
+
+    def __init__(self, dbname='Destination', workers=4, batch_size=100, idle_sleep=0.01, **connection):
+        # connection: further ConnectionManager arguments (host, port, user, password).
+        self.dbname = dbname
+        self.workers = workers
+        self.batch_size = batch_size
+        self.idle_sleep = idle_sleep
+        self.connection = connection
+        self.processed = multiprocessing.Value('q', 0)
+        self._stop = multiprocessing.Event()
+        self._processes = []
+
+    def __enter__(self):
+        self._stop.clear()
+        self._processes = [multiprocessing.Process(target=_work, args=(self.dbname, self.connection, self.batch_size,
+                                                                       self.idle_sleep, self._stop, self.processed),
+                                                   name=f'order-worker-{number}', daemon=True)
+                           for number in range(self.workers)]
+        for process in self._processes:
+            process.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Apply the orders of homework.order_queue with a pool of workers.')
+    parser.add_argument('--dbname', default='Destination')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=100, help='orders applied per transaction')
+    parser.add_argument('--idle-sleep', type=float, default=0.01, help='seconds between polls of an empty queue')
+    arguments = parser.parse_args(argv)
+
+    load_dotenv()
+    workers = OrderWorkers(arguments.dbname, arguments.workers, arguments.batch_size, arguments.idle_sleep)
+    print(f'{arguments.workers} order workers started, Ctrl+C to stop')
+    try:
+        with workers:
+            while True:
+                sleep(60)
+    except KeyboardInterrupt:
+        pass
+    print(f'{workers.processed.value} orders processed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,404 @@
+import argparse
+import json
+import os
+import re
+import sys
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from etl_utils.numbers import parse_numbers
+
+# Dataset profiler. The transformation notebook explored the movies table column by column, e.g.
+# for col in df: df[col].astype(str).str.contains(',') to find multi-valued columns, and decided the
+# data types by looking at df.dtypes and a few rows. Here the same questions are answered in one
+# streaming pass over the batches of a table or file (stream_table(), read_excel_chunks() or
+# pd.read_csv(chunksize=...)), with every check vectorized per batch:
+#   - inferred type per column, in the types coerce_columns() understands, plus the number of values
+#     that would not convert to it
+#   - null rate (blank text counts as null, as it does in the coercion step)
+#   - distinct values: counted exactly up to 'exact_limit' distinct hashes per column, then estimated
+#     with a HyperLogLog sketch, so memory stays bounded on large tables
+#   - delimiter-packed columns, i.e. columns to split into rows (e.g. Genre 'Drama, Crime'), told apart
+#     from columns whose commas are prose, URLs or thousands separators by how often the pieces repeat
+#   - repeated columns of one attribute (e.g. Star1 .. Star4), i.e. columns to stack into rows
+#   - candidate business keys: columns, and pairs of columns, without nulls whose values are all distinct
+# A uniform reservoir sample of the rows is kept on the side for the checks that are too slow to run on
+# every row (date parsing) and for example values.
+#
+# Usage:
+#   python -m etl_utils.profiler --table movies --database Source --schema-out movies_schema.json
+#   python -m etl_utils.profiler --file amazon.xlsx
+
+DELIMITERS = (',', ';', '|')
+BOOLEAN_TEXT = {'true', 'false', 't', 'f', 'yes', 'no', 'y', 'n'}
+
+
+class HyperLogLog:
+    # Cardinality sketch over 64-bit hashes: 2^precision one-byte registers, standard error 1.04 / sqrt(2^precision)
+    # (0.8% with the default precision of 14).
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        shift = np.uint64(64 - self.precision)
+        index = (hashes >> shift).astype(np.int64)
+        # The rank is the position of the first set bit in the remaining bits; a sentinel bit past them
+        # keeps the rank bounded when they are all zero.
+        rest = (hashes << np.uint64(self.precision)) | (np.uint64(1) << np.uint64(self.precision - 1))
+        rank = (65 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities: linear counting over the empty registers is more accurate.
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+def _bit_length(values):
+    # Bit length of uint64 values, computed on 32-bit halves so that every step is exact in float64.
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        high_bits = np.where(high > 0, np.floor(np.log2(np.maximum(high, 1))) + 33, 0)
+        low_bits = np.where(low > 0, np.floor(np.log2(np.maximum(low, 1))) + 1, 0)
+    return np.where(high_bits > 0, high_bits, low_bits).astype(np.int64)
+
+
+class DistinctCounter:
+    # Exact distinct count (a sorted array of 64-bit hashes) until more than exact_limit distinct hashes
+    # have been seen, a HyperLogLog estimate from then on.
+
+    def __init__(self, exact_limit=100000, precision=14):
+        self.exact_limit = exact_limit
+        self.sketch = HyperLogLog(precision)
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    @property
+    def exact(self):
+        return self.hashes is not None
+
+    def add(self, hashes):
+        self.sketch.add(hashes)
+        if self.hashes is not None:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > self.exact_limit:
+                self.hashes = None
+
+    def count(self):
+        return len(self.hashes) if self.hashes is not None else self.sketch.count()
+
+
+def _hash(values):
+    # 64-bit hash per value. categorize=False hashes every value directly, which is cheaper than factorizing
+    # the batch first when most values are distinct.
+    return pd.util.hash_pandas_object(values, index=False, categorize=False).to_numpy()
+
+
+def _combine(first, second):
+    # Hash of a pair of values from the hashes of both.
+    return (first * np.uint64(0x9E3779B97F4A7C15)) ^ second
+
+
+def _present(series):
+    # Cells that hold a value; blank text counts as missing.
+    present = series.notna().to_numpy().copy()
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        present &= series.astype('string').str.strip().ne('').fillna(False).to_numpy(dtype=bool)
+    return present
+
+
+class ColumnProfile:
+
+    def __init__(self, name, exact_limit):
+        self.name = name
+        self.rows = 0
+        self.present = 0
+        self.numbers = 0
+        self.integers = 0
+        self.booleans = 0
+        self.datetimes = 0
+        self.sample_datetime_share = 0.0
+        self.distinct = DistinctCounter(exact_limit)
+        # Per delimiter: [values containing it, pieces after splitting, distinct pieces].
+        self.delimited = {delimiter: [0, 0, DistinctCounter(exact_limit)] for delimiter in DELIMITERS}
+
+    def update(self, series, hashes):
+        present = _present(series)
+        values = series[present]
+        self.rows += len(series)
+        self.present += len(values)
+        if values.empty:
+            return
+
+        self.distinct.add(hashes[present])
+
+        if pd.api.types.is_bool_dtype(values):
+            self.booleans += len(values)
+            return
+        if pd.api.types.is_datetime64_any_dtype(values):
+            self.datetimes += len(values)
+            return
+
+        if pd.api.types.is_numeric_dtype(values):
+            self.numbers += len(values)
+            self.integers += int(np.count_nonzero(np.mod(values.to_numpy(dtype=float), 1) == 0))
+            return
+
+        numbers, unparseable = parse_numbers(values, dtype='float64')
+        parsed = numbers.notna().to_numpy() & ~unparseable
+        self.numbers += int(parsed.sum())
+        parsed_values = numbers.to_numpy(dtype=float, na_value=np.nan)[parsed]
+        self.integers += int(np.count_nonzero(np.mod(parsed_values, 1) == 0))
+
+        text = values.astype('string').str.strip()
+        self.booleans += int(text.str.lower().isin(BOOLEAN_TEXT).sum())
+
+        # Numbers (thousands separators) and URLs are not considered for splitting.
+        candidates = text[~parsed & ~text.str.contains('://', regex=False).fillna(False).to_numpy(dtype=bool)]
+        for delimiter, counts in self.delimited.items():
+            packed = candidates[candidates.str.contains(delimiter, regex=False).fillna(False)]
+            if packed.empty:
+                continue
+            pieces = packed.str.split(delimiter, regex=False).explode().str.strip()
+            pieces = pieces[pieces.ne('').fillna(False)]
+            counts[0] += len(packed)
+            counts[1] += len(pieces)
+            counts[2].add(_hash(pieces.reset_index(drop=True)))
+
+    def update_sample(self, series):
+        # Date detection runs on the sample only: parsing free-form dates is far slower than the checks above.
+        values = series[_present(series)]
+        if values.empty or pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            return
+        if pd.api.types.is_datetime64_any_dtype(values):
+            self.sample_datetime_share = 1.0
+            return
+        text = values.astype('string').str.strip()
+        looks_like_date = text.str.contains(r'\d', regex=True) & text.str.contains(r'[-/:.]', regex=True)
+        parsed = pd.to_datetime(text[looks_like_date.fillna(False)].astype(object), errors='coerce', format='mixed')
+        self.sample_datetime_share = parsed.notna().sum() / len(values)
+
+    def packed_delimiter(self, min_share=0.01, max_piece_ratio=0.5):
+        # A column is delimiter-packed when enough of its values contain the delimiter and the pieces repeat
+        # across rows (a few genres or tags), unlike prose or titles whose pieces are mostly unique.
+        best = None
+        for delimiter, (values, pieces, distinct) in self.delimited.items():
+            if values < 2 or values < min_share * max(self.present, 1) or not pieces:
+                continue
+            ratio = distinct.count() / pieces
+            if ratio <= max_piece_ratio and (best is None or values > best[1]):
+                best = (delimiter, values, ratio)
+        return best
+
+    def inferred_type(self, threshold=0.95):
+        # Returns (type, values that would not convert). The narrowest type matching at least 'threshold'
+        # of the present values wins; the rest would be counted as failures and filled by coerce_columns().
+        if not self.present:
+            return 'string', 0
+
+        candidates = [('bool', self.booleans if self.booleans > self.numbers else 0),
+                      ('Int64', self.integers),
+                      ('float', self.numbers),
+                      ('datetime', self.datetimes or round(self.sample_datetime_share * self.present))]
+        for kind, matching in candidates:
+            if matching >= threshold * self.present:
+                return kind, self.present - matching
+        return 'string', 0
+
+
+class DatasetProfiler:
+
+    def __init__(self, sample_size=10000, exact_limit=100000, key_columns=8, seed=0):
+        # sample_size: rows kept in the reservoir sample.
+        # key_columns: number of columns whose pairs are tracked as composite business key candidates.
+        self.sample_size = sample_size
+        self.exact_limit = exact_limit
+        self.key_columns = key_columns
+        self.rows = 0
+        self.columns = {}
+        self.pairs = {}
+        self.sample = None
+        self._random = np.random.default_rng(seed)
+
+    def update(self, batch):
+        if not self.columns:
+            self.columns = {column: ColumnProfile(column, self.exact_limit) for column in batch.columns}
+            self._choose_pairs(batch)
+
+        # Every column is hashed once per batch; the pair hashes are combined from the column hashes.
+        hashes = {column: _hash(batch[column]) for column in batch.columns}
+        for column, profile in self.columns.items():
+            profile.update(batch[column], hashes[column])
+
+        for (first, second), counter in self.pairs.items():
+            complete = batch[first].notna().to_numpy() & batch[second].notna().to_numpy()
+            counter.add(_combine(hashes[first], hashes[second])[complete])
+
+        self._update_sample(batch)
+        self.rows += len(batch)
+
+    def _choose_pairs(self, batch):
+        # Composite keys are looked for among the highest-cardinality columns of the first batch.
+        cardinality = {column: batch[column].nunique() for column in batch.columns if batch[column].notna().all()}
+        chosen = sorted(cardinality, key=cardinality.get, reverse=True)[:self.key_columns]
+        self.pairs = {pair: DistinctCounter(self.exact_limit) for pair in combinations(chosen, 2)}
+
+    def _update_sample(self, batch):
+        # Reservoir sampling (algorithm R), vectorized over the batch: row t of the stream replaces a random
+        # slot with probability sample_size / (t + 1).
+        batch = batch.reset_index(drop=True)
+        free = max(self.sample_size - (0 if self.sample is None else len(self.sample)), 0)
+        head, rest = batch.iloc[:free], batch.iloc[free:]
+        self.sample = head if self.sample is None else pd.concat([self.sample, head], ignore_index=True)
+
+        if rest.empty:
+            return
+        positions = self.rows + free + np.arange(len(rest))
+        slots = (self._random.random(len(rest)) * (positions + 1)).astype(np.int64)
+        accepted = slots < self.sample_size
+        if not accepted.any():
+            return
+        # When two rows draw the same slot the later one wins, as it would row by row.
+        replacements = pd.Series(np.flatnonzero(accepted), index=slots[accepted]).groupby(level=0).last()
+        sample = self.sample.copy()
+        sample.iloc[replacements.index.to_numpy()] = rest.iloc[replacements.to_numpy()].to_numpy()
+        self.sample = sample
+
+    def finish(self):
+        if self.sample is not None:
+            for column, profile in self.columns.items():
+                profile.update_sample(self.sample[column])
+        return self
+
+    def report(self, threshold=0.95):
+        # One row per column, in source order.
+        records = []
+        for column, profile in self.columns.items():
+            kind, failures = profile.inferred_type(threshold)
+            packed = profile.packed_delimiter()
+            example = self.sample[column].dropna() if self.sample is not None else pd.Series(dtype=object)
+            records.append({
+                'column': column,
+                'type': kind,
+                'unconvertible': failures,
+                'null_rate': round(1 - profile.present / profile.rows, 4) if profile.rows else 0.0,
+                'distinct': profile.distinct.count(),
+                'exact': profile.distinct.exact,
+                'packed_delimiter': packed[0] if packed else None,
+                'example': str(example.iloc[0])[:40] if len(example) else None,
+            })
+        return pd.DataFrame.from_records(records).set_index('column')
+
+    def schema(self, threshold=0.95):
+        # The {column: type} mapping coerce_columns() expects.
+        return {column: profile.inferred_type(threshold)[0] for column, profile in self.columns.items()}
+
+    def packed_columns(self):
+        # {column: delimiter} for the columns to split into rows with split_to_rows().
+        packed = {column: profile.packed_delimiter() for column, profile in self.columns.items()}
+        return {column: found[0] for column, found in packed.items() if found}
+
+    def repeated_columns(self):
+        # {attribute: [columns]} for numbered columns of one attribute e.g. {'Star': ['Star1', ..., 'Star4']},
+        # the columns to stack into rows with stack_columns().
+        groups = {}
+        for column in self.columns:
+            match = re.fullmatch(r'(.*?)[ _]?(\d+)', column)
+            if match and match.group(1):
+                groups.setdefault(match.group(1), []).append(column)
+        return {attribute: columns for attribute, columns in groups.items() if len(columns) > 1}
+
+    def business_keys(self):
+        # Columns, then pairs of columns, without nulls whose distinct count equals the row count.
+        # Exact while the distinct values fit under exact_limit; beyond that the HyperLogLog estimate
+        # only shows the key is plausible and uniqueness should be checked in the database.
+        def unique(counter, rows):
+            if counter.exact:
+                return counter.count() == rows
+            return abs(counter.count() - rows) <= 3 * 1.04 / np.sqrt(len(counter.sketch.registers)) * rows
+
+        keys = [(column,) for column, profile in self.columns.items()
+                if profile.present == self.rows and unique(profile.distinct, self.rows)]
+        single = {key[0] for key in keys}
+        for pair, counter in self.pairs.items():
+            if not single.intersection(pair) and all(self.columns[column].present == self.rows for column in pair):
+                if unique(counter, self.rows):
+                    keys.append(pair)
+        return keys
+
+
+def profile_batches(batches, sample_size=10000, exact_limit=100000):
+    # Profiles an iterable of DataFrame batches and returns the finished DatasetProfiler.
+    profiler = DatasetProfiler(sample_size=sample_size, exact_limit=exact_limit)
+    for batch in batches:
+        profiler.update(batch)
+    return profiler.finish()
+
+
+def _source_batches(arguments):
+    # The readers are imported on demand, so profiling a CSV file needs neither a database driver nor openpyxl.
+    if arguments.table is not None:
+        from etl_utils.connections import ConnectionManager
+        from etl_utils.db_stream import stream_table
+
+        manager = ConnectionManager(arguments.database)
+        return stream_table(manager, arguments.table, batch_size=arguments.batch_size)
+
+    extension = os.path.splitext(arguments.file)[1].lower()
+    if extension in ('.xlsx', '.xlsm'):
+        from etl_utils.excel_stream import read_excel_chunks
+        return read_excel_chunks(arguments.file, chunk_size=arguments.batch_size, sheet_name=arguments.sheet)
+    if extension == '.csv':
+        return pd.read_csv(arguments.file, chunksize=arguments.batch_size)
+    raise ValueError(f'Unsupported file type {extension}, use .xlsx or .csv')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile a source table or file in one streaming pass.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table', help='table to profile, optionally schema-qualified')
+    source.add_argument('--file', help='.xlsx or .csv file to profile')
+    parser.add_argument('--database', default='Source', help='database holding --table (default: Source)')
+    parser.add_argument('--sheet', help='sheet of the workbook (default: the active sheet)')
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=10000, help='rows kept in the reservoir sample')
+    parser.add_argument('--exact-limit', type=int, default=100000,
+                        help='distinct values counted exactly before switching to HyperLogLog')
+    parser.add_argument('--threshold', type=float, default=0.95,
+                        help='share of values that must convert for a type to be inferred')
+    parser.add_argument('--schema-out', help='write the inferred schema to this JSON file')
+    arguments = parser.parse_args(argv)
+
+    profiler = profile_batches(_source_batches(arguments), arguments.sample, arguments.exact_limit)
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(f'{profiler.rows} rows, {len(profiler.columns)} columns\n')
+        print(profiler.report(arguments.threshold))
+
+    print('\nDelimiter-packed columns (split into rows):', profiler.packed_columns() or 'none')
+    print('Repeated columns (stack into rows):', profiler.repeated_columns() or 'none')
+    print('Candidate business keys:', [list(key) for key in profiler.business_keys()] or 'none')
+
+    schema = profiler.schema(arguments.threshold)
+    print('\nschema = ' + json.dumps(schema, indent=4))
+    if arguments.schema_out:
+        with open(arguments.schema_out, 'w') as file:
+            json.dump(schema, file, indent=4)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
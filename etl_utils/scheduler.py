@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import time
+
+# Dependency-aware stage runner. The pipelines used to call their stages one after another at module
+# level, although most dimension loads only depend on the extract. Here every stage is registered
+# with the stages it must wait for, and whatever is ready runs concurrently on a bounded thread pool
+# (each stage checks its own connection out of the pool, so stages never share a cursor).
+# After the run the critical path is reported: the chain of stages that determined the wall-clock time.
+
+
+class StageScheduler:
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._stages = {}
+        self.timings = {}
+
+    def add(self, function, after=(), name=None):
+        # Registers a stage. 'after' lists the stages (functions or names) that must finish first.
+        name = name if name is not None else function.__name__
+        dependencies = [dependency if isinstance(dependency, str) else dependency.__name__ for dependency in after]
+        missing = [dependency for dependency in dependencies if dependency not in self._stages]
+        if missing:
+            raise ValueError(f'{name} depends on unregistered stages {missing}')
+
+        self._stages[name] = (function, dependencies)
+        return function
+
+    def _run_stage(self, name):
+        function = self._stages[name][0]
+        started = time()
+        try:
+            function()
+        finally:
+            self.timings[name] = (started, time())
+
+    def run(self):
+        # Runs every stage once its dependencies have finished. A stage that raises is reported and the
+        # stages depending on it are skipped; independent branches still run to completion.
+        # Returns the names of the stages that failed or were skipped.
+        pending = dict(self._stages)
+        done = set()
+        failed = set()
+        running = {}
+        run_start = time()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name, (function, dependencies) in list(pending.items()):
+                    if any(dependency in failed for dependency in dependencies):
+                        print(f'Stage {name} skipped: a stage it depends on did not complete')
+                        failed.add(name)
+                        del pending[name]
+                    elif all(dependency in done for dependency in dependencies):
+                        running[executor.submit(self._run_stage, name)] = name
+                        del pending[name]
+
+                if not running:
+                    if not pending:
+                        # Every remaining stage was skipped.
+                        break
+                    # Only reachable when the remaining stages wait on each other.
+                    raise ValueError(f'Circular stage dependencies between {sorted(pending)}')
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        print(f'Stage {name} failed: {future.exception()}')
+                        failed.add(name)
+                    else:
+                        done.add(name)
+
+        print(self.report(time() - run_start))
+        return failed
+
+    def critical_path(self):
+        # Longest chain of dependent stages by duration, i.e. the stages whose speed-up would shorten the run.
+        finish = {}
+        previous = {}
+        for name in self._stages:
+            self._path_finish(name, finish, previous)
+
+        if not finish:
+            return [], 0.0
+
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def _path_finish(self, name, finish, previous):
+        if name in finish:
+            return finish[name]
+
+        dependencies = [dependency for dependency in self._stages[name][1] if dependency in self.timings]
+        before = None
+        for dependency in dependencies:
+            if before is None or self._path_finish(dependency, finish, previous) > finish[before]:
+                before = dependency
+
+        started, ended = self.timings.get(name, (0.0, 0.0))
+        finish[name] = (finish[before] if before is not None else 0.0) + (ended - started)
+        previous[name] = before
+        return finish[name]
+
+    def report(self, wall_clock):
+        path, total = self.critical_path()
+        steps = ' -> '.join(f'{name} ({self.timings[name][1] - self.timings[name][0]:.2f}s)'
+                            for name in path if name in self.timings)
+        return f'Run completed in {wall_clock:.2f}s. Critical path ({total:.2f}s): {steps}'
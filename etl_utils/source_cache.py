@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import threading
+
+import pyarrow as pa
+
+# Columnar cache of parsed Excel sheets. Parsing an .xlsx with openpyxl costs far more than reading the
+# same rows from a columnar file, and the amazon/ebay workbooks are parsed again on every run (and by
+# both the initial and the incremental ebay loads) although they rarely change. Here the rows of a sheet
+# are written to Arrow IPC files while they are read the first time; later runs memory-map those files
+# and never open the workbook. The cached rows hold the very values openpyxl returned, so a read from the
+# cache gives the same DataFrames (values and dtypes) as a read from the workbook.
+#
+# Cached copies are named by the workbook's content hash, so copies of the same workbook under different
+# paths share one cached copy. A manifest maps every path to its last seen size, mtime and hash: while
+# size and mtime are unchanged the hash is not recomputed; when they change the file is re-hashed, and
+# only a different hash triggers a new conversion.
+#
+# The cache directory defaults to ~/.cache/etl_sources and can be moved with ETL_SOURCE_CACHE.
+
+CACHE_DIR = os.getenv('ETL_SOURCE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'etl_sources'))
+
+# Rows per Arrow file of a cached sheet; a miss holds at most this many rows besides the caller's chunk.
+BATCH_ROWS = 10000
+
+_lock = threading.Lock()
+
+
+def _content_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode(values):
+    # Arrow column for one batch of cell values that gives back exactly the values openpyxl returned. A batch
+    # holding one kind of value (numbers, text, dates, ...) is stored natively; one that mixes kinds (e.g. 5
+    # and 5.5, or numbers and text) is stored as pickled cells, so no value is widened to float or text.
+    kinds = {type(value) for value in values if value is not None}
+    if len(kinds) <= 1:
+        try:
+            return pa.array(values), False
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            pass
+    return pa.array([None if value is None else pickle.dumps(value) for value in values], pa.binary()), True
+
+
+def _decode(column, pickled):
+    values = column.to_pylist()
+    return [None if value is None else pickle.loads(value) for value in values] if pickled else values
+
+
+def _write_batch(path, rows, width):
+    # Rows shorter than the header (trailing empty cells) are padded, cells past the header are dropped.
+    fields, arrays = [], []
+    for position in range(width):
+        array, pickled = _encode([row[position] if position < len(row) else None for row in rows])
+        fields.append(pa.field(f'c{position}', array.type, metadata={'pickled': '1'} if pickled else None))
+        arrays.append(array)
+
+    schema = pa.schema(fields)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+
+
+def _read_batch(path):
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    columns = [_decode(column, bool(field.metadata and field.metadata.get(b'pickled')))
+               for column, field in zip(table.columns, table.schema)]
+    return zip(*columns)
+
+
+class SourceCache:
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.hits = 0
+        self.misses = 0
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        temporary = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(manifest, file, indent=1)
+        os.replace(temporary, self.manifest_path)
+
+    def fingerprint(self, file_path):
+        # Returns the workbook's content hash, re-reading the file only when its size or mtime changed.
+        path = os.path.abspath(file_path)
+        status = os.stat(path)
+
+        with _lock:
+            manifest = self._load_manifest()
+            entry = manifest.get(path)
+            if entry and entry['size'] == status.st_size and entry['mtime_ns'] == status.st_mtime_ns:
+                return entry['sha256']
+
+            sha256 = _content_hash(path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            manifest[path] = {'size': status.st_size, 'mtime_ns': status.st_mtime_ns, 'sha256': sha256}
+            self._save_manifest(manifest)
+            return sha256
+
+    def cache_path(self, file_path, sheet_name=None):
+        sheet = re.sub(r'[^\w-]', '_', sheet_name) if sheet_name is not None else 'active'
+        return os.path.join(self.cache_dir, f'{self.fingerprint(file_path)}-{sheet}')
+
+    def rows(self, file_path, sheet_name=None, parse=None):
+        # Yields the sheet's header, then its rows as tuples, like etl_utils.excel_stream._sheet_rows().
+        # On a miss 'parse()' is called for that generator and its rows are written to the cache while they
+        # are handed on; the copy is only kept when the caller read the whole sheet, so a preview that
+        # stops early (limit=5) reads no more of the workbook than without the cache.
+        path = self.cache_path(file_path, sheet_name)
+
+        if os.path.isdir(path):
+            self.hits += 1
+            with open(os.path.join(path, 'header.json')) as file:
+                yield json.load(file)
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.arrow'):
+                    yield from _read_batch(os.path.join(path, name))
+            return
+
+        self.misses += 1
+        rows = parse()
+        # Written under a temporary name and renamed, so a concurrent or interrupted run never sees half a copy.
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(temporary)
+        complete = False
+
+        try:
+            header = next(rows, [])
+            with open(os.path.join(temporary, 'header.json'), 'w') as file:
+                json.dump(header, file)
+            yield header
+
+            batch, written = [], 0
+            for row in rows:
+                yield row
+                batch.append(row)
+                if len(batch) >= BATCH_ROWS:
+                    _write_batch(os.path.join(temporary, f'{written:06d}.arrow'), batch, len(header))
+                    batch, written = [], written + 1
+            if batch:
+                _write_batch(os.path.join(temporary, f'{written:06d}.arrow'), batch, len(header))
+            complete = True
+
+        finally:
+            rows.close()
+            if complete:
+                try:
+                    os.replace(temporary, path)
+                except OSError:
+                    # Another run stored the same sheet first.
+                    pass
+            shutil.rmtree(temporary, ignore_errors=True)
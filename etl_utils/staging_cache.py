@@ -0,0 +1,77 @@
+import threading
+
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+# Run-scoped cache of the staging table. Instead of every dimension/fact stage running its own
+# pd.read_sql() on the full staging table, each stage declares the columns it needs up front and
+# the table is read once, projected to the union of those columns. Every stage then gets its own
+# DataFrame over the cached column arrays without copying them.
+
+
+class StagingCache:
+
+    def __init__(self, table_name, engine_url='postgresql:///Destination', where=None, engine=None):
+        # 'where' is an optional SQL predicate pushed down into the read e.g. "created_date = CURRENT_DATE",
+        # so rows a run will never use are not transferred at all.
+        # 'engine' is used instead of engine_url when given e.g. the pooled ConnectionManager.engine.
+        self.table_name = table_name
+        self.engine_url = engine_url
+        self.where = where
+        self.engine = engine
+        self._consumers = {}
+        self._served = set()
+        self._frame = None
+        self.read_count = 0
+        # Stages may run concurrently (see etl_utils.scheduler); the first reader loads the table while
+        # the others wait for it instead of issuing their own read.
+        self._lock = threading.Lock()
+
+    def declare(self, consumer, columns):
+        # Registers the columns a stage (consumer) will read. Must be called before the first read().
+        self._consumers[consumer] = list(columns)
+        return self._consumers[consumer]
+
+    def _pending_columns(self):
+        # Union of the columns needed by the stages that have not been served yet, in declaration order.
+        columns = []
+        for consumer, consumer_columns in self._consumers.items():
+            if consumer in self._served:
+                continue
+            columns += [column for column in consumer_columns if column not in columns]
+        return columns
+
+    def load(self, engine=None):
+        columns = self._pending_columns()
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        query = f'SELECT {column_list} FROM {self.table_name}'
+        if self.where is not None:
+            query += f' WHERE {self.where}'
+
+        if engine is None:
+            engine = self.engine if self.engine is not None else create_engine(self.engine_url)
+        with engine.connect() as connection:
+            self._frame = pd.read_sql(text(query), connection)
+
+        self.read_count += 1
+        return self._frame
+
+    def read(self, consumer, engine=None):
+        # Returns a DataFrame holding the consumer's declared columns. The frame is built from the
+        # cached Series with copy=False, so no column data is duplicated; stages that assign to a
+        # column replace it in their own frame only and never touch the cached arrays.
+        if consumer not in self._consumers:
+            raise KeyError(f'{consumer} has not declared its staging columns')
+
+        with self._lock:
+            if self._frame is None or any(column not in self._frame for column in self._consumers[consumer]):
+                self._served.discard(consumer)
+                self.load(engine)
+
+            self._served.add(consumer)
+            return pd.DataFrame({column: self._frame[column] for column in self._consumers[consumer]}, copy=False)
+
+    def invalidate(self):
+        # Drops the cached frame after the staging table has been modified (e.g. reloaded mid-run).
+        # The next read only fetches the columns of the stages that are still to run.
+        self._frame = None
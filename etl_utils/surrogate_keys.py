@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+# Run-scoped surrogate key resolution. Previously every pipeline added key columns to its staging table
+# and back-filled them with one UPDATE staging ... FROM dim per dimension, rewriting every staging row
+# several times. Here each dimension load hands its generated keys (from INSERT ... RETURNING, or fetched
+# by business key) to a SurrogateKeys map, and facts, bridges and dependent dimensions get their keys
+# with a vectorized hash lookup in memory. Staging is never updated in place.
+
+
+def _lookup_values(frame, columns):
+    # Builds the hashable lookup values for the business key columns: a plain Index for a single column,
+    # a MultiIndex otherwise.
+    if len(columns) == 1:
+        return pd.Index(frame[columns[0]])
+    return pd.MultiIndex.from_frame(frame[columns])
+
+
+def _as_text(values):
+    # Business keys can come back from Postgres with a different type than the frame holds them in
+    # (e.g. a year staged as a number but stored as TEXT in the dimension). Such pairs are compared as text.
+    return values.astype(object).map(str, na_action='ignore')
+
+
+class SurrogateKeys:
+
+    def __init__(self):
+        self._maps = {}
+
+    def register(self, dimension, keys, key_column, business_keys):
+        # Stores the keys of one dimension.
+        # keys:          DataFrame holding the key column and the business key columns, named as in the table
+        #                (e.g. the result of copy_returning()).
+        # business_keys: {frame column: table column} e.g. {'product_id': 'product_id', 'Director': 'director'};
+        #                frames passed to attach() are matched on the frame column names.
+        # When a business key occurs more than once (dimensions that are appended to on every run),
+        # the most recent key wins.
+        if keys is None:
+            raise ValueError(f'No keys to register for {dimension}: the dimension load returned none')
+        keys = keys.rename(columns={table: frame for frame, table in business_keys.items()})
+        keys = keys.sort_values(key_column).drop_duplicates(subset=list(business_keys), keep='last')
+
+        self._maps[dimension] = (list(business_keys), key_column, keys.reset_index(drop=True))
+        return len(keys)
+
+    def fetch(self, cursor, dimension, table_name, key_column, business_keys):
+        # Reads the keys of a dimension that was loaded without RETURNING (e.g. through to_sql) and registers them.
+        table_columns = list(business_keys.values())
+        cursor.execute(sql.SQL('SELECT {}, {} FROM {}').format(
+            sql.Identifier(key_column),
+            sql.SQL(', ').join(sql.Identifier(column) for column in table_columns),
+            sql.Identifier(*table_name.split('.'))))
+
+        keys = pd.DataFrame(cursor.fetchall(), columns=[key_column] + table_columns)
+        return self.register(dimension, keys, key_column, business_keys)
+
+    def attach(self, frame, dimension):
+        # Returns the frame with the dimension's key column added, looked up by the business key columns.
+        # Rows without a matching dimension row get a null key, as they did with UPDATE ... FROM.
+        if dimension not in self._maps:
+            raise KeyError(f'No surrogate keys registered for {dimension}')
+
+        columns, key_column, keys = self._maps[dimension]
+
+        left = frame[columns]
+        right = keys[columns]
+        if any(left[column].dtype != right[column].dtype for column in columns):
+            left = left.copy()
+            right = right.copy()
+            for column in columns:
+                if left[column].dtype != right[column].dtype:
+                    left[column] = _as_text(left[column])
+                    right[column] = _as_text(right[column])
+
+        positions = _lookup_values(right, columns).get_indexer(_lookup_values(left, columns))
+        found = positions >= 0
+
+        values = np.zeros(len(frame), dtype='int64')
+        values[found] = keys[key_column].to_numpy(dtype='int64')[positions[found]]
+        return frame.assign(**{key_column: pd.arrays.IntegerArray(values, ~found)})
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+
+# The shared etl_utils package lives at the repository root, one level above this folder.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pg_cursor():
+    # A cursor on a scratch Postgres transaction that is rolled back after the test. The server is found
+    # through the standard libpq variables (PGHOST, PGPORT, PGUSER, PGPASSWORD, PGDATABASE); tests that
+    # need it are skipped when no server is reachable.
+    try:
+        connection = psycopg2.connect('', connect_timeout=3)
+    except psycopg2.OperationalError as error:
+        pytest.skip(f'No Postgres server available: {error}')
+    try:
+        with connection.cursor() as cursor:
+            yield cursor
+    finally:
+        connection.rollback()
+        connection.close()
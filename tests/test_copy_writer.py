@@ -0,0 +1,145 @@
+import struct
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl_utils.copy_writer import (_encode_binary_chunk, _encode_text_chunk, copy_from_dataframe, copy_insert_missing,
+                                   copy_returning, copy_upsert, ensure_unique_index, has_unique_index,
+                                   resolve_columns)
+
+TYPES = {'id': 'integer', 'name': 'text', 'price': 'double precision', 'active': 'boolean', 'day': 'date',
+         'seen': 'timestamp without time zone'}
+
+
+def sales():
+    return pd.DataFrame({
+        'id': [1.0, 2.0, np.nan],
+        'name': ['tab\there', 'line\nbreak \\ ₹', None],
+        'price': [1.5, np.nan, -2.25],
+        'active': [True, False, None],
+        'day': [date(2024, 1, 31), None, date(1999, 12, 31)],
+        'seen': [datetime(2024, 1, 31, 12, 30, 15, 250), pd.NaT, datetime(2000, 1, 1)],
+    })
+
+
+def test_columns_resolve_case_insensitively():
+    frame = pd.DataFrame(columns=['Series_Title', 'Year'])
+    assert resolve_columns(frame, {'series_title': 'text', 'year': 'text'}) == {'Series_Title': 'series_title',
+                                                                                'Year': 'year'}
+    assert resolve_columns(frame, {'title': 'text'}, {'Series_Title': 'title'}) == {'Series_Title': 'title'}
+    with pytest.raises(ValueError):
+        resolve_columns(frame, {'series_title': 'text'})
+
+
+def test_text_rows_escape_and_mark_nulls():
+    frame = pd.DataFrame({'id': [1.0, np.nan], 'name': ['a\tb\\', None], 'active': [True, False]})
+    encoded = _encode_text_chunk(frame, {column: column for column in frame}, TYPES)
+    assert encoded == b'1\ta\\tb\\\\\tt\n\\N\t\\N\tf\n'
+
+
+def test_fractional_values_are_rejected_for_integer_columns():
+    with pytest.raises(ValueError):
+        _encode_text_chunk(pd.DataFrame({'id': [1.5]}), {'id': 'id'}, TYPES)
+
+
+def test_binary_rows_follow_the_wire_format():
+    frame = pd.DataFrame({'id': [7, None], 'name': ['₹', 'ab']}, dtype=object)
+    encoded = _encode_binary_chunk(frame, {'id': 'id', 'name': 'name'}, TYPES)
+    first = struct.pack('>hii', 2, 4, 7) + struct.pack('>i', 3) + '₹'.encode('utf-8')
+    second = struct.pack('>hi', 2, -1) + struct.pack('>i', 2) + b'ab'
+    assert encoded == first + second
+
+
+@pytest.fixture
+def dimension(pg_cursor):
+    pg_cursor.execute('CREATE TEMP TABLE dim_movie (movie_key serial PRIMARY KEY, title text, year int)')
+    return pg_cursor
+
+
+def movies(*rows):
+    return pd.DataFrame(list(rows), columns=['title', 'year'])
+
+
+def load(cursor, frame):
+    return copy_insert_missing(cursor, frame, 'dim_movie', ['title', 'year'],
+                               returning=['movie_key', 'title', 'year'])
+
+
+def table_rows(cursor):
+    cursor.execute('SELECT title, year FROM dim_movie ORDER BY movie_key')
+    return cursor.fetchall()
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_rerun_inserts_nothing_and_returns_every_key(dimension, indexed):
+    if indexed:
+        ensure_unique_index(dimension, 'dim_movie', ['title', 'year'])
+    assert has_unique_index(dimension, 'dim_movie', ['year', 'title']) == indexed
+
+    frame = movies(('Heat', 1995), ('Heat', None), (None, None), ('Alien', 1979), ('Heat', 1995))
+    inserted, skipped, keys = load(dimension, frame)
+    assert (inserted, skipped, len(keys)) == (4, 0, 4)
+
+    # Null business keys match the rows loaded before instead of being inserted again.
+    inserted, skipped, again = load(dimension, frame)
+    assert (inserted, skipped) == (0, 4)
+    assert sorted(again['movie_key']) == sorted(keys['movie_key'])
+    assert len(table_rows(dimension)) == 4
+
+
+def test_duplicated_table_falls_back_to_the_anti_join(dimension):
+    dimension.execute("INSERT INTO dim_movie (title, year) VALUES ('Heat', 1995), ('Heat', 1995)")
+    with pytest.raises(ValueError):
+        ensure_unique_index(dimension, 'dim_movie', ['title', 'year'])
+    assert not has_unique_index(dimension, 'dim_movie', ['title', 'year'])
+
+    inserted, skipped, keys = load(dimension, movies(('Heat', 1995), ('Alien', 1979)))
+    assert (inserted, skipped) == (1, 1)
+    # Both loaded copies of the duplicated key come back, next to the new row.
+    assert sorted(keys['title']) == ['Alien', 'Heat', 'Heat']
+    assert len(table_rows(dimension)) == 3
+
+
+@pytest.fixture
+def sales_table(pg_cursor):
+    pg_cursor.execute('''
+        CREATE TEMP TABLE sales (id integer, name text, price double precision, active boolean, day date,
+                                 seen timestamp)''')
+    return pg_cursor
+
+
+@pytest.mark.parametrize('copy_format', ['text', 'binary'])
+def test_rows_round_trip(sales_table, copy_format):
+    frame = sales()
+    assert copy_from_dataframe(sales_table, frame, 'sales', copy_format=copy_format, chunk_size=2) == 3
+    sales_table.execute('SELECT id, name, price, active, day, seen FROM sales')
+    assert sales_table.fetchall() == [
+        (1, 'tab\there', 1.5, True, date(2024, 1, 31), datetime(2024, 1, 31, 12, 30, 15, 250)),
+        (2, 'line\nbreak \\ ₹', None, False, None, None),
+        (None, None, -2.25, None, date(1999, 12, 31), datetime(2000, 1, 1)),
+    ]
+
+
+def test_empty_frames_and_unknown_formats(sales_table):
+    assert copy_from_dataframe(sales_table, sales().iloc[:0], 'sales') == 0
+    with pytest.raises(ValueError):
+        copy_from_dataframe(sales_table, sales(), 'sales', copy_format='csv')
+
+
+def test_upsert_updates_with_the_last_row_per_key(sales_table):
+    sales_table.execute('CREATE UNIQUE INDEX ON sales (id)')
+    sales_table.execute("INSERT INTO sales (id, name, price) VALUES (1, 'old', 1), (2, 'kept', 2)")
+    frame = pd.DataFrame({'id': [1, 3, 1], 'name': ['first', 'new', 'last'], 'price': [10.0, 30.0, 11.0]})
+    assert copy_upsert(sales_table, frame, 'sales', ['id'], extra_updates={'active': 'TRUE'}) == 2
+    sales_table.execute('SELECT id, name, price, active FROM sales ORDER BY id')
+    assert sales_table.fetchall() == [(1, 'last', 11.0, True), (2, 'kept', 2.0, None), (3, 'new', 30.0, None)]
+
+
+def test_returned_keys_follow_the_frame(pg_cursor):
+    pg_cursor.execute('CREATE TEMP TABLE dim_genre (genre_key serial PRIMARY KEY, genre text)')
+    frame = pd.DataFrame({'Genre': ['Drama', 'Crime', 'Action']})
+    keys = copy_returning(pg_cursor, frame, 'dim_genre', ['genre_key', 'genre'])
+    assert keys['genre'].tolist() == ['Drama', 'Crime', 'Action']
+    assert keys['genre_key'].is_monotonic_increasing
@@ -0,0 +1,116 @@
+import os
+from datetime import date, datetime
+
+import psycopg2
+import pytest
+
+from etl_utils.connections import ConnectionManager
+from etl_utils.db_copy import copy_query, copy_table
+
+pa = pytest.importorskip('pyarrow')
+pc = pytest.importorskip('pyarrow.compute')
+
+SCHEMA = f'test_db_copy_{os.getpid()}'
+
+MOVIES = [
+    (1, 'The Godfather', 9.2, True, date(1972, 3, 24), datetime(2024, 1, 31, 12, 30, 15, 250)),
+    (2, 'tab\there, line\nbreak "quoted" \\ ₹', None, False, None, None),
+    (3, '', 8.5, None, date(1999, 12, 31), datetime(2000, 1, 1)),
+    (4, None, -1.5, True, date(2008, 7, 18), None),
+]
+
+
+@pytest.fixture
+def databases(pg_cursor):
+    # Source and destination managers on the scratch server. COPY runs on two connections of its own, so the
+    # tables are committed, in a schema of their own that is dropped afterwards.
+    pg_cursor.execute('SELECT current_database()')
+    connection = {'host': os.getenv('PGHOST', 'localhost'), 'port': int(os.getenv('PGPORT', 5432)),
+                  'user': os.getenv('PGUSER'), 'password': os.getenv('PGPASSWORD')}
+    source = ConnectionManager(pg_cursor.fetchone()[0], pool_size=1, **connection)
+    destination = ConnectionManager(source.dbname, pool_size=1, **connection)
+    columns = 'id int, title text, rating double precision, seen boolean, released date, updated timestamp'
+    with source.cursor() as cursor:
+        cursor.execute(f'CREATE SCHEMA {SCHEMA}')
+        cursor.execute(f'CREATE TABLE {SCHEMA}.movies ({columns})')
+        cursor.execute(f'CREATE TABLE {SCHEMA}.stg_movies ({columns})')
+        cursor.executemany(f'INSERT INTO {SCHEMA}.movies VALUES (%s, %s, %s, %s, %s, %s)', MOVIES)
+    try:
+        yield source, destination
+    finally:
+        with source.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+        source.close()
+        destination.close()
+
+
+def rows(database, table, columns='*'):
+    with database.cursor() as cursor:
+        cursor.execute(f'SELECT {columns} FROM {SCHEMA}.{table} ORDER BY 1')
+        return cursor.fetchall()
+
+
+@pytest.mark.parametrize('copy_format', ['binary', 'text', 'csv'])
+def test_rows_round_trip(databases, copy_format):
+    source, destination = databases
+    copied = copy_table(source, destination, f'{SCHEMA}.movies', f'{SCHEMA}.stg_movies', copy_format=copy_format)
+    assert copied == len(MOVIES)
+    assert rows(destination, 'stg_movies') == MOVIES
+
+
+def test_where_and_params_are_pushed_to_the_source(databases):
+    source, destination = databases
+    copied = copy_table(source, destination, f'{SCHEMA}.movies', f'{SCHEMA}.stg_movies', columns=['id', 'title'],
+                        where='rating > %(rating)s', params={'rating': 0})
+    assert copied == 2
+    assert rows(destination, 'stg_movies', 'id, title, rating') == [(1, 'The Godfather', None), (3, '', None)]
+
+
+def test_text_lets_the_destination_convert_types(databases):
+    source, destination = databases
+    with destination.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {SCHEMA}.stg_titles (code text, released text)')
+    copy_query(source, destination, f'SELECT id, released FROM {SCHEMA}.movies', f'{SCHEMA}.stg_titles',
+               columns=['code', 'released'], copy_format='text')
+    assert rows(destination, 'stg_titles') == [('1', '1972-03-24'), ('2', None), ('3', '1999-12-31'),
+                                               ('4', '2008-07-18')]
+
+
+def test_transform_hook_runs_on_arrow_batches(databases):
+    source, destination = databases
+    with destination.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {SCHEMA}.stg_ratings (movie_id int, title text, rating_x10 int, released date)')
+    batches = []
+
+    def transform(batch):
+        batches.append(batch.schema)
+        rating = pc.cast(pc.multiply(batch.column('rating'), 10), pa.int32())
+        return pa.RecordBatch.from_arrays([batch.column('id'), batch.column('title'), rating, batch.column('released')],
+                                          names=['movie_id', 'title', 'rating_x10', 'released'])
+
+    copied = copy_query(source, destination, f'SELECT id, title, rating, released FROM {SCHEMA}.movies',
+                        f'{SCHEMA}.stg_ratings', transform=transform)
+    assert copied == len(MOVIES)
+    # Columns arrive with their own Arrow types; empty strings and nulls stay apart through the CSV round trip.
+    assert batches[0].types == [pa.int32(), pa.string(), pa.float64(), pa.date32()]
+    assert rows(destination, 'stg_ratings') == [(1, 'The Godfather', 92, date(1972, 3, 24)),
+                                                (2, MOVIES[1][1], None, None),
+                                                (3, '', 85, date(1999, 12, 31)),
+                                                (4, None, -15, date(2008, 7, 18))]
+
+
+def test_transform_on_an_empty_result(databases):
+    source, destination = databases
+    copied = copy_query(source, destination, f'SELECT id FROM {SCHEMA}.movies WHERE id < 0',
+                        f'{SCHEMA}.stg_movies', transform=lambda batch: batch)
+    assert copied == 0
+    assert rows(destination, 'stg_movies') == []
+
+
+def test_destination_errors_stop_the_transfer(databases):
+    source, destination = databases
+    with pytest.raises(psycopg2.Error):
+        copy_table(source, destination, f'{SCHEMA}.movies', f'{SCHEMA}.stg_movies', target_columns=['missing'] * 6)
+    with pytest.raises(ValueError):
+        copy_table(source, destination, f'{SCHEMA}.movies', f'{SCHEMA}.stg_movies', copy_format='parquet')
+    assert rows(destination, 'stg_movies') == []
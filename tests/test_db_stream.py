@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from etl_utils.db_stream import BatchDeduplicator, build_query
+
+
+def test_duplicates_are_dropped_across_batches():
+    first = pd.DataFrame({'user_id': ['u1', 'u2', 'u2'], 'rating': [4.0, 3.5, 3.5]})
+    second = pd.DataFrame({'user_id': ['u2', 'u3', 'u1'], 'rating': [3.5, 5.0, 4.0]})
+    deduplicate = BatchDeduplicator()
+    result = pd.concat([deduplicate(first), deduplicate(second)], ignore_index=True)
+    expected = pd.concat([first, second], ignore_index=True).drop_duplicates().reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_integer_and_float_batches_and_nulls_compare_equal():
+    deduplicate = BatchDeduplicator()
+    deduplicate(pd.DataFrame({'count': [3, 4], 'name': ['a', None]}))
+    later = deduplicate(pd.DataFrame({'count': [3.0, 4.0, np.nan], 'name': ['a', None, None]}))
+    assert later['count'].isna().tolist() == [True]
+
+
+def test_unchanged_batches_are_returned_as_is():
+    frame = pd.DataFrame({'id': [1, 2]})
+    assert BatchDeduplicator()(frame) is frame
+
+
+def test_build_query_pushes_the_predicate_down(pg_cursor):
+    query = build_query('public.source', ['id', 'name'], where='id > %(id)s', order_by=['id'], distinct=True)
+    assert query.as_string(pg_cursor) == ('SELECT DISTINCT "id", "name" FROM "public"."source" WHERE id > %(id)s '
+                                          'ORDER BY "id"')
+
+
+def test_build_query_selects_everything_by_default(pg_cursor):
+    assert build_query('source').as_string(pg_cursor) == 'SELECT * FROM "source"'
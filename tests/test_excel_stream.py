@@ -0,0 +1,87 @@
+import os
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from etl_utils import excel_stream
+from etl_utils.excel_stream import on_date, read_excel_chunks
+
+pytest.importorskip('pyarrow')
+from etl_utils import source_cache
+from etl_utils.source_cache import SourceCache
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    # Columns whose kinds change from row to row, the way hand-edited workbooks do: whole and fractional
+    # prices, numbers mixed with text, and a few empty cells.
+    book = Workbook()
+    sheet = book.active
+    sheet.append(['id', 'price', 'code', 'modified_date'])
+    for number in range(1, 31):
+        price = number * 10 if number % 7 else number + 0.5
+        code = number if number % 5 else f'X{number}'
+        modified = datetime(2024, 1, 1 + number % 3) if number % 11 else None
+        sheet.append([number, price, code, modified])
+    path = tmp_path / 'source.xlsx'
+    book.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'cache')
+    monkeypatch.setattr(excel_stream, 'SourceCache', lambda: SourceCache(directory))
+    # Small cache files, so a sheet spans several of them.
+    monkeypatch.setattr(source_cache, 'BATCH_ROWS', 7)
+    return directory
+
+
+def read(path, **options):
+    return list(read_excel_chunks(path, chunk_size=4, **options))
+
+
+def assert_same_chunks(result, expected):
+    assert len(result) == len(expected)
+    for chunk, expected_chunk in zip(result, expected):
+        pd.testing.assert_frame_equal(chunk, expected_chunk)
+
+
+def test_cached_reads_match_the_workbook(workbook, cache_dir):
+    filters = {'modified_date': on_date(date(2024, 1, 2))}
+    for options in ({}, {'columns': ['code', 'price']}, {'filters': filters}):
+        expected = read(workbook, cache=False, **options)
+        # The first read fills the cache, the second is served from it.
+        assert_same_chunks(read(workbook, **options), expected)
+        assert_same_chunks(read(workbook, **options), expected)
+
+
+def test_cache_keeps_the_values_of_mixed_columns(workbook, cache_dir):
+    read(workbook)
+    cached = pd.concat(read(workbook), ignore_index=True)
+    assert cached['code'].tolist()[3:5] == [4, 'X5']
+    assert cached['price'].tolist()[5:7] == [60, 7.5]
+
+
+def test_limit_stops_reading_and_leaves_no_partial_cache(workbook, cache_dir, monkeypatch):
+    read_rows = []
+    sheet_rows = excel_stream._sheet_rows
+
+    def counting(*arguments):
+        for row in sheet_rows(*arguments):
+            read_rows.append(row)
+            yield row
+
+    monkeypatch.setattr(excel_stream, '_sheet_rows', counting)
+    preview = read(workbook, limit=5)
+    assert sum(len(chunk) for chunk in preview) == 5
+    # The header, the five kept rows and the one row that showed the limit was reached.
+    assert len(read_rows) == 7
+    assert [name for name in os.listdir(cache_dir) if name != 'manifest.json'] == []
+
+
+def test_missing_columns_are_reported(workbook, cache_dir):
+    with pytest.raises(ValueError):
+        read(workbook, columns=['id', 'title'])
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from etl_utils.explode import parallel_explode, split_to_rows, stack_columns
+
+
+def reviews():
+    return pd.DataFrame({
+        'product_id': ['p1', 'p2', 'p3', 'p4'],
+        'user_id': ['u1,u2,u3', 'u4', 'u5,u6', None],
+        'review_id': ['r1,r2,r3', 'r4', 'r5', None],
+    }, index=[10, 11, 12, 13])
+
+
+def test_aligned_columns_explode_together():
+    exploded, rejects = parallel_explode(reviews(), ['user_id', 'review_id'])
+    assert exploded.index.tolist() == [10, 10, 10, 11, 13]
+    assert exploded['product_id'].tolist() == ['p1', 'p1', 'p1', 'p2', 'p4']
+    assert exploded['user_id'].tolist()[:4] == ['u1', 'u2', 'u3', 'u4']
+    assert exploded['review_id'].tolist()[:4] == ['r1', 'r2', 'r3', 'r4']
+    # A null cell stays a single null value, as with explode().
+    assert exploded[['user_id', 'review_id']].iloc[4].isna().all()
+    # p3 has two users but one review, so it cannot be paired up.
+    assert rejects.index.tolist() == [12]
+
+
+def test_single_column_matches_explode():
+    frame = reviews().drop(index=12)
+    exploded, rejects = parallel_explode(frame, ['user_id'])
+    expected = frame.assign(user_id=frame['user_id'].str.split(',')).explode('user_id')
+    pd.testing.assert_series_equal(exploded['user_id'], expected['user_id'])
+    assert rejects.empty
+
+
+def test_custom_delimiter_and_strip():
+    frame = pd.DataFrame({'names': ['a | b| c', ' d ']})
+    exploded, _ = parallel_explode(frame, ['names'], delimiter='|', strip=True)
+    assert exploded['names'].tolist() == ['a', 'b', 'c', 'd']
+
+
+def test_empty_frame():
+    exploded, rejects = parallel_explode(reviews().iloc[:0], ['user_id', 'review_id'])
+    assert exploded.empty and rejects.empty
+    assert list(exploded.columns) == ['product_id', 'user_id', 'review_id']
+
+
+def test_split_to_rows_keeps_only_the_keys():
+    movies = pd.DataFrame({'movie': ['m1', 'm2'], 'genre': ['Drama, Crime', 'Action'], 'overview': ['x', 'y']})
+    genres = split_to_rows(movies, ['movie'], 'genre', strip=True)
+    assert genres.to_dict('list') == {'movie': ['m1', 'm1', 'm2'], 'genre': ['Drama', 'Crime', 'Action']}
+
+
+def test_stack_columns_matches_melt():
+    movies = pd.DataFrame({'movie': ['m1', 'm2'], 'Star1': ['a', 'c'], 'Star2': ['b', np.nan]})
+    stacked = stack_columns(movies, ['movie'], ['Star1', 'Star2'], 'actor')
+    melted = movies.melt(id_vars=['movie'], value_vars=['Star1', 'Star2'], value_name='actor').drop(columns='variable')
+    pd.testing.assert_frame_equal(stacked, melted)
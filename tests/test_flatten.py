@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl_utils.fakestore_stub import make_carts, make_products, make_users
+from etl_utils.flatten import PRODUCTS, SALES, USERS, Flattener
+
+
+def normalized(records, flattener):
+    # What json_normalize gives for the flattener's columns, under the flattener's column names.
+    expected = pd.json_normalize(records).reindex(columns=flattener.columns)
+    return expected.set_axis(flattener.names, axis=1)
+
+
+def products():
+    records = make_products(6)
+    # Missing, null and non-object nested values, and a missing nested key, all give null columns.
+    del records[1]['rating']
+    records[2]['rating'] = None
+    records[3]['rating'] = 'n/a'
+    del records[4]['rating']['count']
+    del records[5]['title']
+    return records
+
+
+def users():
+    records = make_users(5)
+    del records[1]['address']['geolocation']
+    records[2]['address'] = None
+    del records[3]['name']
+    records[4]['name'] = {'firstname': 'kate'}
+    return records
+
+
+@pytest.mark.parametrize('records, flattener', [(make_products(20), PRODUCTS), (products(), PRODUCTS),
+                                                (make_users(20), USERS), (users(), USERS)])
+def test_objects_match_json_normalize(records, flattener):
+    pd.testing.assert_frame_equal(flattener.frame(records), normalized(records, flattener))
+
+
+def test_cart_lines_match_json_normalize():
+    carts = make_carts(20, products=10, users=5)
+    expected = pd.json_normalize(carts, record_path='products', meta=['id', 'userId', 'date', '__v'])
+    # Meta columns come back as objects from json_normalize.
+    expected = expected[['id', 'userId', 'date', '__v', 'productId', 'quantity']].infer_objects()
+    pd.testing.assert_frame_equal(SALES.frame(carts), expected)
+
+
+def test_empty_and_missing_arrays_keep_one_row():
+    carts = [{'id': 1, 'userId': 4, 'products': []},
+             {'id': 2, 'userId': 5},
+             {'id': 3, 'userId': 6, 'products': None},
+             {'id': 4, 'userId': 7, 'products': [{'productId': 10, 'quantity': 2}, 'broken', {'quantity': 1}]}]
+    sales = SALES.frame(carts)
+    assert sales['id'].tolist() == [1, 2, 3, 4, 4, 4]
+    # As with explode(), a cart without lines gives one row with null line columns.
+    assert sales['productId'].isna().tolist() == [True, True, True, False, True, True]
+    assert sales['quantity'].tolist()[3:] == pytest.approx([2, np.nan, 1], nan_ok=True)
+    assert sales['date'].isna().all()
+
+
+def test_dataframe_cells_and_numpy_arrays():
+    # Frames read from BigQuery hold the nested values in their cells, with arrays as numpy arrays.
+    carts = make_carts(5, products=10, users=5)
+    frame = pd.DataFrame(carts).assign(products=lambda df: [np.array(lines) for lines in df['products']])
+    pd.testing.assert_frame_equal(SALES.frame(frame), SALES.frame(carts))
+
+
+def test_keys_that_are_not_identifiers():
+    records = [{'class': 1, 'first name': 'ann', "o'brien": {'zip-code': '123', '2nd': None}, 'x': {'"': 'q'}},
+               {'class': 2, "o'brien": {'zip-code': '456'}, 'x': 3}]
+    flattener = Flattener(['class', 'first name', "o'brien.zip-code", "o'brien.2nd", 'x."'],
+                          rename={"o'brien.zip-code": 'zip'})
+    assert flattener.names == ['class', 'first name', 'zip', "o'brien.2nd", 'x."']
+    expected = pd.DataFrame({'class': [1, 2], 'first name': ['ann', None], 'zip': ['123', '456'],
+                             "o'brien.2nd": [None, None], 'x."': ['q', None]})
+    pd.testing.assert_frame_equal(flattener.frame(records), expected)
+
+
+def test_invalid_specs_are_rejected():
+    with pytest.raises(ValueError):
+        Flattener(['rating.rate', 'rate'], rename={'rating.rate': 'rate'})
+    with pytest.raises(ValueError):
+        Flattener(['id'], unnest='products')
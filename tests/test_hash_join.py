@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl_utils.hash_join import hash_join
+
+
+def sales(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'id': np.arange(rows), 'productId': rng.integers(1, 60, rows),
+                         'quantity': rng.integers(1, 10, rows)})
+
+
+def products(count=50):
+    return pd.DataFrame({'id': np.arange(1, count + 1), 'title': [f'Product {n}' for n in range(1, count + 1)],
+                         'price': np.arange(1, count + 1) * 1.5})
+
+
+def batches(frame, size):
+    return [frame.iloc[start:start + size] for start in range(0, len(frame), size)]
+
+
+def expected(probe, build, probe_key, build_key):
+    merged = probe.merge(build.rename(columns={build_key: '__key'}), left_on=probe_key, right_on='__key')
+    return merged.drop(columns=['__key'])
+
+
+def normalise(frame):
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+
+def collect(joined):
+    parts = list(joined)
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+
+def test_in_memory_join_matches_merge():
+    probe, build = sales(), products()
+    result = collect(hash_join(batches(probe, 300), build, 'productId', 'id'))
+    pd.testing.assert_frame_equal(normalise(result), normalise(expected(probe, build, 'productId', 'id')))
+
+
+def test_spilled_join_matches_in_memory_join(tmp_path):
+    probe, build = sales(), products()
+    in_memory = collect(hash_join(batches(probe, 300), batches(build, 10), 'productId', 'id'))
+    spilled = collect(hash_join(batches(probe, 300), batches(build, 10), 'productId', 'id', memory_limit=10,
+                                partitions=4, spill_dir=str(tmp_path)))
+    pd.testing.assert_frame_equal(normalise(spilled), normalise(in_memory))
+    # The spill directory is removed once the join is done.
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_duplicate_build_keys_give_one_row_per_match():
+    probe = pd.DataFrame({'key': [1, 2, 3], 'left': ['a', 'b', 'c']})
+    build = pd.DataFrame({'id': [1, 1, 2], 'right': ['x', 'y', 'z']})
+    result = collect(hash_join(probe, build, 'key', 'id'))
+    assert sorted(zip(result['left'], result['right'])) == [('a', 'x'), ('a', 'y'), ('b', 'z')]
+
+
+def test_null_keys_match_nothing():
+    probe = pd.DataFrame({'key': [1.0, np.nan], 'left': ['a', 'b']})
+    build = pd.DataFrame({'id': [1.0, np.nan], 'right': ['x', 'y']})
+    result = collect(hash_join(probe, build, 'key', 'id'))
+    assert result[['left', 'right']].values.tolist() == [['a', 'x']]
+
+
+def test_overlapping_columns_are_rejected():
+    probe = pd.DataFrame({'key': [1], 'title': ['a']})
+    build = pd.DataFrame({'id': [1], 'title': ['b']})
+    with pytest.raises(ValueError):
+        collect(hash_join(probe, build, 'key', 'id'))
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from etl_utils.api_fetch import fetch_json
+from etl_utils.http_cache import ResponseCache, canonical_url
+from etl_utils.scheduler import StageScheduler
+
+URL = 'https://fakestoreapi.com/products?limit=5&sort=asc'
+PRODUCTS = [{'id': 1, 'title': 'Backpack', 'rating': {'rate': 3.9, 'count': 120}}]
+
+
+class FakeResponse:
+
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = body
+        self.content = self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self._body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(f'HTTP {self.status}')
+
+
+class FakeSession:
+    # Stands in for the aiohttp session: answers every URL with its current payload and validators, and
+    # with 304 when the request's validators still match, as fakestore_stub does. Records the request headers.
+
+    def __init__(self, payload=PRODUCTS, etag='"v1"', last_modified=None):
+        self.requests = []
+        self.serve(payload, etag, last_modified)
+
+    def serve(self, payload, etag='"v1"', last_modified=None):
+        self.body = json.dumps(payload).encode('utf-8')
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def get(self, url, headers=None):
+        headers = dict(headers or {})
+        self.requests.append(headers)
+        if self.etag is not None and headers.get('If-None-Match') == self.etag:
+            return FakeResponse(304, headers={'ETag': self.etag})
+        if self.etag is None and self.last_modified and headers.get('If-Modified-Since') == self.last_modified:
+            return FakeResponse(304)
+        validators = {'ETag': self.etag, 'Last-Modified': self.last_modified}
+        return FakeResponse(200, self.body, {name: value for name, value in validators.items() if value})
+
+
+def fetch(session, cache, parse=True):
+    stats = {'requests': 0, 'bytes': 0, 'retries': 0, 'cached': 0}
+
+    async def run():
+        return await fetch_json(session, URL, asyncio.Semaphore(1), stats=stats, cache=cache, parse=parse)
+
+    return asyncio.run(run()), stats
+
+
+def test_etag_revalidation_reuses_the_cached_body(tmp_path):
+    cache, session = ResponseCache(str(tmp_path), ttl=0), FakeSession()
+    assert fetch(session, cache)[0] == PRODUCTS
+    assert cache.status[URL] == 'new'
+
+    payload, stats = fetch(session, cache)
+    assert payload == PRODUCTS
+    assert session.requests[1]['If-None-Match'] == '"v1"'
+    assert cache.status[URL] == 'not_modified'
+    assert (stats['requests'], stats['cached'], stats['bytes']) == (1, 1, 0)
+
+
+def test_last_modified_revalidation(tmp_path):
+    modified = 'Wed, 14 Oct 2026 08:00:00 GMT'
+    cache, session = ResponseCache(str(tmp_path), ttl=0), FakeSession(etag=None, last_modified=modified)
+    fetch(session, cache)
+    assert fetch(session, cache)[0] == PRODUCTS
+    assert session.requests[1] == {'If-Modified-Since': modified}
+    assert cache.status[URL] == 'not_modified'
+
+
+def test_full_answers_are_compared_by_content(tmp_path):
+    cache, session = ResponseCache(str(tmp_path), ttl=0), FakeSession(etag=None)
+    fetch(session, cache)
+    old_body = cache.path(URL)
+    # Without validators the server answers in full; the same content is recognised as unchanged.
+    fetch(session, cache)
+    assert cache.status[URL] == 'unchanged'
+
+    session.serve(PRODUCTS * 2, etag=None)
+    assert fetch(session, cache)[0] == PRODUCTS * 2
+    assert cache.status[URL] == 'changed'
+    assert not os.path.exists(old_body)
+
+
+def test_fresh_payloads_are_served_without_a_request(tmp_path):
+    cache, session = ResponseCache(str(tmp_path), ttl=3600), FakeSession()
+    fetch(session, cache)
+    payload, stats = fetch(session, cache)
+    assert payload == PRODUCTS and len(session.requests) == 1
+    assert cache.status[URL] == 'fresh' and stats['cached'] == 1
+
+
+def test_streamed_bodies_are_cached_files(tmp_path):
+    cache, session = ResponseCache(str(tmp_path), ttl=0), FakeSession()
+    path, _ = fetch(session, cache, parse=False)
+    with open(path, 'rb') as file:
+        assert file.read() == session.body
+    # A 304 gives the same cached file.
+    assert fetch(session, cache, parse=False)[0] == path
+
+
+def test_needs_load_follows_the_loaded_versions(tmp_path):
+    cache, session = ResponseCache(str(tmp_path), ttl=0), FakeSession()
+    assert cache.needs_load([URL], 'homework')
+    fetch(session, cache)
+    assert cache.needs_load([URL], 'homework')
+    cache.mark_loaded([URL], 'homework')
+    assert not cache.needs_load([URL], 'homework')
+    # Loads are recorded per consumer, by canonical URL, and kept in the manifest.
+    assert cache.needs_load([URL], 'bigquery')
+    reopened = ResponseCache(str(tmp_path), ttl=0)
+    assert not reopened.needs_load(['https://FAKESTOREAPI.com/products?sort=asc&limit=5'], 'homework')
+
+    session.serve(PRODUCTS * 2, etag='"v2"')
+    fetch(session, reopened)
+    assert reopened.needs_load([URL], 'homework')
+
+
+def test_versions_of_other_sources(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    blob = 'gs://my-dw-bucket-02/bq_source_data_04.json'
+    cache.mark_loaded([blob], 'bigquery', versions={blob: 'md5-1'})
+    assert not cache.needs_load([blob], 'bigquery', versions={blob: 'md5-1'})
+    assert cache.needs_load([blob], 'bigquery', versions={blob: 'md5-2'})
+    assert canonical_url(blob) in cache._manifest['loaded']['bigquery']
+
+
+@pytest.mark.parametrize('fails', [True, False])
+def test_payloads_are_marked_loaded_only_when_every_stage_succeeded(tmp_path, fails):
+    cache = ResponseCache(str(tmp_path), ttl=0)
+    fetch(FakeSession(), cache)
+
+    def staging():
+        pass
+
+    def load_fact():
+        if fails:
+            raise RuntimeError('COPY failed')
+
+    # As in '04 ETL - API to DB/03 homework.py': the scheduler returns the stages that failed or were skipped.
+    scheduler = StageScheduler(max_workers=2)
+    scheduler.add(staging)
+    scheduler.add(load_fact, after=[staging])
+    if cache.needs_load([URL], 'homework') and not scheduler.run():
+        cache.mark_loaded([URL], 'homework')
+    assert cache.needs_load([URL], 'homework') == fails
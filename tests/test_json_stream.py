@@ -0,0 +1,64 @@
+import io
+import json
+
+import pytest
+
+from etl_utils.json_stream import iter_array, iter_json_file, iter_record_batches, write_json_array, write_ndjson
+
+RECORDS = [
+    {'id': 1, 'title': 'Café ₹ "quoted"', 'price': 109.95, 'rating': {'rate': 3.9, 'count': 120}},
+    {'id': 22, 'title': None, 'price': -1e-3, 'tags': ['a', 'b'], 'nested': [[], {}]},
+    12345,
+    'text',
+    [],
+]
+
+
+def split(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1 << 16])
+def test_records_match_json_loads_for_any_chunking(size):
+    # Chunks of one byte split multi-byte characters and numbers between chunks.
+    payload = json.dumps(RECORDS, indent=2, ensure_ascii=False).encode('utf-8')
+    assert list(iter_array(split(payload, size))) == json.loads(payload)
+
+
+def test_text_chunks_are_accepted():
+    assert list(iter_array(['[1, 2', '3, {"a"', ': 4}]'])) == [1, 23, {'a': 4}]
+
+
+def test_empty_array():
+    assert list(iter_array([b' [ ] '])) == []
+
+
+@pytest.mark.parametrize('payload', [b'{"a": 1}', b'[1, 2', b'[1, 2,]', b'[1 2]', b'[1] [2]', b'[1, {"a": }]'])
+def test_malformed_payloads_are_rejected(payload):
+    with pytest.raises(ValueError):
+        list(iter_array(split(payload, 2)))
+
+
+def test_record_batches_are_bounded():
+    payload = json.dumps(list(range(12))).encode()
+    assert list(iter_record_batches(split(payload, 5), batch_size=5)) == [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11]]
+
+
+def test_json_file(tmp_path):
+    path = tmp_path / 'payload.json'
+    path.write_text(json.dumps(RECORDS), encoding='utf-8')
+    assert [record for batch in iter_json_file(str(path), batch_size=2, chunk_size=5) for record in batch] == RECORDS
+
+
+@pytest.mark.parametrize('indent', [None, 4])
+@pytest.mark.parametrize('records', [RECORDS, []])
+def test_written_array_matches_json_dump(indent, records):
+    file = io.StringIO()
+    assert write_json_array(file, [records[:2], records[2:]], indent=indent) == len(records)
+    assert file.getvalue() == json.dumps(records, indent=indent)
+
+
+def test_ndjson_has_one_record_per_line():
+    file = io.StringIO()
+    assert write_ndjson(file, [RECORDS[:1], RECORDS[1:]]) == len(RECORDS)
+    assert [json.loads(line) for line in file.getvalue().split('\n')] == RECORDS
@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+
+import pandas as pd
+import pytest
+
+from etl_utils.masking import REDACTED, Masker
+
+
+def users():
+    return pd.DataFrame({
+        'email': ['ann@example.com', 'bob@example.com', None, 'ann@example.com'],
+        'phone': ['1-570-236-7033', '1-765-789-6734', '1-570-236-7033', None],
+        'password': ['secret', None, 'hunter2', 'secret'],
+        'city': ['kilcoole', 'Cullman', 'San Antonio', 'kilcoole'],
+        'zipcode': ['12926-3874', '29567-1452', '78234-1234', None],
+    })
+
+
+def masker(**options):
+    policy = {'email': 'token', 'phone': 'format', 'password': 'redact', 'city': 'keep',
+              'zipcode': {'method': 'bucket', 'buckets': 16}}
+    return Masker(policy, key='test-key', **options)
+
+
+def test_tokens_are_keyed_hmacs():
+    masked = masker().apply(users())
+    expected = 'tok_' + hmac.new(b'test-key', b'email\x00ann@example.com', hashlib.sha256).hexdigest()[:16]
+    assert masked['email'][0] == expected
+    # The same value always gives the same token, so masked columns still join; nulls stay null.
+    assert masked['email'][3] == expected
+    assert masked['email'][1] != expected
+    assert masked['email'][2] is None
+
+
+def test_tokens_depend_on_key_and_domain():
+    other_key = Masker({'email': 'token'}, key='another-key').token('ann@example.com', 'email')
+    other_domain = Masker({'email': {'method': 'token', 'domain': 'customer'}}, key='test-key')
+    assert other_key != masker().token('ann@example.com', 'email')
+    assert other_domain.token('ann@example.com', 'email') != masker().token('ann@example.com', 'email')
+
+
+def test_format_keeps_the_shape():
+    masked = masker().apply(users())['phone']
+    assert masked[0] == masked[2]
+    assert masked[3] is None
+    for original, value in zip(users()['phone'][:3], masked[:3]):
+        assert value != original
+        assert [character.isdigit() for character in value] == [character.isdigit() for character in original]
+        assert [character for character in value if not character.isdigit()] == ['-', '-', '-']
+
+
+def test_redact_keep_and_bucket():
+    masked = masker().apply(users())
+    assert masked['password'].tolist()[::2] == [REDACTED, REDACTED]
+    assert masked['password'].isna().tolist() == [False, True, False, False]
+    pd.testing.assert_series_equal(masked['city'], users()['city'])
+    assert masked['zipcode'].dtype == 'Int64'
+    assert masked['zipcode'][:3].between(0, 15).all()
+    assert masked['zipcode'].isna().tolist() == [False, False, False, True]
+
+
+def test_missing_key_falls_back_to_redact(monkeypatch):
+    monkeypatch.delenv('PII_TOKEN_KEY', raising=False)
+    masked = Masker({'email': 'token', 'phone': 'format'}).apply(users())
+    assert masked['email'].where(masked['email'].notna(), None).tolist() == [REDACTED, REDACTED, None, REDACTED]
+    assert masked['phone'][0] == REDACTED
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        Masker({'email': 'hash'}, key='test-key')
+
+
+def test_other_columns_and_the_input_are_untouched():
+    frame = users()
+    masked = Masker({'email': 'token', 'missing': 'token'}, key='test-key').apply(frame)
+    pd.testing.assert_frame_equal(frame, users())
+    pd.testing.assert_frame_equal(masked.drop(columns='email'), frame.drop(columns='email'))
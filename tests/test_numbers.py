@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl_utils import numbers
+from etl_utils.numbers import parse_numbers, parse_numeric_columns
+
+
+@pytest.fixture(params=['arrow', 'python'])
+def parser(request, monkeypatch):
+    # Both implementations must agree; the Python one is what runs without pyarrow.
+    if request.param == 'arrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(numbers, 'pa', None)
+    return parse_numbers
+
+
+def test_currency_and_separators_are_dropped(parser):
+    values, unparseable = parser(pd.Series(['₹1,099', '$ 28,341,469', '€0.5', '-3', '1e3']))
+    assert values.tolist() == [1099.0, 28341469.0, 0.5, -3.0, 1000.0]
+    assert not unparseable.any()
+
+
+def test_blank_cells_are_null_but_not_failures(parser):
+    values, unparseable = parser(pd.Series(['', '  ', None, '\xa0']))
+    assert values.isna().all()
+    assert not unparseable.any()
+
+
+def test_text_and_symbol_only_cells_are_failures(parser):
+    values, unparseable = parser(pd.Series(['₹', 'abc', ',', '₹ ,', '1.2.3', '₹12']))
+    assert values.isna().tolist() == [True, True, True, True, True, False]
+    assert unparseable.tolist() == [True, True, True, True, True, False]
+
+
+def test_other_locales(parser):
+    values, unparseable = parser(pd.Series(['1.234,5', '€ 7,25']), thousands='.', decimal=',')
+    assert values.tolist() == [1234.5, 7.25]
+    assert not unparseable.any()
+
+
+def test_integer_output_rejects_fractions(parser):
+    values, unparseable = parser(pd.Series(['1,000', '2.5', None], index=[7, 8, 9]), dtype='Int64')
+    assert values.dtype == 'Int64'
+    assert values.index.tolist() == [7, 8, 9]
+    assert values.isna().tolist() == [False, True, True]
+    assert values[7] == 1000
+    assert unparseable.tolist() == [False, True, False]
+
+
+def test_numeric_columns_pass_through():
+    values, unparseable = parse_numbers(pd.Series([1, 2.5, np.nan]))
+    assert values.tolist()[:2] == [1.0, 2.5]
+    assert not unparseable.any()
+
+
+def test_rejected_rows_are_returned_and_their_cells_nulled():
+    frame = pd.DataFrame({'price': ['₹10', '₹', '₹30'], 'count': ['1', '2', 'x']})
+    parsed, rejects = parse_numeric_columns(frame, ['price', 'count'])
+    assert parsed['price'].tolist()[::2] == [10.0, 30.0]
+    assert parsed['count'].isna().tolist() == [False, False, True]
+    assert rejects.index.tolist() == [1, 2]
@@ -0,0 +1,44 @@
+import multiprocessing
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import sqlalchemy.exc
+
+from etl_utils import order_queue
+
+
+class FlakyDatabase:
+    # Stands in for ConnectionManager: every checkout takes the next outcome, an exception to raise or the
+    # number of orders process_order_queue() reports.
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.closed = False
+
+    @contextmanager
+    def cursor(self):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        yield outcome
+
+    def close(self):
+        self.closed = True
+
+
+def test_worker_retries_after_connection_errors(monkeypatch):
+    refused = sqlalchemy.exc.OperationalError('connect', {}, psycopg2.OperationalError('connection refused'))
+    database = FlakyDatabase([refused, psycopg2.OperationalError('server closed the connection'), 3, 0])
+    sleeps = []
+    monkeypatch.setattr(order_queue, 'ConnectionManager', lambda *args, **kwargs: database)
+    monkeypatch.setattr(order_queue, 'process_batch', lambda cursor, batch_size: cursor)
+    monkeypatch.setattr(order_queue, 'sleep', sleeps.append)
+    monkeypatch.setattr(order_queue.signal, 'signal', lambda *args: None)
+
+    # 'stop' is already set: the worker still retries the failed batches and only stops on an empty queue.
+    stop, processed = threading.Event(), multiprocessing.Value('q', 0)
+    stop.set()
+    order_queue._work('Destination', {}, 100, 0.5, stop, processed)
+    assert processed.value == 3
+    assert sleeps == [0.5, 0.5]
+    assert database.outcomes == [] and database.closed
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from etl_utils.profiler import DistinctCounter, HyperLogLog, _bit_length, main, profile_batches
+
+GENRES = ['Drama', 'Crime', 'Action', 'Comedy', 'Adventure', 'Thriller']
+
+
+def movies(rows=600, seed=0):
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1950, 2020, rows)
+    return pd.DataFrame({
+        'Series_Title': [f'Movie {number % 300}' for number in range(rows)],
+        'Released_Year': years.astype(str),
+        'Runtime': [f'{minutes} min' for minutes in rng.integers(80, 200, rows)],
+        'Genre': [', '.join(rng.choice(GENRES, rng.integers(1, 4), replace=False)) for _ in range(rows)],
+        'IMDB_Rating': rng.integers(70, 95, rows) / 10,
+        'Overview': [f'A story number {number}, told in words {number * 7}.' for number in range(rows)],
+        'Gross': [f'{amount:,}' if amount % 5 else '' for amount in rng.integers(10000, 9000000, rows)],
+        'Star1': [f'Actor {number}' for number in rng.integers(0, 90, rows)],
+        'Star2': [f'Actor {number}' for number in rng.integers(0, 90, rows)],
+        'Released': pd.Timestamp('2000-01-01') + pd.to_timedelta(rng.integers(0, 5000, rows), unit='D'),
+    })
+
+
+def profile(frame, size=128, **options):
+    return profile_batches([frame.iloc[start:start + size] for start in range(0, len(frame), size)], **options)
+
+
+def test_bit_length_is_exact():
+    values = np.array([0, 1, 2, 3, (1 << 32) - 1, 1 << 32, (1 << 53) + 1, (1 << 64) - 1], dtype=np.uint64)
+    assert _bit_length(values).tolist() == [int(value).bit_length() for value in values]
+
+
+@pytest.mark.parametrize('distinct', [50, 5000, 200000])
+def test_hyperloglog_estimate(distinct):
+    sketch = HyperLogLog()
+    hashes = pd.util.hash_array(np.arange(distinct))
+    sketch.add(hashes)
+    sketch.add(hashes[:distinct // 2])
+    assert abs(sketch.count() - distinct) <= 0.03 * distinct
+
+
+def test_hyperloglog_merge_equals_one_sketch():
+    hashes = pd.util.hash_array(np.arange(10000))
+    whole, first, second = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    whole.add(hashes)
+    first.add(hashes[:6000])
+    second.add(hashes[4000:])
+    first.merge(second)
+    assert first.count() == whole.count()
+
+
+def test_distinct_counter_switches_to_the_sketch():
+    counter = DistinctCounter(exact_limit=1000)
+    counter.add(pd.util.hash_array(np.arange(800)))
+    assert counter.exact and counter.count() == 800
+    counter.add(pd.util.hash_array(np.arange(400, 3000)))
+    assert not counter.exact
+    assert abs(counter.count() - 3000) <= 0.03 * 3000
+
+
+def test_types_nulls_and_distinct_values():
+    profiler = profile(movies())
+    assert profiler.rows == 600
+    assert profiler.schema() == {
+        'Series_Title': 'string', 'Released_Year': 'Int64', 'Runtime': 'string', 'Genre': 'string',
+        'IMDB_Rating': 'float', 'Overview': 'string', 'Gross': 'Int64', 'Star1': 'string', 'Star2': 'string',
+        'Released': 'datetime',
+    }
+    report = profiler.report()
+    # Blank Gross cells count as null.
+    assert report.loc['Gross', 'null_rate'] == pytest.approx((movies()['Gross'] == '').mean(), abs=1e-4)
+    assert report.loc['Series_Title', 'distinct'] == 300
+    assert report.loc['Series_Title', 'exact']
+
+
+def test_packed_repeated_and_key_columns():
+    frame = movies()
+    frame['Movie_Id'] = np.arange(len(frame))
+    profiler = profile(frame)
+    # Genre repeats a few pieces; Overview has commas too, but its pieces are prose.
+    assert profiler.packed_columns() == {'Genre': ','}
+    assert profiler.repeated_columns() == {'Star': ['Star1', 'Star2']}
+    keys = profiler.business_keys()
+    assert ('Movie_Id',) in keys and ('Overview',) in keys
+    assert ('Series_Title',) not in keys
+
+
+def test_composite_keys():
+    frame = pd.DataFrame({'title': [f't{number % 50}' for number in range(200)],
+                          'year': [str(1990 + number // 50) for number in range(200)],
+                          'rating': np.arange(200) % 5})
+    assert profile(frame, size=64).business_keys() == [('title', 'year')]
+
+
+def test_reservoir_sample_is_bounded_and_drawn_from_the_rows():
+    frame = movies(rows=2000)
+    profiler = profile(frame, size=300, sample_size=100)
+    assert len(profiler.sample) == 100
+    assert profiler.sample['Overview'].isin(frame['Overview']).all()
+    # Rows of later batches get into the sample too.
+    assert profiler.sample['Overview'].isin(frame['Overview'][1000:]).any()
+
+
+def test_command_line_on_a_csv_file(tmp_path, capsys):
+    path = tmp_path / 'movies.csv'
+    movies().drop(columns='Released').to_csv(path, index=False)
+    schema_path = tmp_path / 'schema.json'
+    main(['--file', str(path), '--batch-size', '100', '--schema-out', str(schema_path)])
+    assert '600 rows, 9 columns' in capsys.readouterr().out
+    assert json.loads(schema_path.read_text())['IMDB_Rating'] == 'float'
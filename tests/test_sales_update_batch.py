@@ -0,0 +1,77 @@
+import os
+import re
+
+import pytest
+
+SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '04 ETL - API to DB',
+                        '04 homework.sql')
+
+SOLD = 'Sale successfully completed'
+SHORT = 'Insufficient quantity'
+
+
+def batch_function():
+    # The function of the homework script, created on temp tables of the same names instead of the homework schema.
+    with open(SQL_PATH, encoding='utf-8') as file:
+        text = file.read()
+    function = re.search(r'CREATE OR REPLACE FUNCTION sales_update_batch\(.*?\n\$\$;', text, re.S).group(0)
+    function = function.replace('FUNCTION sales_update_batch', 'FUNCTION pg_temp.sales_update_batch')
+    return function.replace('homework.', 'pg_temp.')
+
+
+@pytest.fixture
+def homework(pg_cursor):
+    pg_cursor.execute('''
+        CREATE TEMP TABLE dim_product (product_key serial PRIMARY KEY, product_id int);
+        CREATE TEMP TABLE dim_user (user_key serial PRIMARY KEY, user_id int UNIQUE);
+        CREATE TEMP TABLE dim_date (date_key serial PRIMARY KEY, sale_date date, month int, year int);
+        CREATE TEMP TABLE sale_fact_table (sale_key serial PRIMARY KEY, sale_id int, product_key int, user_key int,
+                                           date_key int, price float, quantity int, total_sale float, stock int);
+        CREATE TEMP TABLE product_inventory (product_key int PRIMARY KEY, stock int NOT NULL, price float,
+                                             updated_at timestamp NOT NULL DEFAULT now());
+        INSERT INTO dim_product (product_id) VALUES (101), (102);
+        INSERT INTO dim_user (user_id) VALUES (1);
+        INSERT INTO product_inventory (product_key, stock, price) VALUES (1, 5, 2.5), (2, 3, 10);''')
+    pg_cursor.execute(batch_function())
+    return pg_cursor
+
+
+def sell(cursor, products, quantities, first_sale=1):
+    sale_ids = list(range(first_sale, first_sale + len(products)))
+    cursor.execute('SELECT * FROM pg_temp.sales_update_batch(%s, %s, %s, %s)',
+                   (sale_ids, [1] * len(products), products, quantities))
+    return cursor.fetchall()
+
+
+def state(cursor):
+    cursor.execute('SELECT product_key, stock FROM product_inventory ORDER BY product_key')
+    inventory = cursor.fetchall()
+    cursor.execute('SELECT sale_id, product_key, quantity, total_sale, stock FROM sale_fact_table ORDER BY sale_id')
+    return inventory, cursor.fetchall()
+
+
+def test_a_smaller_order_fits_after_a_rejected_one(homework):
+    assert sell(homework, [101, 101], [10, 1]) == [(1, SHORT, 5), (2, SOLD, 4)]
+    assert state(homework) == ([(1, 4), (2, 3)], [(2, 1, 1, 2.5, 4)])
+
+
+def test_unknown_products_and_invalid_quantities(homework):
+    assert sell(homework, [999, 101, 101, 102], [1, 0, None, 3]) == [
+        (1, 'Unknown product', None), (2, 'Invalid quantity', 5), (3, 'Invalid quantity', 5), (4, SOLD, 0)]
+    assert state(homework) == ([(1, 5), (2, 0)], [(4, 2, 3, 30.0, 0)])
+
+
+def test_a_batch_matches_one_order_per_call(homework):
+    # Orders for both products are interleaved, with rejects in between accepted orders.
+    products = [101, 102, 101, 101, 102, 101, 102, 101]
+    quantities = [2, 4, 4, 1, 2, 3, 1, 2]
+    batch = sell(homework, products, quantities)
+    after_batch = state(homework)
+
+    homework.execute('TRUNCATE sale_fact_table')
+    homework.execute('UPDATE product_inventory SET stock = CASE product_key WHEN 1 THEN 5 ELSE 3 END')
+    single = [row for sale_id, (product, quantity) in enumerate(zip(products, quantities), 1)
+              for row in sell(homework, [product], [quantity], first_sale=sale_id)]
+    assert batch == single
+    assert state(homework) == after_batch
+    assert [status for _, status, _ in batch] == [SOLD, SHORT, SHORT, SOLD, SOLD, SHORT, SOLD, SOLD]